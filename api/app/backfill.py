@@ -0,0 +1,107 @@
+"""
+Backfills articles from the Diffbot Knowledge Graph.
+
+Fetches articles page by page, splits and embeds them and extracts their
+graph documents with the same pipeline as the API. The bulk writer saves
+them as CSV files for `neo4j-admin database import full`, which is far
+faster than the transactional import queries for initial loads:
+
+    python backfill.py --tag "Artificial intelligence" --size 100000 --output import
+    import/import.sh  # with the database stopped, then start it
+    python startup.py  # creates the indexes, including the vector index
+
+Incremental updates after the backfill go through the API or this script
+with `--writer transactional`, which runs the same import queries as the API.
+Importing into an existing database needs `--overwrite-destination`.
+Articles of a tenant are written to its database with `--tenant`.
+"""
+
+import argparse
+import asyncio
+import logging
+from typing import Dict, List
+
+from bulk_import import BulkImportWriter
+from importing import aget_articles, aprocess_params
+from langchain_community.graphs.graph_document import GraphDocument
+from processing import aprocess_document, astore_articles, store_graph_documents
+from tenants import DEFAULT_TENANT, current_tenant, use_tenant
+from utils import gather_with_limit
+
+# Concurrent requests to Diffbot API
+MAX_WORKERS = 20
+
+
+class TransactionalWriter:
+    """
+    Writes batches with the import queries of the API
+    """
+
+    # Chunks stored with their embedding keep it, as with the API
+    reuse_existing = True
+
+    async def aadd(self, params: List[Dict], graph_documents: List[GraphDocument]):
+        await astore_articles(params)
+        await asyncio.to_thread(store_graph_documents, graph_documents)
+        return len(params)
+
+    def close(self) -> None:
+        pass
+
+
+class BulkWriter:
+    """
+    Writes batches to bulk import files
+    """
+
+    # The files replace the database, so every chunk needs its embedding and
+    # the backfill runs without a database
+    reuse_existing = False
+
+    def __init__(self, directory: str):
+        self._writer = BulkImportWriter(directory)
+
+    async def aadd(self, params: List[Dict], graph_documents: List[GraphDocument]):
+        return await asyncio.to_thread(self._writer.add, params, graph_documents)
+
+    def close(self) -> None:
+        command = self._writer.close(current_tenant().database)
+        logging.info(f"Import with the database stopped:\n{command}")
+
+
+async def backfill(writer, query, tag, size: int, batch_size: int) -> int:
+    written = 0
+    for offset in range(0, size, batch_size):
+        data = await aget_articles(query, tag, min(batch_size, size - offset), offset)
+        if not data.get("data"):
+            break
+        params = await aprocess_params(data, writer.reuse_existing)
+        responses = await gather_with_limit(
+            [aprocess_document({"id": el["id"], "text": el["text"]}) for el in params],
+            MAX_WORKERS,
+        )
+        graph_documents = [el for response in responses for el in response]
+        written += await writer.aadd(params, graph_documents)
+        logging.info(f"Backfilled {written} articles.")
+    writer.close()
+    return written
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--query")
+    parser.add_argument("--tag")
+    parser.add_argument("--size", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--writer", choices=["bulk", "transactional"], default="bulk")
+    parser.add_argument("--output", default="import", help="Bulk import directory")
+    parser.add_argument("--tenant", default=DEFAULT_TENANT)
+    args = parser.parse_args()
+    if not args.query and not args.tag:
+        parser.error("Either --query or --tag must be provided")
+    writer = BulkWriter(args.output) if args.writer == "bulk" else TransactionalWriter()
+    with use_tenant(args.tenant):
+        asyncio.run(backfill(writer, args.query, args.tag, args.size, args.batch_size))
@@ -0,0 +1,350 @@
+import csv
+import logging
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain_community.graphs.graph_document import GraphDocument
+from processing import EXCLUDED_TYPES
+
+# Delimiter of array values, such as embeddings, in the CSV files
+ARRAY_DELIMITER = ";"
+
+# ID space and key property of each node file, entities carry their labels
+node_groups = {
+    "Article": "id",
+    "Chunk": "id",
+    "Site": "name",
+    "Category": "name",
+    "Tag": "name",
+    "Author": "name",
+    "Entity": "id",
+}
+
+# Import types of properties that aren't strings
+property_types = {
+    "sentiment": "float",
+    "date": "datetime",
+    "processed": "boolean",
+    "position": "int",
+    "embedding": "float[]",
+}
+
+article_properties = [
+    "sentiment",
+    "sentiment_bucket",
+    "title",
+    "text",
+    "language",
+    "pageUrl",
+    "date",
+    "processed",
+    "chunking",
+]
+chunk_properties = ["text", "index", "position", "embedding"]
+
+
+def sentiment_bucket(sentiment: Optional[float]) -> str:
+    if sentiment is None:
+        return "unclassified"
+    if sentiment > 0.5:
+        return "positive"
+    if sentiment < -0.5:
+        return "negative"
+    if -0.5 < sentiment < 0.5:
+        return "neutral"
+    return "unclassified"
+
+
+def _format(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return ARRAY_DELIMITER.join(str(el) for el in value)
+    return str(value)
+
+
+def _header(name: str) -> str:
+    return f"{name}:{property_types[name]}" if name in property_types else name
+
+
+class _CsvFile:
+    """
+    CSV file with a fixed header, written as rows arrive
+    """
+
+    def __init__(self, path: Path, header: List[str]):
+        self.path = path
+        self._file = open(path, "w", newline="", encoding="utf-8")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(header)
+
+    def write(self, row: Iterable[Any]) -> None:
+        self._writer.writerow([_format(el) for el in row])
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class BulkImportWriter:
+    """
+    Writes the import parameters of articles and their graph documents as
+    deduplicated node and relationship CSV files in the layout of
+    `neo4j-admin database import full`, for initial backfills.
+
+    Articles, chunks and their relationships are streamed to disk as they
+    arrive, so memory doesn't grow with the embeddings. Sites, tags,
+    categories, authors and entities are deduplicated in memory and written
+    on `close`. Nodes and relationships follow the transactional import
+    queries, so the API can keep writing incremental updates to the imported
+    database. Organizations and people with the same lowercased name are
+    merged as `merge_entities` does.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        # Relationship type of each relationship file
+        self._relationship_files: List[Tuple[str, str]] = []
+        (self.directory / "nodes").mkdir(parents=True, exist_ok=True)
+        (self.directory / "relationships").mkdir(parents=True, exist_ok=True)
+        self._articles = self._stream_nodes("Article", article_properties)
+        self._chunks = self._stream_nodes("Chunk", chunk_properties)
+        self._streamed_relationships = {
+            "HAS_CHUNK": self._stream_relationship("Article", "HAS_CHUNK", "Chunk"),
+            "ON_SITE": self._stream_relationship("Article", "ON_SITE", "Site"),
+            "IN_CATEGORY": self._stream_relationship(
+                "Article", "IN_CATEGORY", "Category"
+            ),
+            "HAS_TAG": self._stream_relationship(
+                "Article", "HAS_TAG", "Tag", ["sentiment"]
+            ),
+            "HAS_AUTHOR": self._stream_relationship("Article", "HAS_AUTHOR", "Author"),
+            "MENTIONS": self._stream_relationship(
+                "Article", "MENTIONS", "Entity", ["sentiment"]
+            ),
+        }
+        self._article_ids = set()
+        self._chunk_ids = set()
+        # Nodes by key and relationships by their ends, per group and type
+        self._nodes: Dict[str, Dict[str, Dict[str, Any]]] = {
+            el: {} for el in ["Site", "Category", "Tag", "Author", "Entity"]
+        }
+        self._entity_labels: Dict[str, set] = {}
+        self._relationships: Dict[Tuple[str, str, str], Dict[Tuple, Dict]] = {}
+        # Entity id by lowercased name, for organizations and people
+        self._entity_names: Dict[str, str] = {}
+        self._entity_ids: Dict[str, str] = {}
+
+    def _stream_nodes(self, group: str, properties: List[str]) -> _CsvFile:
+        header = [f"{node_groups[group]}:ID({group})"] + [
+            _header(el) for el in properties
+        ]
+        return _CsvFile(self.directory / "nodes" / f"{group}.csv", header)
+
+    def _stream_relationship(
+        self, start: str, type: str, end: str, properties: List[str] = []
+    ) -> _CsvFile:
+        header = [f":START_ID({start})", f":END_ID({end})"] + [
+            _header(el) for el in properties
+        ]
+        path = f"relationships/{start}_{type}_{end}.csv"
+        self._relationship_files.append((type, path))
+        return _CsvFile(self.directory / path, header)
+
+    def _node(self, group: str, key: str, properties: Dict[str, Any] = {}) -> None:
+        # Properties are only set on creation, as with ON CREATE SET
+        node = self._nodes[group].setdefault(key, {})
+        for name, value in properties.items():
+            node.setdefault(name, value)
+
+    def _relationship(
+        self,
+        start: Tuple[str, str],
+        type: str,
+        end: Tuple[str, str],
+        properties: Dict[str, Any] = {},
+    ) -> None:
+        group = self._relationships.setdefault((start[0], type, end[0]), {})
+        group.setdefault((start[1], end[1]), properties)
+
+    def _entity_id(self, id: str, type: str, name: Optional[str]) -> str:
+        id = self._entity_ids.get(id, id)
+        if type in ["Organization", "Person"] and name:
+            canonical = self._entity_names.setdefault(name.lower(), id)
+            self._entity_ids[id] = canonical
+            return canonical
+        return id
+
+    def add(self, params: List[Dict], graph_documents: List[GraphDocument]) -> int:
+        """
+        Adds a batch of articles and their graph documents. Articles already
+        added are skipped. Returns the number of articles written.
+        """
+        processed = {el.source.metadata["id"] for el in graph_documents}
+        written = set()
+        for row in params:
+            if row["id"] in self._article_ids:
+                continue
+            self._article_ids.add(row["id"])
+            written.add(row["id"])
+            self._add_article(row, row["id"] in processed)
+        for document in graph_documents:
+            if document.source.metadata["id"] in written:
+                self._add_graph_document(document)
+        return len(written)
+
+    def _add_article(self, row: Dict, processed: bool) -> None:
+        id = row["id"]
+        sentiment = float(row["sentiment"])
+        date = datetime.fromtimestamp(row["date"], tz=timezone.utc)
+        self._articles.write(
+            [
+                id,
+                sentiment,
+                sentiment_bucket(sentiment),
+                row["title"],
+                row["text"],
+                row["language"],
+                row["page_url"],
+                date.isoformat(),
+                processed or None,
+                row.get("chunking"),
+            ]
+        )
+        self._node(
+            "Site", row["site_name"], {"publisherRegion": row["publisher_region"]}
+        )
+        self._streamed_relationships["ON_SITE"].write([id, row["site_name"]])
+        for category in set(row["categories"]):
+            self._node("Category", category)
+            self._streamed_relationships["IN_CATEGORY"].write([id, category])
+        # Tag relationships are merged along with their sentiment
+        for tag in {(el["name"], el["sentiment"]) for el in row["tags"]}:
+            self._node("Tag", tag[0])
+            self._streamed_relationships["HAS_TAG"].write([id, *tag])
+        if row["author"] is not None:
+            self._node("Author", row["author"])
+            self._streamed_relationships["HAS_AUTHOR"].write([id, row["author"]])
+            self._relationship(
+                ("Author", row["author"]), "WRITES_FOR", ("Site", row["site_name"])
+            )
+        for chunk in row["chunks"]:
+            if chunk["index"] not in self._chunk_ids:
+                self._chunk_ids.add(chunk["index"])
+                self._chunks.write(
+                    [
+                        chunk["index"],
+                        chunk["text"],
+                        chunk["index"],
+                        chunk["position"],
+                        chunk["embedding"],
+                    ]
+                )
+            self._streamed_relationships["HAS_CHUNK"].write([id, chunk["index"]])
+
+    def _add_entity(self, id: str, type: str, properties: Dict[str, Any]) -> str:
+        id = self._entity_id(id, type, properties.get("name"))
+        self._node("Entity", id)
+        # Entity properties are overwritten, as with SET +=
+        self._nodes["Entity"][id].update(
+            {
+                k: v
+                for k, v in properties.items()
+                if k != "sentiment" and v not in ["", None]
+            }
+        )
+        self._entity_labels.setdefault(id, {"__Entity__"}).add(type)
+        return id
+
+    def _add_graph_document(self, document: GraphDocument) -> None:
+        article_id = document.source.metadata["id"]
+        mentions = {}
+        for node in document.nodes:
+            if node.type in EXCLUDED_TYPES:
+                continue
+            id = self._add_entity(node.id, node.type, node.properties)
+            sentiment = node.properties.get("sentiment")
+            if sentiment is not None or id not in mentions:
+                mentions[id] = sentiment
+        for id, sentiment in mentions.items():
+            self._streamed_relationships["MENTIONS"].write([article_id, id, sentiment])
+        for rel in document.relationships:
+            if rel.source.type in EXCLUDED_TYPES or rel.target.type in EXCLUDED_TYPES:
+                continue
+            source = self._entity_id(rel.source.id, rel.source.type, None)
+            target = self._entity_id(rel.target.id, rel.target.type, None)
+            for id in [source, target]:
+                self._node("Entity", id)
+                self._entity_labels.setdefault(id, {"__Entity__"})
+            # Only the first relationship of a type between two entities is
+            # kept, as with apoc.merge.relationship
+            self._relationship(
+                ("Entity", source),
+                rel.type.replace(" ", "_").upper(),
+                ("Entity", target),
+                rel.properties,
+            )
+
+    def _write_nodes(self, group: str) -> None:
+        nodes = self._nodes[group]
+        properties = sorted({k for el in nodes.values() for k in el})
+        header = [f"{node_groups[group]}:ID({group})"]
+        header += [_header(el) for el in properties]
+        if group == "Entity":
+            header.append(":LABEL")
+        output = _CsvFile(self.directory / "nodes" / f"{group}.csv", header)
+        for key, node in nodes.items():
+            row = [key] + [node.get(el) for el in properties]
+            if group == "Entity":
+                row.append(sorted(self._entity_labels[key]))
+            output.write(row)
+        output.close()
+
+    def _write_relationships(self, start: str, type: str, end: str) -> None:
+        relationships = self._relationships[(start, type, end)]
+        properties = sorted({k for el in relationships.values() for k in el})
+        output = self._stream_relationship(start, type, end, properties)
+        for (source, target), rel in relationships.items():
+            output.write([source, target] + [rel.get(el) for el in properties])
+        output.close()
+
+    def close(self, database: str = "neo4j") -> str:
+        """
+        Writes the remaining files and returns the import command, which is
+        also saved as import.sh in the output directory
+        """
+        for output in [self._articles, self._chunks]:
+            output.close()
+        for output in self._streamed_relationships.values():
+            output.close()
+        for group in self._nodes:
+            self._write_nodes(group)
+        for start, type, end in self._relationships:
+            self._write_relationships(start, type, end)
+
+        arguments = []
+        for group in node_groups:
+            label = "" if group == "Entity" else f"{group}="
+            arguments.append(f"--nodes={label}nodes/{group}.csv")
+        for type, path in self._relationship_files:
+            arguments.append(f"--relationships={type}={path}")
+        command = " \\\n  ".join(
+            [
+                f"neo4j-admin database import full {database}",
+                "--multiline-fields=true",
+                f"--array-delimiter='{ARRAY_DELIMITER}'",
+                *arguments,
+            ]
+        )
+        script = self.directory / "import.sh"
+        script.write_text(f'#!/bin/sh\ncd "$(dirname "$0")"\n{command}\n')
+        os.chmod(script, 0o755)
+        logging.info(
+            f"Bulk import files of {len(self._article_ids)} articles and "
+            f"{len(self._chunk_ids)} chunks written to {self.directory}"
+        )
+        return command
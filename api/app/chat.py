@@ -1,6 +1,8 @@
 import logging
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 
+from context import pack_context
+from gazetteer import entity_extractor
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import (
     ChatPromptTemplate,
@@ -14,14 +16,13 @@ from langchain_core.runnables import (
     RunnableParallel,
     RunnablePassthrough,
 )
+from retrieval import RetrievalConfig, hybrid_search
 from utils import (
     _format_chat_history,
-    entity_chain,
-    format_docs,
+    format_chunks,
     generate_full_text_query,
-    graph,
     llm,
-    vector_index,
+    read_query,
 )
 
 # Condense a chat history and follow-up question into a standalone question
@@ -67,51 +68,57 @@ _search_query = RunnableBranch(
 
 
 # Fulltext index query
-def structured_retriever(question: str) -> str:
+def structured_retriever(question: str) -> List[str]:
     """
     Collects the neighborhood of entities mentioned
     in the question
     """
-    result = ""
-    entities = entity_chain.invoke({"question": question})
-    for entity in entities.names:
-        response = graph.query(
-            """CALL db.index.fulltext.queryNodes('entity', $query, {limit:2})
-            YIELD node,score
-            CALL {
-              WITH node
-              MATCH (node)-[r:!MENTIONS]->(neighbor)
-              RETURN node.name + ' - ' + type(r) + ' -> ' + neighbor.name AS output
-              UNION ALL
-              WITH node
-              MATCH (node)<-[r:!MENTIONS]-(neighbor)
-              RETURN neighbor.name + ' - ' + type(r) + ' -> ' +  node.name AS output
-            }
-            RETURN output LIMIT 200
-            """,
-            {"query": generate_full_text_query(entity)},
-        )
-        if response:
-            result += "\n".join([el["output"] for el in response if el["output"]])
-    return result
+    entities = entity_extractor.invoke({"question": question})
+    response = read_query(
+        """UNWIND $queries AS query
+        CALL {
+          WITH query
+          CALL db.index.fulltext.queryNodes('entity', query, {limit:2})
+          YIELD node,score
+          CALL {
+            WITH node
+            MATCH (node)-[r:!MENTIONS]->(neighbor)
+            RETURN node.name + ' - ' + type(r) + ' -> ' + neighbor.name AS output
+            UNION ALL
+            WITH node
+            MATCH (node)<-[r:!MENTIONS]-(neighbor)
+            RETURN neighbor.name + ' - ' + type(r) + ' -> ' +  node.name AS output
+          }
+          RETURN output LIMIT 200
+        }
+        RETURN output
+        """,
+        {"queries": [generate_full_text_query(entity) for entity in entities.names]},
+    )
+    return [el["output"] for el in response if el["output"]]
 
 
 def retriever(input) -> str:
-    print(input)
     # Rewrite query if needed
     query = input.get("search_query")
     if not isinstance(query, str):
         query = query.content
+    config = RetrievalConfig.parse_obj(input.get("question", {}).get("retrieval") or {})
     # Retrieve documents from vector index
-    documents = format_docs(vector_index.similarity_search(query))
+    documents = hybrid_search(
+        query, config, backend=input.get("question", {}).get("backend", "neo4j")
+    )
     if input.get("question", {}).get("mode") == "basic_hybrid_search_node_neighborhood":
-        structured_data = structured_retriever(query)
-        print(structured_data)
-        documents = f"""Structured data:
+        structured_data, chunks = pack_context(
+            documents, structured_retriever(query), config.token_budget
+        )
+        structured_data = "\n".join(structured_data)
+        return f"""Structured data:
         {structured_data}
         Unstructured data:
-        {documents}"""
-    return documents
+        {format_chunks(chunks)}"""
+    _, chunks = pack_context(documents, token_budget=config.token_budget)
+    return format_chunks(chunks)
 
 
 chain = (
@@ -144,6 +151,9 @@ class ChainInput(BaseModel):
         ..., extra={"widget": {"type": "chat", "input": "input", "output": "output"}}
     )
     mode: str
+    # Vector retrieval backend, either "neo4j" or the in-process "local" index
+    backend: str = "neo4j"
+    retrieval: Optional[RetrievalConfig] = None
 
 
 chain = chain.with_types(input_type=ChainInput)
@@ -0,0 +1,96 @@
+import logging
+import os
+from typing import List, Literal
+
+from langchain_core.pydantic_v1 import BaseModel, Field, root_validator
+from langchain_text_splitters import (
+    RecursiveCharacterTextSplitter,
+    TextSplitter,
+    TokenTextSplitter,
+)
+from utils import Lazy
+
+# How article texts are split: fixed token windows, or windows that end on
+# sentence or paragraph boundaries where possible
+CHUNK_STRATEGY = os.environ.get("CHUNK_STRATEGY", "token")
+# Chunk size and overlap between consecutive chunks, in tokens
+CHUNK_SIZE = int(os.environ.get("CHUNK_SIZE", 500))
+CHUNK_OVERLAP = int(os.environ.get("CHUNK_OVERLAP", 50))
+# Chunks kept per article, 0 keeps all of them
+MAX_CHUNKS = int(os.environ.get("MAX_CHUNKS", 5))
+
+# Boundaries tried in order, falling back to words and characters when a
+# sentence or paragraph alone is longer than the chunk size
+_sentence_separators = [r"(?<=[.!?])\s+", r"\s+", ""]
+_paragraph_separators = [r"\n\s*\n", r"\n", *_sentence_separators]
+
+ChunkStrategy = Literal["token", "sentence", "paragraph"]
+
+
+class ChunkingConfig(BaseModel):
+    """Parameters of article splitting."""
+
+    strategy: ChunkStrategy = Field(CHUNK_STRATEGY, description="Where chunks end")
+    size: int = Field(CHUNK_SIZE, description="Maximum chunk size in tokens")
+    overlap: int = Field(CHUNK_OVERLAP, description="Tokens shared by neighbors")
+    max_chunks: int = Field(
+        MAX_CHUNKS, description="Chunks kept per article, 0 keeps all"
+    )
+
+    class Config:
+        # Defaults come from the environment, so they are validated as well
+        validate_all = True
+
+    @root_validator(skip_on_failure=True)
+    def check_sizes(cls, values):
+        if values["size"] < 1:
+            raise ValueError("size must be at least 1")
+        if not 0 <= values["overlap"] < values["size"]:
+            raise ValueError("overlap must be at least 0 and smaller than size")
+        if values["max_chunks"] < 0:
+            raise ValueError("max_chunks must be at least 0")
+        return values
+
+    @property
+    def fingerprint(self) -> str:
+        """
+        Identifies the configuration on articles, so the ones split with
+        another configuration can be found and split again
+        """
+        return f"{self.strategy}-{self.size}-{self.overlap}-{self.max_chunks}"
+
+
+def build_splitter(config: ChunkingConfig) -> TextSplitter:
+    if config.strategy == "token":
+        return TokenTextSplitter(chunk_size=config.size, chunk_overlap=config.overlap)
+    separators = {
+        "sentence": _sentence_separators,
+        "paragraph": _paragraph_separators,
+    }
+    # Lengths are measured with the same tokenizer as the token strategy
+    return RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+        chunk_size=config.size,
+        chunk_overlap=config.overlap,
+        separators=separators[config.strategy],
+        is_separator_regex=True,
+    )
+
+
+class Chunker:
+    """
+    Splits article texts with a chunking configuration
+    """
+
+    def __init__(self, config: ChunkingConfig):
+        self.config = config
+        self._splitter = Lazy(lambda: build_splitter(config))
+
+    def split(self, text: str) -> List[str]:
+        chunks = self._splitter.split_text(text)
+        if self.config.max_chunks and len(chunks) > self.config.max_chunks:
+            logging.debug(f"Keeping {self.config.max_chunks} of {len(chunks)} chunks.")
+            chunks = chunks[: self.config.max_chunks]
+        return chunks
+
+
+chunker = Chunker(ChunkingConfig())
@@ -0,0 +1,128 @@
+import re
+from typing import Dict, List, Optional, Set, Tuple
+
+import tiktoken
+from chunking import chunker
+from langchain_core.documents import Document
+from utils import Lazy
+
+# Default number of context tokens passed to answer synthesis
+CONTEXT_TOKEN_BUDGET = 3000
+# Share of the budget reserved for structured data when both are present
+STRUCTURED_SHARE = 0.3
+# Jaccard similarity of word shingles above which chunks are duplicates
+DUPLICATE_THRESHOLD = 0.8
+SHINGLE_SIZE = 3
+# Shortest overlap between consecutive chunks that is stripped, in tokens
+MIN_OVERLAP_TOKENS = 5
+
+encoding = Lazy(lambda: tiktoken.get_encoding("cl100k_base"))
+
+_word_re = re.compile(r"\S+")
+
+
+def count_tokens(text: str) -> int:
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def _shingles(words: List[str]) -> Set[Tuple[str, ...]]:
+    if len(words) < SHINGLE_SIZE:
+        return {tuple(words)}
+    return {
+        tuple(words[i : i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)
+    }
+
+
+def _jaccard(a: Set, b: Set) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def _overlap(previous: str, text: str, max_tokens: int) -> int:
+    """
+    Length of the start of `text` that repeats the end of `previous`
+    character for character, as produced by the overlap of the text
+    splitter. Returns 0 when no such overlap of `MIN_OVERLAP_TOKENS` to
+    `max_tokens` tokens exists.
+    """
+    start = previous.find(text[:1])
+    while start != -1:
+        if text.startswith(previous[start:]):
+            tokens = count_tokens(previous[start:])
+            # Chunk boundaries may cut a token, which then encodes as two
+            if tokens <= max_tokens + 1:
+                if tokens < min(MIN_OVERLAP_TOKENS, max_tokens):
+                    return 0
+                return len(previous) - start
+        start = previous.find(text[:1], start + 1)
+    return 0
+
+
+def deduplicate_chunks(documents: List[Document]) -> List[str]:
+    """
+    Drops near-duplicate chunks and strips the text a chunk shares with the
+    previous chunk of the same article, when both are kept. Keeps the input
+    order and the original whitespace.
+    """
+    overlap = chunker.config.overlap
+    kept: List[Tuple[Document, Set]] = []
+    for doc in documents:
+        shingles = _shingles(_word_re.findall(doc.page_content))
+        if any(_jaccard(shingles, el) >= DUPLICATE_THRESHOLD for _, el in kept):
+            continue
+        kept.append((doc, shingles))
+    # Chunks by article and position within the article
+    positions: Dict[Tuple[str, int], str] = {
+        (doc.metadata["article_id"], doc.metadata["position"]): doc.page_content
+        for doc, _ in kept
+        if doc.metadata.get("article_id") and doc.metadata.get("position") is not None
+    }
+    result = []
+    for doc, _ in kept:
+        text = doc.page_content
+        previous = positions.get(
+            (doc.metadata.get("article_id"), (doc.metadata.get("position") or 0) - 1)
+        )
+        if previous and overlap:
+            text = text[_overlap(previous, text, overlap) :]
+        if text.strip():
+            result.append(text)
+    return result
+
+
+def deduplicate_lines(lines: List[str]) -> List[str]:
+    return list(dict.fromkeys(el.strip() for el in lines if el and el.strip()))
+
+
+def _pack(items: List[str], budget: int) -> Tuple[List[str], int]:
+    packed = []
+    used = 0
+    for item in items:
+        tokens = count_tokens(item)
+        if used + tokens > budget:
+            continue
+        packed.append(item)
+        used += tokens
+    return packed, used
+
+
+def pack_context(
+    documents: List[Document],
+    structured: Optional[List[str]] = None,
+    token_budget: int = CONTEXT_TOKEN_BUDGET,
+) -> Tuple[List[str], List[str]]:
+    """
+    Deduplicates retrieved chunks and structured lines and keeps the
+    highest ranked ones that fit into the token budget.
+
+    Items are expected in ranking order. Structured lines are short, so
+    they get a fixed share of the budget and any unused part of it is
+    given to the text chunks.
+    """
+    lines = deduplicate_lines(structured or [])
+    chunks = deduplicate_chunks(documents)
+    structured_budget = int(token_budget * STRUCTURED_SHARE) if chunks else token_budget
+    packed_lines, used = _pack(lines, structured_budget)
+    packed_chunks, _ = _pack(chunks, token_budget - used)
+    return packed_lines, packed_chunks
@@ -0,0 +1,137 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from metrics import cache_requests
+from tenants import current_tenant
+
+# Number of question shapes kept in the cache
+CACHE_SIZE = 1000
+# Seconds a template is reused before it is generated again
+CACHE_TTL = float(os.environ.get("CYPHER_CACHE_TTL", 3600))
+
+_word_re = re.compile(r"\w+")
+
+
+def _ordered_entities(question: str, entity_mapping: Dict[str, str]) -> List[str]:
+    """
+    Entities sorted by their position in the question, longest first on ties
+    """
+    lowered = question.lower()
+    return sorted(entity_mapping, key=lambda el: (lowered.find(el.lower()), -len(el)))
+
+
+def is_cacheable(question: str, entity_mapping: Dict[str, str]) -> bool:
+    """
+    Templates can only be reused when every entity is mentioned verbatim
+    in the question and was mapped to a database value
+    """
+    lowered = question.lower()
+    return all(
+        entity.lower() in lowered and value for entity, value in entity_mapping.items()
+    )
+
+
+def question_shape(question: str, entity_mapping: Dict[str, str]) -> str:
+    """
+    Normalized question with entity mentions replaced by placeholders,
+    e.g. "Who is the CEO of Neo4j?" -> "who is the ceo of entity"
+    """
+    shape = question.lower()
+    for entity in sorted(entity_mapping, key=len, reverse=True):
+        shape = shape.replace(entity.lower(), " __entity__ ")
+    return " ".join(_word_re.findall(shape)).replace("__entity__", "entity")
+
+
+def _literal_pattern(value: str) -> re.Pattern:
+    escaped = re.escape(value)
+    return re.compile(f"'{escaped}'|\"{escaped}\"")
+
+
+class CypherTemplateCache:
+    """
+    LRU cache of validated Cypher statements keyed by question shape.
+
+    Database values of the entities are replaced by `$entity_<i>` parameters,
+    numbered by the order in which entities appear in the question, so that
+    a template can be reused for the same question about other entities.
+
+    Templates expire after the TTL and are only served for the schema
+    version they were generated against.
+    """
+
+    def __init__(self, max_size: int = CACHE_SIZE, ttl: float = CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        # Template, schema version and creation time by question shape
+        self._templates: OrderedDict[str, Tuple[str, str, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _params(question: str, entity_mapping: Dict[str, str]) -> Dict[str, str]:
+        return {
+            f"entity_{i}": entity_mapping[entity]
+            for i, entity in enumerate(_ordered_entities(question, entity_mapping))
+        }
+
+    def get(
+        self, question: str, entity_mapping: Dict[str, str], version: str
+    ) -> Optional[Tuple[str, Dict[str, str]]]:
+        """
+        Returns the template and its parameters for the question, if cached
+        for the schema version
+        """
+        if not is_cacheable(question, entity_mapping):
+            return None
+        key = question_shape(question, entity_mapping)
+        with self._lock:
+            entry = self._templates.get(key)
+            if (
+                entry is None
+                or entry[1] != version
+                or time.monotonic() - entry[2] > self.ttl
+            ):
+                # Expired or generated for an earlier schema
+                self._templates.pop(key, None)
+                self.misses += 1
+                cache_requests.inc(
+                    cache="cypher", result="miss", tenant=current_tenant().id
+                )
+                return None
+            template = entry[0]
+            self._templates.move_to_end(key)
+            self.hits += 1
+            cache_requests.inc(cache="cypher", result="hit", tenant=current_tenant().id)
+        return template, self._params(question, entity_mapping)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._templates.clear()
+
+    def put(
+        self, question: str, entity_mapping: Dict[str, str], query: str, version: str
+    ) -> bool:
+        """
+        Parameterizes and stores a query that returned rows, generated
+        against the schema version. Queries are skipped when an entity value
+        can't be cleanly replaced by a parameter.
+        """
+        if not is_cacheable(question, entity_mapping):
+            return False
+        template = query
+        for name, value in self._params(question, entity_mapping).items():
+            template, replaced = _literal_pattern(value).subn(f"${name}", template)
+            if not replaced or value.lower() in template.lower():
+                return False
+        key = question_shape(question, entity_mapping)
+        with self._lock:
+            self._templates[key] = (template, version, time.monotonic())
+            self._templates.move_to_end(key)
+            while len(self._templates) > self.max_size:
+                self._templates.popitem(last=False)
+        return True
@@ -0,0 +1,110 @@
+import json
+import os
+from typing import Any, Dict, List, Optional
+
+from neo4j import READ_ACCESS, unit_of_work
+from utils import graph
+
+# Queries whose plan estimates more rows than this in any operator are rejected
+MAX_ESTIMATED_ROWS = int(os.environ.get("CYPHER_MAX_ESTIMATED_ROWS", 1_000_000))
+# Maximum number of result rows fetched from the database
+ROW_LIMIT = int(os.environ.get("CYPHER_ROW_LIMIT", 100))
+# Transaction timeout in seconds
+QUERY_TIMEOUT = float(os.environ.get("CYPHER_QUERY_TIMEOUT", 10))
+# Maximum length of the serialized result passed to the response prompt
+MAX_RESULT_CHARS = int(os.environ.get("CYPHER_MAX_RESULT_CHARS", 8000))
+
+
+class QueryRejected(Exception):
+    """Raised when a generated query is not safe to execute."""
+
+
+def _walk(plan: Dict[str, Any]):
+    yield plan
+    for child in plan.get("children", []):
+        yield from _walk(child)
+
+
+def explain(query: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Returns the execution plan of the query without running it.
+    Syntax and semantic errors are raised by the database.
+    """
+    with graph._driver.session(
+        database=graph._database, default_access_mode=READ_ACCESS
+    ) as session:
+        return session.run(f"EXPLAIN {query}", params or {}).consume().plan
+
+
+def check_plan(query: str, params: Optional[Dict[str, Any]] = None) -> str:
+    """
+    EXPLAINs the query and returns it.
+
+    Rejects write queries and queries whose estimated intermediate rows
+    exceed the budget. The number of result rows is bounded when the query
+    runs, see guarded_query.
+    """
+    plan = explain(query, params)
+    estimated_rows = 0.0
+    for operator in _walk(plan):
+        name = operator.get("operatorType", "")
+        if any(
+            el in name for el in ["Create", "Merge", "Delete", "Set", "Remove", "Load"]
+        ):
+            raise QueryRejected(f"Only read queries are allowed, found {name}")
+        estimated_rows = max(
+            estimated_rows, operator.get("args", {}).get("EstimatedRows", 0)
+        )
+    if estimated_rows > MAX_ESTIMATED_ROWS:
+        raise QueryRejected(
+            f"The query is too expensive, it is estimated to process "
+            f"{int(estimated_rows)} rows. Use a more specific pattern."
+        )
+    return query
+
+
+def guarded_query(
+    query: str, params: Optional[Dict[str, Any]] = None, check: bool = True
+) -> List[Dict[str, Any]]:
+    """
+    Runs a generated query in a read transaction with a timeout,
+    fetching at most ROW_LIMIT rows. Set `check` to False for queries
+    already returned by check_plan.
+
+    Rows are pulled in batches of ROW_LIMIT and the transaction ends after
+    the first one, so the database stops early without rewriting the query.
+    """
+    if check:
+        query = check_plan(query, params)
+
+    @unit_of_work(timeout=QUERY_TIMEOUT)
+    def work(tx):
+        result = tx.run(query, params or {})
+        return [record.data() for record in result.fetch(ROW_LIMIT)]
+
+    with graph._driver.session(
+        database=graph._database, fetch_size=ROW_LIMIT
+    ) as session:
+        return session.execute_read(work)
+
+
+def format_result(data: List[Dict[str, Any]]) -> str:
+    """
+    Serializes query results for the response prompt, dropping rows
+    that don't fit into MAX_RESULT_CHARS
+    """
+    output = str(data)
+    if len(output) <= MAX_RESULT_CHARS:
+        return output
+    rows = []
+    length = 0
+    for row in data:
+        serialized = json.dumps(row, default=str)
+        if length + len(serialized) > MAX_RESULT_CHARS:
+            break
+        rows.append(serialized)
+        length += len(serialized)
+    return (
+        "[" + ", ".join(rows) + "]\n"
+        f"Showing {len(rows)} of {len(data)} rows, the rest was truncated."
+    )
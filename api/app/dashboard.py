@@ -0,0 +1,125 @@
+import asyncio
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from importing import import_labels
+from metrics import cache_requests
+from tenants import current_tenant
+from utils import TenantLocal, read_query
+
+# Seconds a dashboard snapshot is served before it is recomputed
+DASHBOARD_TTL = float(os.environ.get("DASHBOARD_TTL", 60))
+# Number of entity types shown on the dashboard
+ENTITY_TYPE_LIMIT = 7
+
+# Labels that are not entity types: imported article metadata and the
+# values added by enhancement, like City, which are not entities
+non_entity_labels = [
+    *import_labels,
+    "__Entity__",
+    "City",
+    "Nationality",
+    "Classification",
+    "InvestmentSeries",
+]
+
+# Label counts come from the count store, sentiment counts from the
+# sentiment bucket index, so neither scans the graph
+dashboard_query = """
+CALL apoc.meta.stats() YIELD labels
+RETURN labels,
+       count {(a:Article WHERE a.sentiment_bucket = 'positive')} AS positive,
+       count {(a:Article WHERE a.sentiment_bucket = 'neutral')} AS neutral,
+       count {(a:Article WHERE a.sentiment_bucket = 'negative')} AS negative
+"""
+
+
+def build_dashboard(data: Dict[str, Any]) -> Dict[str, Any]:
+    labels = data["labels"]
+    # Entities with more than one type label are counted under each of them
+    entity_types = sorted(
+        (
+            {"label": label, "count": count}
+            for label, count in labels.items()
+            if label not in non_entity_labels and count
+        ),
+        key=lambda el: el["count"],
+        reverse=True,
+    )
+    return {
+        "article": {
+            "article_count": labels.get("Article", 0),
+            "sentiment": [
+                {"sentiment": el, "count": data[el]}
+                for el in ["positive", "neutral", "negative"]
+            ],
+        },
+        "entity": {
+            "types": entity_types[:ENTITY_TYPE_LIMIT],
+            "count": labels.get("__Entity__", 0),
+        },
+    }
+
+
+class DashboardStats:
+    """
+    Serves dashboard statistics from a snapshot.
+
+    The snapshot is recomputed when older than the TTL or after writers
+    report new data. Concurrent requests for a stale snapshot wait for a
+    single recomputation instead of each querying the database.
+    """
+
+    def __init__(self, ttl: float = DASHBOARD_TTL):
+        self.ttl = ttl
+        self._snapshot: Optional[Dict[str, Any]] = None
+        self._created_at = 0.0
+        # Invalidations so far, and the number the snapshot was built after
+        self._generation = 0
+        self._snapshot_generation = 0
+        self._lock = threading.Lock()
+
+    def _is_fresh(self) -> bool:
+        return (
+            self._snapshot is not None
+            and self._snapshot_generation == self._generation
+            and time.monotonic() - self._created_at < self.ttl
+        )
+
+    def get(self) -> Dict[str, Any]:
+        if self._is_fresh():
+            cache_requests.inc(
+                cache="dashboard", result="hit", tenant=current_tenant().id
+            )
+            return self._snapshot
+        with self._lock:
+            if not self._is_fresh():
+                cache_requests.inc(
+                    cache="dashboard", result="miss", tenant=current_tenant().id
+                )
+                # Invalidations during the query apply to the next rebuild,
+                # and a failed query leaves the snapshot stale
+                generation = self._generation
+                self._snapshot = build_dashboard(read_query(dashboard_query)[0])
+                self._snapshot_generation = generation
+                self._created_at = time.monotonic()
+            return self._snapshot
+
+    async def aget(self) -> Dict[str, Any]:
+        if self._is_fresh():
+            cache_requests.inc(
+                cache="dashboard", result="hit", tenant=current_tenant().id
+            )
+            return self._snapshot
+        return await asyncio.to_thread(self.get)
+
+    def invalidate(self) -> None:
+        """
+        Called by writers after they change articles or entities
+        """
+        self._generation += 1
+
+
+dashboard_stats = TenantLocal(lambda tenant: DashboardStats())
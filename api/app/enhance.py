@@ -5,12 +5,19 @@ from typing import Any, Dict, List, Optional, Union
 from urllib.parse import urlencode
 
 import requests
-from utils import graph
+from dashboard import dashboard_stats
+from gazetteer import gazetteer
+from metrics import rows_total, timed
+from network import network_cache
+from schema import schema_service
+from utils import graph, http_client
 
 CATEGORY_THRESHOLD = 0.50
 params = []
 
 DIFF_TOKEN = os.environ["DIFFBOT_API_KEY"]
+# Diffbot Knowledge Graph host, overridable to point at a local stand-in
+DIFFBOT_KG_URL = os.environ.get("DIFFBOT_KG_URL", "https://kg.diffbot.com")
 
 
 def get_datetime(value: Optional[Union[str, int, float]]) -> datetime:
@@ -19,17 +26,27 @@ def get_datetime(value: Optional[Union[str, int, float]]) -> datetime:
     return datetime.fromtimestamp(float(value) / 1000.0)
 
 
+@timed("enhance_fetch")
 def process_entities(entity: str, type: str) -> Dict[str, Any]:
     """
     Fetch relevant articles from Diffbot KG endpoint
     """
-    search_host = "https://kg.diffbot.com/kg/v3/enhance?"
+    search_host = f"{DIFFBOT_KG_URL}/kg/v3/enhance?"
     params = {"type": type, "name": entity, "token": DIFF_TOKEN}
     encoded_query = urlencode(params)
     url = f"{search_host}{encoded_query}"
     return entity, requests.get(url).json()
 
 
+@timed("enhance_fetch")
+async def aprocess_entities(entity: str, type: str) -> Dict[str, Any]:
+    response = await http_client.get(
+        f"{DIFFBOT_KG_URL}/kg/v3/enhance",
+        params={"type": type, "name": entity, "token": DIFF_TOKEN},
+    )
+    return entity, response.json()
+
+
 def get_people_params(row: Dict) -> Optional[Dict]:
     firstName = row.get("nameDetail", {}).get("firstName", "")
     lastName = row.get("nameDetail", {}).get("lastName", "")
@@ -318,6 +335,59 @@ WITH o
 RETURN count(*)
 """
 
+
+# Labels and relationship types written by the enhancement queries
+enhance_labels = [
+    "Person",
+    "Organization",
+    "City",
+    "Nationality",
+    "Classification",
+    "InvestmentSeries",
+]
+enhance_relationship_types = [
+    "PERSON_LOCATION",
+    "HAS_NATIONALITY",
+    "EMPLOYEE_OR_MEMBER_OF",
+    "HAS_CLASSIFICATION",
+    "HAS_CEO",
+    "HAS_SUBSIDIARY",
+    "BOARD_MEMBER",
+    "PARTNERSHIP",
+    "HAS_FOUNDER",
+    "HAS_COMPETITOR",
+    "HAS_SUPPLIER",
+    "HAS_INVESTMENT",
+    "HAS_INVESTED",
+]
+
+
+def get_related_names(
+    organizations: List[Dict[str, Any]], people: List[Dict[str, Any]]
+) -> List[str]:
+    """
+    Names of all entities merged by the organization and person import queries
+    """
+    names = [el["name"] for el in organizations + people]
+    for org in organizations:
+        if org["ceo"]:
+            names.append(org["ceo"]["name"])
+        for key in [
+            "subsidiaries",
+            "board_members",
+            "partnerships",
+            "founders",
+            "competitors",
+            "suppliers",
+        ]:
+            names.extend(el["name"] for el in org[key])
+        for investment in org["investments"]:
+            names.extend(el["name"] for el in investment["investors"])
+    for person in people:
+        names.extend(el["employer"] for el in person["employments"])
+    return names
+
+
 no_data_processed_query = """
 UNWIND $data AS row
 MATCH (e:`__Entity__` {name: row})
@@ -325,6 +395,7 @@ SET e.processed = True;
 """
 
 
+@timed("neo4j_write")
 def store_enhanced_data(data: List[Dict[str, Any]]) -> Dict:
     organizations = []
     people = []
@@ -350,4 +421,10 @@ def store_enhanced_data(data: List[Dict[str, Any]]) -> Dict:
         graph.query(organization_import_query, {"data": organizations})
     if people:
         graph.query(person_import_query, {"data": people})
+    gazetteer.add(get_related_names(organizations, people))
+    rows_total.inc(len(organizations) + len(people), operation="entities")
+    if organizations or people:
+        schema_service.observe(enhance_labels, enhance_relationship_types)
+        dashboard_stats.invalidate()
+        network_cache.invalidate()
     return {"organizations": len(organizations), "people": len(people)}
@@ -0,0 +1,143 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from metrics import cache_requests
+from tenants import current_tenant
+from utils import (
+    TenantLocal,
+    aquery,
+    entity_keyword_index,
+    generate_full_text_query,
+    read_query,
+)
+
+# Number of resolved names kept in each resolver
+CACHE_SIZE = 2048
+# Seconds after which a cached resolution is looked up again
+CACHE_TTL = 600
+
+batch_resolution_query = """
+UNWIND $rows AS row
+CALL {
+  WITH row
+  CALL db.index.fulltext.queryNodes($index, row.query, {limit: toInteger($limit)})
+  YIELD node, score
+  WHERE $label IS NULL OR $label IN labels(node)
+  WITH node ORDER BY score DESC
+  RETURN collect(DISTINCT node.name) AS candidates
+}
+RETURN row.name AS name, candidates
+"""
+
+
+class EntityResolver:
+    """
+    Maps entity names to names of `__Entity__` nodes via the fulltext index.
+
+    All names missing from the LRU cache are resolved with a single UNWIND
+    query, so resolving any number of entities costs at most one round-trip.
+    Names without candidates are not cached, as they may be imported later.
+    """
+
+    def __init__(
+        self,
+        build_query: Callable[[str], str],
+        limit: int = 1,
+        label: Optional[str] = None,
+        max_size: int = CACHE_SIZE,
+        ttl: int = CACHE_TTL,
+    ):
+        self.build_query = build_query
+        self.limit = limit
+        self.label = label
+        self.max_size = max_size
+        self.ttl = ttl
+        self._cache: OrderedDict[str, Tuple[float, List[str]]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get_cached(self, name: str) -> Optional[List[str]]:
+        with self._lock:
+            entry = self._cache.get(name)
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                cache_requests.inc(
+                    cache="entity_resolution", result="miss", tenant=current_tenant().id
+                )
+                return None
+            self._cache.move_to_end(name)
+        cache_requests.inc(
+            cache="entity_resolution", result="hit", tenant=current_tenant().id
+        )
+        return entry[1]
+
+    def _put(self, name: str, candidates: List[str]) -> None:
+        with self._lock:
+            self._cache[name] = (time.monotonic(), candidates)
+            self._cache.move_to_end(name)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
+
+    def _prepare(self, names: List[str]) -> Tuple[Dict[str, List[str]], List[Dict]]:
+        """
+        Splits names into cached results and rows that need a lookup
+        """
+        result = {}
+        rows = []
+        for name in dict.fromkeys(names):
+            cached = self._get_cached(name)
+            if cached is not None:
+                result[name] = cached
+                continue
+            try:
+                rows.append({"name": name, "query": self.build_query(name)})
+            except IndexError:  # Nothing left to search for
+                result[name] = []
+        return result, rows
+
+    def _params(self, rows: List[Dict]) -> Dict[str, Any]:
+        return {
+            "rows": rows,
+            "index": entity_keyword_index,
+            "limit": self.limit,
+            "label": self.label,
+        }
+
+    def _collect(
+        self, names: List[str], result: Dict[str, List[str]], data: List[Dict]
+    ) -> Dict[str, List[str]]:
+        for row in data:
+            result[row["name"]] = row["candidates"]
+            if row["candidates"]:
+                self._put(row["name"], row["candidates"])
+        return {name: result.get(name, []) for name in names}
+
+    def resolve(self, names: List[str]) -> Dict[str, List[str]]:
+        """
+        Returns candidate database names for each of the input names,
+        ordered by fulltext score
+        """
+        result, rows = self._prepare(names)
+        data = read_query(batch_resolution_query, self._params(rows)) if rows else []
+        return self._collect(names, result, data)
+
+    async def aresolve(self, names: List[str]) -> Dict[str, List[str]]:
+        result, rows = self._prepare(names)
+        data = await aquery(batch_resolution_query, self._params(rows)) if rows else []
+        return self._collect(names, result, data)
+
+
+# Prefix match of the whole name, used to map entities for text2cypher
+entity_resolver = TenantLocal(
+    lambda tenant: EntityResolver(lambda name: name + "*", limit=1)
+)
+# Fuzzy match of each word, used to find organizations for prefiltering
+organization_resolver = TenantLocal(
+    lambda tenant: EntityResolver(
+        generate_full_text_query, limit=25, label="Organization"
+    )
+)
@@ -0,0 +1,345 @@
+import difflib
+import logging
+import re
+import threading
+import time
+from collections import defaultdict, deque
+from contextvars import copy_context
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from langchain_core.runnables import RunnableLambda
+from metrics import timed
+from utils import Entities, TenantLocal, entity_chain, read_query
+
+# Seconds between full reloads of entity names from the database
+REFRESH_INTERVAL = 300
+# Minimum similarity ratio for the fuzzy fallback
+FUZZY_CUTOFF = 0.88
+# Shortest entity name that is considered for matching
+MIN_NAME_LENGTH = 3
+# Added names served by the delta automaton before it is merged
+DELTA_SIZE = 1000
+# Names compared in full for each fuzzy n-gram
+FUZZY_CANDIDATES = 10
+# Trigrams shared by more names are skipped when finding candidates
+MAX_TRIGRAM_POSTINGS = 5000
+# Common question words, names made of them only are never matched
+STOP_WORDS = frozenset(
+    """
+    a about after all an and any are as at be been before by can ceo cfo
+    company companies cto did do does for from had has have how in is it its
+    latest news of on or recent say says show tell that the their them there
+    these they this to was were what when where which who whom whose why will
+    with
+    """.split()
+)
+
+entity_names_query = """
+MATCH (e:`__Entity__`)
+WHERE e.name IS NOT NULL AND size(e.name) >= $min_length
+RETURN e.name AS name
+"""
+
+_word_re = re.compile(r"\w+")
+
+
+def normalize(text: str) -> str:
+    return " ".join(_word_re.findall(text.lower()))
+
+
+class _Automaton:
+    """
+    Aho-Corasick automaton over normalized entity names.
+    Immutable once built, so readers never need a lock.
+    """
+
+    def __init__(self, patterns: Dict[str, str]):
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.output: List[List[str]] = [[]]
+        for pattern in patterns:
+            self._insert(pattern)
+        self._build_failure_links()
+        self.patterns = patterns
+
+    def _insert(self, pattern: str) -> None:
+        state = 0
+        for char in pattern:
+            if char not in self.goto[state]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+                self.goto[state][char] = len(self.goto) - 1
+            state = self.goto[state][char]
+        self.output[state].append(pattern)
+
+    def _build_failure_links(self) -> None:
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(char, 0)
+                self.output[next_state] += self.output[self.fail[next_state]]
+
+    def search(self, text: str) -> List[Tuple[int, int, str]]:
+        """
+        Returns (start, end, pattern) for every pattern found in text
+        that starts and ends on a word boundary.
+        """
+        matches = []
+        state = 0
+        for position, char in enumerate(text):
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            for pattern in self.output[state]:
+                start = position - len(pattern) + 1
+                end = position + 1
+                if (start == 0 or text[start - 1] == " ") and (
+                    end == len(text) or text[end] == " "
+                ):
+                    matches.append((start, end, pattern))
+        return matches
+
+
+def _trigrams(text: str) -> Set[str]:
+    padded = f" {text} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+def _is_stop_phrase(text: str) -> bool:
+    return all(el in STOP_WORDS for el in text.split())
+
+
+class EntityGazetteer:
+    """
+    In-memory dictionary of entity names stored in the graph.
+
+    Names are matched with an Aho-Corasick automaton, so lookup cost depends
+    on the length of the question and not on the number of entities. Names
+    added by the writers go to a small delta automaton, which is merged into
+    the main one in the background once it grows past DELTA_SIZE. Expired
+    names are reloaded in the background as well, and the previous automata
+    keep serving lookups until then.
+
+    Misspelled names are found through a trigram index, so only names that
+    share trigrams with a question n-gram are compared.
+    """
+
+    def __init__(self, refresh_interval: int = REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self._names: Dict[str, str] = {}
+        # Names by the trigrams of their normalized form
+        self._trigram_index: Dict[str, List[str]] = defaultdict(list)
+        self._automaton: Optional[_Automaton] = None
+        # Added names that are not part of the main automaton yet
+        self._pending: Dict[str, str] = {}
+        self._delta = _Automaton({})
+        self._delta_dirty = False
+        self._loaded_at = 0.0
+        # A reload or merge is running in the background
+        self._refreshing = False
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    @staticmethod
+    def _indexable(key: str) -> bool:
+        return len(key) >= MIN_NAME_LENGTH and not _is_stop_phrase(key)
+
+    def refresh(self) -> None:
+        """
+        Reload all entity names from the database
+        """
+        data = read_query(entity_names_query, {"min_length": MIN_NAME_LENGTH})
+        names: Dict[str, str] = {}
+        trigram_index: Dict[str, List[str]] = defaultdict(list)
+        for row in data:
+            key = normalize(row["name"])
+            if self._indexable(key) and key not in names:
+                names[key] = row["name"]
+                for trigram in _trigrams(key):
+                    trigram_index[trigram].append(key)
+        automaton = _Automaton(names)
+        with self._lock:
+            # Names added while the database was read stay in the delta
+            pending = {
+                key: name for key, name in self._pending.items() if key not in names
+            }
+            for key, name in pending.items():
+                names[key] = name
+                for trigram in _trigrams(key):
+                    trigram_index[trigram].append(key)
+            self._names = names
+            self._trigram_index = trigram_index
+            self._automaton = automaton
+            self._pending = pending
+            self._delta_dirty = True
+            self._loaded_at = time.monotonic()
+        logging.info(f"Entity gazetteer loaded with {len(names)} names.")
+
+    def merge(self) -> None:
+        """
+        Rebuilds the main automaton with the added names
+        """
+        with self._lock:
+            names = dict(self._names)
+        automaton = _Automaton(names)
+        with self._lock:
+            self._automaton = automaton
+            self._pending = {
+                key: name for key, name in self._pending.items() if key not in names
+            }
+            self._delta_dirty = True
+
+    def _run_in_background(self, update: Callable[[], None]) -> None:
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                update()
+            except Exception as e:
+                logging.warning(f"Entity gazetteer update failed: {e}")
+            finally:
+                self._refreshing = False
+
+        # Runs in the context of the request, so in its tenant
+        threading.Thread(target=copy_context().run, args=(run,), daemon=True).start()
+
+    def add(self, names: Iterable[Optional[str]]) -> None:
+        """
+        Register names of newly written entities
+        """
+        with self._lock:
+            for name in names:
+                if not name:
+                    continue
+                key = normalize(name)
+                if self._indexable(key) and key not in self._names:
+                    self._names[key] = name
+                    self._pending[key] = name
+                    for trigram in _trigrams(key):
+                        self._trigram_index[trigram].append(key)
+                    self._delta_dirty = True
+
+    def _get_automata(self) -> Tuple[_Automaton, _Automaton]:
+        """
+        Main and delta automaton. Only the delta, which is bounded by
+        DELTA_SIZE, is ever rebuilt in the request path.
+        """
+        if self._automaton is None:
+            # Nothing to serve yet, the first lookups wait for a single load
+            with self._load_lock:
+                if self._automaton is None:
+                    self.refresh()
+        elif time.monotonic() - self._loaded_at > self.refresh_interval:
+            self._run_in_background(self.refresh)
+        if self._delta_dirty:
+            with self._lock:
+                if self._delta_dirty:
+                    self._delta = _Automaton(dict(self._pending))
+                    self._delta_dirty = False
+        if len(self._delta.patterns) > DELTA_SIZE:
+            self._run_in_background(self.merge)
+        return self._automaton, self._delta
+
+    def match(self, text: str) -> List[str]:
+        """
+        Returns database names of entities mentioned in the text.
+        Overlapping matches are resolved in favor of the longest name.
+        """
+        normalized = normalize(text)
+        matches = sorted(
+            (
+                (start, end, automaton.patterns[pattern])
+                for automaton in self._get_automata()
+                for start, end, pattern in automaton.search(normalized)
+            ),
+            key=lambda el: (el[0], -(el[1] - el[0])),
+        )
+        result = []
+        covered_until = 0
+        for start, end, name in matches:
+            if start < covered_until:
+                continue
+            result.append(name)
+            covered_until = end
+        return result
+
+    def _closest(self, ngram: str) -> Optional[str]:
+        """
+        Most similar name to the n-gram among the names sharing most of its
+        trigrams, or None when none is similar enough
+        """
+        trigrams = _trigrams(ngram)
+        with self._lock:
+            postings = [
+                self._trigram_index[el] for el in trigrams if el in self._trigram_index
+            ]
+        shared: Dict[str, int] = defaultdict(int)
+        for keys in postings:
+            # Trigrams common to many names say little about the n-gram
+            if len(keys) > MAX_TRIGRAM_POSTINGS:
+                continue
+            for key in keys:
+                shared[key] += 1
+        candidates = sorted(
+            (el for el, count in shared.items() if count >= len(trigrams) / 2),
+            key=lambda el: shared[el],
+            reverse=True,
+        )[:FUZZY_CANDIDATES]
+        best, best_ratio = None, FUZZY_CUTOFF
+        for key in candidates:
+            ratio = difflib.SequenceMatcher(None, ngram, key).ratio()
+            if ratio >= best_ratio:
+                best, best_ratio = key, ratio
+        return best
+
+    def fuzzy_match(self, text: str, max_ngram: int = 3) -> List[str]:
+        """
+        Matches word n-grams of the text against names sharing their
+        trigrams, allowing for small misspellings.
+        """
+        self._get_automata()
+        words = normalize(text).split()
+        result = []
+        for size in range(max_ngram, 0, -1):
+            for i in range(len(words) - size + 1):
+                ngram = " ".join(words[i : i + size])
+                if not self._indexable(ngram):
+                    continue
+                key = self._closest(ngram)
+                if key and self._names[key] not in result:
+                    result.append(self._names[key])
+        return result
+
+
+gazetteer = TenantLocal(lambda tenant: EntityGazetteer())
+
+
+@timed("entity_extraction")
+def extract_entities(input: Dict) -> Entities:
+    """
+    Finds entities in the question with the gazetteer and falls back
+    to LLM extraction only when nothing is found.
+    """
+    question = input["question"]
+    try:
+        names = gazetteer.match(question) or gazetteer.fuzzy_match(question)
+    except Exception as e:
+        logging.warning(f"Entity gazetteer lookup failed: {e}")
+        names = []
+    if names:
+        return Entities(names=names)
+    return entity_chain.invoke(input)
+
+
+entity_extractor = RunnableLambda(extract_entities).with_config(
+    run_name="EntityExtraction"
+)
@@ -1,25 +1,43 @@
+import asyncio
+import logging
+import math
 from typing import Any, Dict, List, Optional, Tuple, Type
 
+from entity_resolution import organization_resolver
 from langchain.agents import AgentExecutor
 from langchain.agents.format_scratchpad import format_to_openai_function_messages
 from langchain.agents.output_parsers import OpenAIFunctionsAgentOutputParser
 from langchain.callbacks.manager import CallbackManagerForToolRun
 from langchain.pydantic_v1 import BaseModel, Field
 from langchain.tools import BaseTool
+from langchain_community.vectorstores.neo4j_vector import remove_lucene_chars
+from langchain_core.documents import Document
 from langchain_core.messages import AIMessage, HumanMessage
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.utils.function_calling import convert_to_openai_function
-from utils import embeddings, generate_full_text_query, graph, llm, vector_index
+from metrics import timed
+from utils import (
+    aquery,
+    chunk_retrieval_query,
+    embeddings,
+    index_name,
+    keyword_index_name,
+    llm,
+    read_query,
+    vector_index,
+)
 
-candidate_query = """
-CALL db.index.fulltext.queryNodes('entity', $fulltextQuery, {limit: $limit})
-YIELD node
-WHERE node:Organization // Filter organization nodes
-RETURN distinct node.name AS candidate
-"""
 
+def _pick_candidates(input: str, candidates: List[str]) -> List[str]:
+    # If there is direct match return only that, otherwise return all options
+    direct_match = [el for el in candidates if el.lower() == input.lower()]
+    if direct_match:
+        return direct_match
+
+    return candidates
 
-def get_candidates(input: str, limit: int = 25) -> List[Dict[str, str]]:
+
+def get_candidates(input: str) -> List[str]:
     """
     Retrieve a list of candidate entities from database based on the input string.
 
@@ -28,79 +46,285 @@ def get_candidates(input: str, limit: int = 25) -> List[Dict[str, str]]:
     specified index in the database. The function returns a list of candidates
     matching the query.
     """
-    ft_query = generate_full_text_query(input)
-    print(ft_query)
-    candidates = graph.query(
-        candidate_query, {"fulltextQuery": ft_query, "index": "entity", "limit": limit}
+    return _pick_candidates(input, organization_resolver.resolve([input])[input])
+
+
+async def aget_candidates(input: str) -> List[str]:
+    candidates = await organization_resolver.aresolve([input])
+    return _pick_candidates(input, candidates[input])
+
+
+# Organization mentioned by the user was not found in the database
+NOT_FOUND_MESSAGE = (
+    "Tell the user that no organization named {organization} was found in the news."
+)
+# Number of text chunks returned by the unfiltered hybrid search
+HYBRID_K = 4
+
+
+# Filters matching fewer chunks than this are scanned exactly
+EXACT_SCAN_THRESHOLD = 2000
+# Extra vector index candidates fetched relative to the expected need
+OVERSAMPLE_FACTOR = 2
+# Upper bound for candidates requested from the vector index
+MAX_INDEX_CANDIDATES = 1000
+
+
+# Uses parallel runtime where available
+parallel_runtime = "CYPHER runtime = parallel parallelRuntimeSupport=all "
+
+return_snippet = "RETURN '#title ' + a.title + '\n#date ' + toString(a.date) + '\n#text ' + c.text AS output"
+
+
+def filtered_chunk_count_query(article_match: str) -> str:
+    return (
+        f"CALL {{ {article_match} "
+        "RETURN sum(count {(a)-[:HAS_CHUNK]->()}) AS filtered } "
+        "RETURN filtered, count {(:Chunk)} AS total"
     )
-    print(candidates)
-    # If there is direct match return only that, otherwise return all options
-    direct_match = [
-        el["candidate"] for el in candidates if el["candidate"].lower() == input.lower()
-    ]
-    if direct_match:
-        return direct_match
 
-    return [el["candidate"] for el in candidates]
 
+def exact_scan_query(article_match: str) -> str:
+    return (
+        f"{parallel_runtime}{article_match} "
+        "MATCH (a)-[:HAS_CHUNK]->(c:Chunk) "
+        "WITH c, a, vector.similarity.cosine(c.embedding,$embedding) AS score "
+        "ORDER BY score DESC LIMIT toInteger($k) " + return_snippet
+    )
 
-def get_organization_news(
-    topic: Optional[str] = None,
-    organization: Optional[str] = None,
-    sentiment: Optional[str] = None,
-) -> str:
-    # If there is no prefiltering, we can use vector index
-    if topic and not organization and not sentiment:
-        return vector_index.similarity_search(topic)
-    # Uses parallel runtime where available
-    base_query = (
-        "CYPHER runtime = parallel parallelRuntimeSupport=all "
-        "MATCH (c:Chunk)<-[:HAS_CHUNK]-(a:Article) WHERE "
+
+def index_post_filter_query(where: str) -> str:
+    return (
+        f"CALL db.index.vector.queryNodes('{index_name}', toInteger($candidates), "
+        "$embedding) YIELD node AS c, score "
+        f"MATCH (c)<-[:HAS_CHUNK]-(a:Article) WHERE {where} "
+        "WITH c, a, score ORDER BY score DESC LIMIT toInteger($k) " + return_snippet
     )
+
+
+# Max normalized vector and keyword search, as done by Neo4jVector hybrid search
+hybrid_search_query = (
+    """
+CALL {
+  CALL db.index.vector.queryNodes($index, toInteger($k), $embedding)
+  YIELD node, score
+  WITH collect({node: node, score: score}) AS nodes, max(score) AS max
+  UNWIND nodes AS n
+  RETURN n.node AS node, (n.score / max) AS score
+  UNION
+  CALL db.index.fulltext.queryNodes($keyword_index, $query, {limit: toInteger($k)})
+  YIELD node, score
+  WITH collect({node: node, score: score}) AS nodes, max(score) AS max
+  UNWIND nodes AS n
+  RETURN n.node AS node, (n.score / max) AS score
+}
+WITH node, max(score) AS score ORDER BY score DESC LIMIT toInteger($k)
+"""
+    + chunk_retrieval_query
+)
+
+
+def latest_query(article_match: str) -> str:
+    return (
+        f"{parallel_runtime}{article_match} "
+        "MATCH (a)-[:HAS_CHUNK]->(c:Chunk) "
+        "WITH c, a ORDER BY a.date DESC LIMIT toInteger($k) " + return_snippet
+    )
+
+
+def pick_vector_strategy(counts: Dict[str, Any], k: int) -> Tuple[str, int]:
+    """
+    Picks the vector search strategy based on filter selectivity.
+
+    Returns "exact" when few chunks pass the filter, so that scoring
+    each of them is cheaper than an index lookup. Otherwise returns "index"
+    along with the number of index candidates needed to expect `k` chunks
+    surviving the post-filter.
+    """
+    filtered, total = counts["filtered"] or 0, counts["total"] or 0
+    if filtered <= EXACT_SCAN_THRESHOLD or not total:
+        return "exact", filtered
+    selectivity = filtered / total
+    candidates = math.ceil(k / selectivity * OVERSAMPLE_FACTOR)
+    return "index", min(max(candidates, k), MAX_INDEX_CANDIDATES)
+
+
+def choose_vector_strategy(
+    article_match: str, params: Dict[str, Any]
+) -> Tuple[str, int]:
+    counts = read_query(filtered_chunk_count_query(article_match), params)
+    return pick_vector_strategy(counts[0], params["k"])
+
+
+async def achoose_vector_strategy(
+    article_match: str, params: Dict[str, Any]
+) -> Tuple[str, int]:
+    counts = await aquery(filtered_chunk_count_query(article_match), params)
+    return pick_vector_strategy(counts[0], params["k"])
+
+
+def follow_up(candidates: List[str]) -> Optional[str]:
+    if len(candidates) > 1:  # Ask for follow up if too many options
+        return (
+            "Ask a follow up question which of the available organizations "
+            f"did the user mean. Available options: {candidates}"
+        )
+    return None
+
+
+def build_filters(
+    organization: Optional[str], sentiment: Optional[str]
+) -> Tuple[str, str, Dict[str, Any]]:
+    """
+    Returns a MATCH clause binding the filtered articles to `a`, the same
+    filter as a per-article predicate, and their parameters.
+
+    The MATCH clause starts from the indexed organization node and its
+    MENTIONS relationships, or from the indexed sentiment bucket, so only
+    relevant articles are expanded to chunks. The predicate is used to
+    post-filter vector index results.
+    """
     where_queries = []
     params = {"k": 5}  # Define the number of text chunks to retrieve
     if organization:
-        # Map to database
-        candidates = get_candidates(organization)
-        if len(candidates) > 1:  # Ask for follow up if too many options
-            return (
-                "Ask a follow up question which of the available organizations "
-                f"did the user mean. Available options: {candidates}"
-            )
+        article_match = (
+            "MATCH (:`__Entity__`:Organization {name: $organization})"
+            "<-[:MENTIONS]-(a:Article)"
+        )
         where_queries.append(
             "EXISTS {(a)-[:MENTIONS]->(:Organization {name: $organization})}"
         )
-        params["organization"] = candidates[0]
+        params["organization"] = organization
+    else:
+        article_match = "MATCH (a:Article)"
     if sentiment:
-        if sentiment == "positive":
-            where_queries.append("a.sentiment > $sentiment")
-            params["sentiment"] = 0.5
-        else:
-            where_queries.append("a.sentiment < $sentiment")
-            params["sentiment"] = -0.5
-    if topic:  # Do vector comparison
-        vector_snippet = (
-            " WITH c, a, vector.similarity.cosine(c.embedding,$embedding) AS score "
-            "ORDER BY score DESC LIMIT toInteger($k) "
+        where_queries.append("a.sentiment_bucket = $sentiment_bucket")
+        params["sentiment_bucket"] = (
+            "positive" if sentiment == "positive" else "negative"
         )
-        params["embedding"] = embeddings.embed_query(topic)
-        params["topic"] = topic
-    else:  # Just return the latest data
-        vector_snippet = " WITH c, a ORDER BY a.date DESC LIMIT toInteger($k) "
+        article_match += " WHERE a.sentiment_bucket = $sentiment_bucket"
+    return article_match, " AND ".join(where_queries) or "true", params
 
-    return_snippet = "RETURN '#title ' + a.title + '\n#date ' + toString(a.date) + '\n#text ' + c.text AS output"
 
-    complete_query = (
-        base_query + " AND ".join(where_queries) + vector_snippet + return_snippet
-    )
-    data = graph.query(complete_query, params)
-    print(f"Cypher: {complete_query}\n")
-    # Safely remove embedding before printing
-    params.pop("embedding", None)
-    print(f"Parameters: {params}")
+def format_news(data: List[Dict[str, Any]]) -> str:
     return "###Article: ".join([el["output"] for el in data])
 
 
+def to_documents(data: List[Dict[str, Any]]) -> List[Document]:
+    """Converts hybrid search rows to documents like Neo4jVector does"""
+    return [
+        Document(
+            page_content=el["text"],
+            metadata={k: v for k, v in el["metadata"].items() if v is not None},
+        )
+        for el in data
+    ]
+
+
+async def ahybrid_search(topic: str) -> List[Document]:
+    params = {
+        "index": index_name,
+        "keyword_index": keyword_index_name,
+        "k": HYBRID_K,
+        "embedding": await embeddings.aembed_query(topic),
+        "query": remove_lucene_chars(topic),
+    }
+    return to_documents(await aquery(hybrid_search_query, params))
+
+
+@timed("vector_search")
+def get_organization_news(
+    topic: Optional[str] = None,
+    organization: Optional[str] = None,
+    sentiment: Optional[str] = None,
+    strategy: Optional[str] = None,
+) -> str:
+    """
+    Retrieves text chunks of news articles, optionally filtered by a
+    mentioned organization and article sentiment.
+
+    With filters and a topic, the vector strategy is chosen by selectivity
+    unless `strategy` forces either "exact" or "index".
+    """
+    # If there is no prefiltering, we can use vector index
+    if topic and not organization and not sentiment:
+        return vector_index.similarity_search(topic, k=HYBRID_K)
+    if organization:
+        # Map to database
+        candidates = get_candidates(organization)
+        if not candidates:
+            return NOT_FOUND_MESSAGE.format(organization=organization)
+        if follow_up(candidates):
+            return follow_up(candidates)
+        organization = candidates[0]
+    article_match, where, params = build_filters(organization, sentiment)
+
+    if not topic:  # Just return the latest data
+        return format_news(read_query(latest_query(article_match), params))
+    # Do vector comparison
+    if not strategy:
+        strategy, index_candidates = choose_vector_strategy(article_match, params)
+    else:
+        index_candidates = MAX_INDEX_CANDIDATES
+    params["embedding"] = embeddings.embed_query(topic)
+    params["topic"] = topic
+    if strategy == "index":
+        params["candidates"] = index_candidates
+        data = read_query(index_post_filter_query(where), params)
+        # Too few candidates survived the post-filter
+        if len(data) < params["k"]:
+            strategy = "exact"
+    if strategy == "exact":
+        data = read_query(exact_scan_query(article_match), params)
+    logging.debug(f"Prefiltered vector search used strategy: {strategy}")
+    return format_news(data)
+
+
+@timed("vector_search")
+async def aget_organization_news(
+    topic: Optional[str] = None,
+    organization: Optional[str] = None,
+    sentiment: Optional[str] = None,
+    strategy: Optional[str] = None,
+) -> str:
+    """
+    Async version of get_organization_news using the async Neo4j driver
+    and embeddings client
+    """
+    if topic and not organization and not sentiment:
+        return await ahybrid_search(topic)
+    if organization:
+        candidates = await aget_candidates(organization)
+        if not candidates:
+            return NOT_FOUND_MESSAGE.format(organization=organization)
+        if follow_up(candidates):
+            return follow_up(candidates)
+        organization = candidates[0]
+    article_match, where, params = build_filters(organization, sentiment)
+
+    if not topic:
+        return format_news(await aquery(latest_query(article_match), params))
+    if not strategy:
+        # Selectivity and the embedding are independent, fetch them concurrently
+        (strategy, index_candidates), params["embedding"] = await asyncio.gather(
+            achoose_vector_strategy(article_match, params),
+            embeddings.aembed_query(topic),
+        )
+    else:
+        index_candidates = MAX_INDEX_CANDIDATES
+        params["embedding"] = await embeddings.aembed_query(topic)
+    params["topic"] = topic
+    if strategy == "index":
+        params["candidates"] = index_candidates
+        data = await aquery(index_post_filter_query(where), params)
+        if len(data) < params["k"]:
+            strategy = "exact"
+    if strategy == "exact":
+        data = await aquery(exact_scan_query(article_match), params)
+    logging.debug(f"Prefiltered vector search used strategy: {strategy}")
+    return format_news(data)
+
+
 fewshot_examples = """{Input:What are the health benefits for Google employees in the news? Topic: Health benefits}
 {Input: What is the latest positive news about Google? Topic: None}
 {Input: Are there any news about VertexAI regarding Google? Topic: VertexAI}
@@ -144,7 +368,7 @@ class NewsTool(BaseTool):
         run_manager: Optional[CallbackManagerForToolRun] = None,
     ) -> str:
         """Use the tool asynchronously."""
-        return get_organization_news(topic, organization, sentiment)
+        return await aget_organization_news(topic, organization, sentiment)
 
 
 tools = [NewsTool()]
@@ -179,9 +403,9 @@ def _format_chat_history(chat_history: List[Tuple[str, str]]):
 prefiltering_agent = (
     {
         "input": lambda x: x["input"],
-        "chat_history": lambda x: _format_chat_history(x["chat_history"])
-        if x.get("chat_history")
-        else [],
+        "chat_history": lambda x: (
+            _format_chat_history(x["chat_history"]) if x.get("chat_history") else []
+        ),
         "agent_scratchpad": lambda x: format_to_openai_function_messages(
             x["intermediate_steps"]
         ),
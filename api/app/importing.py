@@ -1,16 +1,42 @@
+import asyncio
+import hashlib
 import logging
 import os
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
+import numpy as np
 import requests
-from utils import embeddings, text_splitter
+from chunking import Chunker, chunker
+from metrics import chunks_total, stage, timed
+from utils import (
+    aembed_texts,
+    aquery,
+    embed_texts,
+    http_client,
+    read_query,
+)
 
 CATEGORY_THRESHOLD = 0.50
 params = []
 
 DIFF_TOKEN = os.environ["DIFFBOT_API_KEY"]
+# Diffbot Knowledge Graph host, overridable to point at a local stand-in
+DIFFBOT_KG_URL = os.environ.get("DIFFBOT_KG_URL", "https://kg.diffbot.com")
+
+
+def articles_url(
+    query: Optional[str], tag: Optional[str], size: int = 5, offset: int = 0
+) -> str:
+    search_host = f"{DIFFBOT_KG_URL}/kg/v3/dql?"
+    search_query = 'query=type%3AArticle+strict%3Alanguage%3A"en"+sortBy%3Adate'
+    if query:
+        search_query += f'+text%3A"{query}"'
+    if tag:
+        search_query += f'+tags.label%3A"{tag}"'
+    return f"{search_host}{search_query}&token={DIFF_TOKEN}&from={offset}&size={size}"
 
 
+@timed("dql_fetch")
 def get_articles(
     query: Optional[str], tag: Optional[str], size: int = 5, offset: int = 0
 ) -> Dict[str, Any]:
@@ -18,20 +44,20 @@ def get_articles(
     Fetch relevant articles from Diffbot KG endpoint
     """
     try:
-        search_host = "https://kg.diffbot.com/kg/v3/dql?"
-        search_query = f'query=type%3AArticle+strict%3Alanguage%3A"en"+sortBy%3Adate'
-        if query:
-            search_query += f'+text%3A"{query}"'
-        if tag:
-            search_query += f'+tags.label%3A"{tag}"'
-        url = (
-            f"{search_host}{search_query}&token={DIFF_TOKEN}&from={offset}&size={size}"
-        )
-        return requests.get(url).json()
+        return requests.get(articles_url(query, tag, size, offset)).json()
     except Exception as ex:
         raise ex
 
 
+@timed("dql_fetch")
+async def aget_articles(
+    query: Optional[str], tag: Optional[str], size: int = 5, offset: int = 0
+) -> Dict[str, Any]:
+    response = await http_client.get(articles_url(query, tag, size, offset))
+    # Article payloads are large, parse them off the event loop
+    return await asyncio.to_thread(response.json)
+
+
 def get_tag_type(types: List[str]) -> str:
     try:
         return types[0].split("/")[-1]
@@ -39,15 +65,42 @@ def get_tag_type(types: List[str]) -> str:
         return "Node"
 
 
-def process_params(data):
+def chunk_ids(article_id: str, texts: List[str]) -> List[str]:
+    """
+    Chunk ids derived from the chunk text, so unchanged chunks keep their id
+    and embedding when the article text changes. Repeated texts are numbered.
+    """
+    ids = []
+    counts = {}
+    for text in texts:
+        digest = hashlib.sha256(text.encode()).hexdigest()[:16]
+        counts[digest] = counts.get(digest, 0) + 1
+        suffix = f"-{counts[digest]}" if counts[digest] > 1 else ""
+        ids.append(f"{article_id}-{digest}{suffix}")
+    return ids
+
+
+def split_article(
+    id: str, text: str, splitter: Chunker = chunker
+) -> List[Dict[str, Any]]:
+    texts = splitter.split(text)
+    return [
+        {"text": el, "index": chunk_id, "position": i}
+        for i, (el, chunk_id) in enumerate(zip(texts, chunk_ids(id, texts)))
+    ]
+
+
+@timed("splitting")
+def article_params(data) -> Tuple[List[Dict], List[Dict]]:
+    """
+    Splits articles into chunks and builds import parameters, without
+    embeddings. Returns the parameters and all chunks.
+    """
     params = []
     all_chunks = []
     for row in data["data"]:
         article = row["entity"]
-        split_chunks = [
-            {"text": el, "index": f"{article['id']}-{i}"}
-            for i, el in enumerate(text_splitter.split_text(article["text"])[:5])
-        ]
+        split_chunks = split_article(article["id"], article["text"])
         all_chunks.extend(split_chunks)
         params.append(
             {
@@ -75,12 +128,18 @@ def process_params(data):
                 "page_url": article["pageUrl"],
                 "id": article["id"],
                 "chunks": split_chunks,
+                "chunking": chunker.config.fingerprint,
             }
         )
     logging.info(f"Number of text chunks: {len(all_chunks)}.")
-    # Make a single request for embeddings
-    embedded_documents = embeddings.embed_documents([el["text"] for el in all_chunks])
-    # Assign embeddings to chunks in params using a dictionary
+    return params, all_chunks
+
+
+def add_embeddings(
+    params: List[Dict], all_chunks: List[Dict], embedded_documents: np.ndarray
+) -> List[Dict]:
+    # Assign embeddings to chunks in params using a dictionary. Rows are views
+    # into the float32 matrix, which the driver packs without copies to lists
     chunk_embedding_map = {
         chunk["index"]: embedded_documents[i] for i, chunk in enumerate(all_chunks)
     }
@@ -93,10 +152,104 @@ def process_params(data):
     return params
 
 
-import_cypher_query = """
+existing_chunks_query = """
+UNWIND $ids AS id
+MATCH (c:Chunk {id: id})
+WHERE c.embedding IS NOT NULL
+RETURN c.id AS id
+"""
+
+
+def _new_chunks(all_chunks: List[Dict], existing: List[Dict]) -> List[Dict]:
+    existing_ids = {el["id"] for el in existing}
+    return [el for el in all_chunks if el["index"] not in existing_ids]
+
+
+def _log_embedding(new_chunks: List[Dict], all_chunks: List[Dict]) -> None:
+    logging.info(
+        f"Embedding {len(new_chunks)} new or changed chunks, "
+        f"{len(all_chunks) - len(new_chunks)} are unchanged."
+    )
+
+
+def process_params(data, reuse_existing: bool = True):
+    """
+    Splits and embeds articles. With `reuse_existing`, chunks already stored
+    with their embedding are not embedded again and get no embedding in the
+    parameters, which the import query leaves untouched. Without it, every
+    chunk is embedded and the database isn't queried.
+    """
+    params, all_chunks = article_params(data)
+    new_chunks = all_chunks
+    if reuse_existing:
+        existing = read_query(
+            existing_chunks_query, {"ids": [el["index"] for el in all_chunks]}
+        )
+        new_chunks = _new_chunks(all_chunks, existing)
+        _log_embedding(new_chunks, all_chunks)
+    # Make a single request for embeddings
+    with stage("embedding"):
+        embedded_documents = embed_texts([el["text"] for el in new_chunks])
+    chunks_total.inc(len(new_chunks))
+    return add_embeddings(params, new_chunks, embedded_documents)
+
+
+async def aprocess_params(data, reuse_existing: bool = True):
+    # Token splitting is CPU-bound
+    params, all_chunks = await asyncio.to_thread(article_params, data)
+    new_chunks = all_chunks
+    if reuse_existing:
+        existing = await aquery(
+            existing_chunks_query, {"ids": [el["index"] for el in all_chunks]}
+        )
+        new_chunks = _new_chunks(all_chunks, existing)
+        _log_embedding(new_chunks, all_chunks)
+    with stage("embedding"):
+        embedded_documents = await aembed_texts([el["text"] for el in new_chunks])
+    chunks_total.inc(len(new_chunks))
+    return add_embeddings(params, new_chunks, embedded_documents)
+
+
+# Replaces the chunks of an article with row.chunks, keeping the stored
+# embedding of unchanged ones. Returns the ids of removed chunks.
+store_chunks_cypher = """
+WITH a, row
+// Chunks of the previous text that are no longer part of the article
+CALL {
+  WITH a, row
+  MATCH (a)-[:HAS_CHUNK]->(old:Chunk)
+  WHERE NOT old.id IN [el IN row.chunks | el.index]
+  WITH old, old.id AS id
+  DETACH DELETE old
+  RETURN collect(id) AS removed
+}
+CALL {
+  WITH a, row
+  UNWIND row.chunks AS chunk
+  MERGE (c:Chunk {id: chunk.index})
+  SET c.text = chunk.text,
+      c.index = chunk.index,
+      c.position = chunk.position
+  MERGE (a)-[:HAS_CHUNK]->(c)
+  // Unchanged chunks keep their stored embedding
+  WITH c, chunk
+  WHERE chunk.embedding IS NOT NULL
+  CALL db.create.setNodeVectorProperty(c, 'embedding', chunk.embedding)
+  RETURN count(*) AS embedded
+}
+RETURN removed
+"""
+
+import_cypher_query = (
+    """
 UNWIND $data AS row
 MERGE (a:Article {id:row.id})
-SET a.sentiment = toFloat(row.sentiment),
+SET a.chunking = row.chunking,
+    a.sentiment = toFloat(row.sentiment),
+    a.sentiment_bucket = CASE WHEN toFloat(row.sentiment) > 0.5 THEN 'positive'
+                              WHEN toFloat(row.sentiment) < -0.5 THEN 'negative'
+                              WHEN -0.5 < toFloat(row.sentiment) < 0.5 THEN 'neutral'
+                              ELSE 'unclassified' END,
     a.title = row.title,
     a.text = row.text,
     a.language = row.language,
@@ -105,7 +258,7 @@ SET a.sentiment = toFloat(row.sentiment),
 MERGE (s:Site {name: row.site_name})
 ON CREATE SET s.publisherRegion = row.publisher_region
 MERGE (a)-[:ON_SITE]->(s)
-FOREACH (category in row.category |
+FOREACH (category in row.categories |
   MERGE (c:Category {name: category}) MERGE (a)-[:IN_CATEGORY]->(c)
 )
 FOREACH (tag in row.tags |
@@ -117,12 +270,17 @@ FOREACH (i in CASE WHEN row.author IS NOT NULL THEN [1] ELSE [] END |
   MERGE (a)-[:HAS_AUTHOR]->(au)
   MERGE (au)-[:WRITES_FOR]->(s)
 )
-WITH a, row
-UNWIND row.chunks AS chunk
-  MERGE (c:Chunk {id: chunk.index})
-  SET c.text = chunk.text,
-      c.index = chunk.index
-  MERGE (a)-[:HAS_CHUNK]->(c)
-  WITH c, chunk
-  CALL db.create.setNodeVectorProperty(c, 'embedding', chunk.embedding)
 """
+    + store_chunks_cypher
+)
+
+# Labels and relationship types written by the import query
+import_labels = ["Article", "Site", "Category", "Tag", "Author", "Chunk"]
+import_relationship_types = [
+    "ON_SITE",
+    "IN_CATEGORY",
+    "HAS_TAG",
+    "HAS_AUTHOR",
+    "WRITES_FOR",
+    "HAS_CHUNK",
+]
@@ -0,0 +1,495 @@
+import fcntl
+import json
+import logging
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from contextvars import copy_context
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from utils import EMBEDDING_DIMENSIONS, TenantLocal, embeddings, read_query
+
+LOCAL_INDEX_PATH = os.environ.get("LOCAL_INDEX_PATH", "local_index")
+# Below this size every vector is scored, above it the IVF lists are probed
+BRUTE_FORCE_LIMIT = 20000
+# Number of closest IVF lists scanned per query
+NPROBE = 8
+# Retrain centroids when the index grows by this factor since the last training
+RETRAIN_GROWTH = 4
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE = 50000
+# Chunk embeddings read from the database per query while building
+BUILD_BATCH_SIZE = 5000
+
+chunk_embeddings_query = """
+MATCH (c:Chunk)
+WHERE c.id > $cursor AND c.embedding IS NOT NULL
+RETURN c.id AS id, c.embedding AS embedding
+ORDER BY c.id
+LIMIT toInteger($limit)
+"""
+
+hydrate_query = """
+UNWIND $ids AS id
+MATCH (a:Article)-[:HAS_CHUNK]->(c:Chunk {id: id})
+RETURN c.id AS id, c.text AS text, c.position AS position,
+       a.id AS article_id, a.title AS title,
+       toString(a.date) AS date, a.pageUrl AS page_url
+"""
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return (vectors / norms).astype(np.float32)
+
+
+def _kmeans(vectors: np.ndarray, nlist: int, seed: int = 42) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    if len(vectors) > KMEANS_SAMPLE:
+        vectors = vectors[rng.choice(len(vectors), KMEANS_SAMPLE, replace=False)]
+    centroids = vectors[rng.choice(len(vectors), nlist, replace=False)].copy()
+    for _ in range(KMEANS_ITERATIONS):
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        for i in range(nlist):
+            members = vectors[assignments == i]
+            if len(members):
+                centroids[i] = members.mean(axis=0)
+        centroids = _normalize(centroids)
+    return centroids
+
+
+class _Snapshot:
+    """
+    Read-only view of the index used by searches
+    """
+
+    def __init__(
+        self,
+        ids: List[str],
+        vectors: np.ndarray,
+        centroids: Optional[np.ndarray],
+        assignments: np.ndarray,
+        deleted: Optional[np.ndarray] = None,
+    ):
+        self.ids = ids
+        self.vectors = vectors
+        self.centroids = centroids
+        # Mask of removed rows, replaced when rows are removed
+        self.deleted = (
+            deleted if deleted is not None else np.zeros(len(ids), dtype=bool)
+        )
+        # Inverted lists as a permutation of rows sorted by centroid
+        self.order = np.argsort(assignments, kind="stable")
+        self.offsets = np.searchsorted(
+            assignments[self.order],
+            np.arange(len(centroids) + 1 if centroids is not None else 1),
+        )
+
+    def search(self, query: np.ndarray, k: int) -> List[Tuple[int, float]]:
+        if not self.ids or k < 1:
+            return []
+        if self.centroids is None or len(self.ids) <= BRUTE_FORCE_LIMIT:
+            rows = np.arange(len(self.ids))
+            scores = self.vectors @ query
+        else:
+            probes = np.argsort(self.centroids @ query)[::-1][:NPROBE]
+            rows = np.concatenate(
+                [self.order[self.offsets[p] : self.offsets[p + 1]] for p in probes]
+            )
+            scores = self.vectors[rows] @ query
+        # Cosine scores can be negative, so removed rows are ranked last
+        scores[self.deleted[rows]] = -np.inf
+        k = min(k, len(rows))
+        top = np.argpartition(scores, -k)[-k:]
+        top = top[np.argsort(scores[top])[::-1]]
+        return [(int(rows[i]), float(scores[i])) for i in top if scores[i] > -np.inf]
+
+
+class LocalVectorIndex:
+    """
+    In-process IVF index over Chunk embeddings.
+
+    Normalized float32 vectors are appended to a memory-mapped file, so the
+    index survives restarts and is shared through the page cache between
+    workers. Chunk text and Article metadata stay in Neo4j and are hydrated
+    for the top results with a single query.
+
+    Files in the index directory:
+        vectors.f32      row-major float32 matrix
+        ids.json         chunk id of each row
+        centroids.npy    IVF centroids
+        assignments.npy  IVF list of each row
+        deleted.npy      rows of removed chunks, until the next build
+        manifest.json    dimension, size and training size
+
+    The index is built by `python startup.py` when it doesn't exist yet.
+    Until then `is_ready` builds it in the background and searches are
+    served by Neo4j.
+    """
+
+    def __init__(self, path: str = LOCAL_INDEX_PATH):
+        self.path = path
+        self._snapshot: Optional[_Snapshot] = None
+        self._manifest_mtime = 0.0
+        self._deleted_mtime = 0
+        self._building = False
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    @contextmanager
+    def _write_lock(self):
+        os.makedirs(self.path, exist_ok=True)
+        with self._lock, open(self._file(".lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_manifest(self) -> Optional[Dict]:
+        try:
+            with open(self._file("manifest.json")) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _deleted_version(self) -> int:
+        try:
+            return os.stat(self._file("deleted.npy")).st_mtime_ns
+        except FileNotFoundError:
+            return 0
+
+    def _deleted_rows(self) -> np.ndarray:
+        try:
+            return np.load(self._file("deleted.npy"))
+        except FileNotFoundError:
+            return np.zeros(0, dtype=np.int64)
+
+    def _write_deleted(self, rows: np.ndarray) -> None:
+        self._replace("deleted.npy", lambda f: np.save(f, rows.astype(np.int64)))
+
+    def _read_deleted(self, size: int) -> np.ndarray:
+        """
+        Mask of the removed rows. Must be read after `_deleted_version`, so
+        removals in between are picked up by the next search.
+        """
+        rows = self._deleted_rows()
+        mask = np.zeros(size, dtype=bool)
+        mask[rows[rows < size]] = True
+        return mask
+
+    def _load(self) -> None:
+        manifest = self._read_manifest()
+        if manifest is None:
+            raise RuntimeError(f"Local vector index {self.path} is not built")
+        with open(self._file("ids.json")) as f:
+            ids = json.load(f)
+        size, dimension = manifest["size"], manifest["dimension"]
+        vectors = (
+            np.memmap(
+                self._file("vectors.f32"),
+                dtype=np.float32,
+                mode="r",
+                shape=(size, dimension),
+            )
+            if size
+            else np.zeros((0, dimension), dtype=np.float32)
+        )
+        centroids = (
+            np.load(self._file("centroids.npy"))
+            if os.path.exists(self._file("centroids.npy"))
+            else None
+        )
+        assignments = (
+            np.load(self._file("assignments.npy"))
+            if centroids is not None
+            else np.zeros(size, dtype=np.int32)
+        )
+        self._deleted_mtime = self._deleted_version()
+        self._snapshot = _Snapshot(
+            ids[:size],
+            vectors,
+            centroids,
+            assignments[:size],
+            self._read_deleted(size),
+        )
+        self._manifest_mtime = os.path.getmtime(self._file("manifest.json"))
+
+    def _is_stale(self) -> bool:
+        manifest_file = self._file("manifest.json")
+        return (
+            self._snapshot is None
+            or not os.path.exists(manifest_file)
+            or os.path.getmtime(manifest_file) != self._manifest_mtime
+        )
+
+    def _get_snapshot(self) -> _Snapshot:
+        if self._is_stale():
+            with self._load_lock:
+                if self._is_stale():
+                    self._load()
+        if self._deleted_version() != self._deleted_mtime:
+            with self._load_lock:
+                self._deleted_mtime = self._deleted_version()
+                self._snapshot.deleted = self._read_deleted(len(self._snapshot.ids))
+        return self._snapshot
+
+    def _write_lists(
+        self,
+        ids: List[str],
+        dimension: int,
+        centroids: Optional[np.ndarray],
+        assignments: Optional[np.ndarray],
+        trained_size: int,
+    ) -> None:
+        """
+        Writes everything but the vectors. Must be called with the write lock held.
+        The manifest is written last, which makes the update visible to readers.
+        """
+        self._replace("ids.json", lambda f: f.write(json.dumps(ids).encode()))
+        if centroids is not None:
+            self._replace("centroids.npy", lambda f: np.save(f, centroids))
+            self._replace("assignments.npy", lambda f: np.save(f, assignments))
+        elif os.path.exists(self._file("centroids.npy")):
+            os.remove(self._file("centroids.npy"))
+        manifest = {"size": len(ids), "dimension": dimension}
+        manifest["trained_size"] = trained_size
+        self._replace("manifest.json", lambda f: f.write(json.dumps(manifest).encode()))
+
+    def _replace(self, name: str, write: Callable) -> None:
+        """
+        Atomically replaces a file, so readers never see partial writes
+        """
+        with open(self._file(name + ".tmp"), "wb") as f:
+            write(f)
+        os.replace(self._file(name + ".tmp"), self._file(name))
+
+    @staticmethod
+    def _assign(
+        vectors: np.ndarray, centroids: np.ndarray, batch_size: int = 10000
+    ) -> np.ndarray:
+        return np.concatenate(
+            [
+                np.argmax(vectors[i : i + batch_size] @ centroids.T, axis=1)
+                for i in range(0, len(vectors), batch_size)
+            ]
+            or [np.zeros(0)]
+        ).astype(np.int32)
+
+    @staticmethod
+    def _train(vectors: np.ndarray) -> Optional[np.ndarray]:
+        if len(vectors) <= BRUTE_FORCE_LIMIT:
+            return None
+        return _kmeans(vectors, int(np.sqrt(len(vectors))))
+
+    def exists(self) -> bool:
+        return os.path.exists(self._file("manifest.json"))
+
+    @staticmethod
+    def _write_embeddings(f, batch_size: int = BUILD_BATCH_SIZE) -> Tuple[List, int]:
+        """
+        Writes normalized chunk embeddings to the file in batches.
+        Returns the chunk ids and the dimension.
+        """
+        ids = []
+        dimension = EMBEDDING_DIMENSIONS
+        cursor = ""
+        while True:
+            data = read_query(
+                chunk_embeddings_query, {"cursor": cursor, "limit": batch_size}
+            )
+            if not data:
+                return ids, dimension
+            vectors = _normalize(
+                np.array([el["embedding"] for el in data], dtype=np.float32)
+            )
+            if not ids:
+                dimension = vectors.shape[1]
+            elif vectors.shape[1] != dimension:
+                raise ValueError(
+                    f"Chunk embeddings have {vectors.shape[1]} dimensions, "
+                    f"expected {dimension}"
+                )
+            f.write(vectors.tobytes())
+            ids.extend(el["id"] for el in data)
+            cursor = data[-1]["id"]
+
+    def build(self) -> int:
+        """
+        Rebuilds the index from all chunk embeddings in the database.
+        Embeddings are streamed to disk, so memory use doesn't grow with
+        the number of chunks.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        # Concurrent builds of other workers write their own file
+        fd, path = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                ids, dimension = self._write_embeddings(f)
+            vectors = (
+                np.memmap(path, dtype=np.float32, mode="r", shape=(len(ids), dimension))
+                if ids
+                else np.zeros((0, dimension), dtype=np.float32)
+            )
+            centroids = self._train(vectors)
+            assignments = (
+                self._assign(vectors, centroids) if centroids is not None else None
+            )
+            with self._write_lock():
+                os.replace(path, self._file("vectors.f32"))
+                # Rows are numbered again, removed chunks are not part of the build
+                if os.path.exists(self._file("deleted.npy")):
+                    os.remove(self._file("deleted.npy"))
+                self._write_lists(ids, dimension, centroids, assignments, len(ids))
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+        logging.info(f"Local vector index built with {len(ids)} chunks.")
+        return len(ids)
+
+    def _background_build(self) -> None:
+        try:
+            self.build()
+        except Exception as e:
+            logging.warning(f"Local vector index build failed: {e}")
+        finally:
+            self._building = False
+
+    def is_ready(self) -> bool:
+        """
+        Whether the index was built. Otherwise starts building it in the
+        background, so requests don't wait for a full scan of the chunks.
+        """
+        if self.exists():
+            return True
+        with self._lock:
+            start = not self._building
+            self._building = True
+        if start:
+            # Runs in the context of the request, so in its tenant
+            threading.Thread(
+                target=copy_context().run,
+                args=(self._background_build,),
+                daemon=True,
+            ).start()
+        return False
+
+    def add(self, ids: List[str], vectors: List[np.ndarray]) -> None:
+        """
+        Inserts or replaces chunk embeddings.
+        New vectors are appended to the memory-mapped file in place.
+        """
+        if not ids or self._read_manifest() is None:
+            # Chunks stored before the build are read from the database
+            return
+        new_vectors = _normalize(np.array(vectors, dtype=np.float32))
+        with self._write_lock():
+            manifest = self._read_manifest()
+            with open(self._file("ids.json")) as f:
+                all_ids = json.load(f)[: manifest["size"]]
+            positions = {id: i for i, id in enumerate(all_ids)}
+            dimension = manifest["dimension"]
+            centroids = (
+                np.load(self._file("centroids.npy"))
+                if os.path.exists(self._file("centroids.npy"))
+                else None
+            )
+            assignments = (
+                np.load(self._file("assignments.npy"))[: manifest["size"]]
+                if centroids is not None
+                else None
+            )
+            changed_rows = []
+            with open(self._file("vectors.f32"), "r+b") as f:
+                for id, vector in zip(ids, new_vectors):
+                    if id not in positions:
+                        positions[id] = len(all_ids)
+                        all_ids.append(id)
+                    changed_rows.append(positions[id])
+                    f.seek(positions[id] * dimension * 4)
+                    f.write(vector.tobytes())
+            trained_size = manifest["trained_size"]
+            if len(all_ids) > max(trained_size, 1) * RETRAIN_GROWTH or (
+                centroids is None and len(all_ids) > BRUTE_FORCE_LIMIT
+            ):
+                vectors = np.memmap(
+                    self._file("vectors.f32"),
+                    dtype=np.float32,
+                    mode="r",
+                    shape=(len(all_ids), dimension),
+                )
+                centroids = self._train(vectors)
+                assignments = self._assign(vectors, centroids)
+                trained_size = len(all_ids)
+            elif centroids is not None:
+                assignments = np.resize(assignments, len(all_ids))
+                assignments[changed_rows] = self._assign(new_vectors, centroids)
+            # Chunks stored again after their removal are searchable again
+            deleted = self._deleted_rows()
+            if np.isin(changed_rows, deleted).any():
+                self._write_deleted(np.setdiff1d(deleted, changed_rows))
+            self._write_lists(all_ids, dimension, centroids, assignments, trained_size)
+
+    def remove(self, ids: List[str]) -> None:
+        """
+        Removes chunk embeddings by zeroing their rows and recording them as
+        deleted, so searches skip them. Their ids are dropped on the next
+        build.
+        """
+        if not ids or self._read_manifest() is None:
+            return
+        with self._write_lock():
+            manifest = self._read_manifest()
+            with open(self._file("ids.json")) as f:
+                all_ids = json.load(f)[: manifest["size"]]
+            positions = {id: i for i, id in enumerate(all_ids)}
+            dimension = manifest["dimension"]
+            empty = np.zeros(dimension, dtype=np.float32).tobytes()
+            rows = [positions[id] for id in ids if id in positions]
+            with open(self._file("vectors.f32"), "r+b") as f:
+                for row in rows:
+                    f.seek(row * dimension * 4)
+                    f.write(empty)
+            if rows:
+                # Searches reload the mask when the file changes
+                self._write_deleted(np.union1d(self._deleted_rows(), rows))
+
+    def similarity_search_with_score_by_vector(
+        self, embedding: List[float], k: int = 4
+    ) -> List[Tuple[Document, float]]:
+        snapshot = self._get_snapshot()
+        query = _normalize(np.array([embedding], dtype=np.float32))[0]
+        hits = snapshot.search(query, k)
+        ids = [snapshot.ids[row] for row, _ in hits]
+        rows = {el["id"]: el for el in read_query(hydrate_query, {"ids": ids})}
+        documents = []
+        for (row, score), id in zip(hits, ids):
+            if id not in rows:
+                continue
+            metadata = {key: value for key, value in rows[id].items() if key != "text"}
+            documents.append(
+                (Document(page_content=rows[id]["text"], metadata=metadata), score)
+            )
+        return documents
+
+    def similarity_search_with_score(
+        self, query: str, k: int = 4
+    ) -> List[Tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(
+            embeddings.embed_query(query), k
+        )
+
+    def similarity_search(self, query: str, k: int = 4) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+
+local_index = TenantLocal(
+    lambda tenant: LocalVectorIndex(tenant.path(LOCAL_INDEX_PATH))
+)
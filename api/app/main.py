@@ -1,28 +1,37 @@
+import asyncio
 import logging
 import os
-from concurrent.futures import ThreadPoolExecutor
-from typing import Any, Dict
+import time
+from typing import Any, Dict, Optional
 
 from api_types import ArticleData, CountData, EntityData
 from chat import chain
-from enhance import process_entities, store_enhanced_data
-from fastapi import FastAPI, HTTPException
+from dashboard import dashboard_stats
+from enhance import aprocess_entities, store_enhanced_data
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from graph_prefiltering import prefiltering_agent_executor
-from importing import get_articles, import_cypher_query, process_params
+from importing import aget_articles, aprocess_params
 from langserve import add_routes
-from processing import process_document, store_graph_documents
+from metrics import pool_gauges, registry, request_duration, trace
+from network import etag_matches, network_cache
+from processing import aprocess_document, astore_articles, store_graph_documents
+from schema import schema_service
+from serialization import FastJSONResponse
+from startup import readiness
+from tenants import DEFAULT_TENANT, TENANT_HEADER, tenants, use_tenant
 from text2cypher import text2cypher_chain
-from utils import graph, remove_null_properties
+from utils import aquery, gather_with_limit, pool_metrics
 
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
 )
 
-# Multithreading for Diffbot API
+# Concurrent requests to Diffbot API
 MAX_WORKERS = min(os.cpu_count() * 5, 20)
 
-app = FastAPI()
+app = FastAPI(default_response_class=FastJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -33,88 +42,127 @@ app.add_middleware(
     expose_headers=["*"],
 )
 
+registry.add_collector(lambda: pool_gauges(pool_metrics()))
+
+
+@app.middleware("http")
+async def route_tenant(request: Request, call_next):
+    """
+    Serves the request from the database and caches of its tenant
+    """
+    tenant = request.headers.get(TENANT_HEADER, DEFAULT_TENANT)
+    if tenant not in tenants:
+        return FastJSONResponse({"detail": f"Unknown tenant {tenant}"}, 404)
+    with use_tenant(tenant):
+        return await call_next(request)
+
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """
+    Ties the stages of a request together in one trace and times the request
+    """
+    start = time.perf_counter()
+    with trace(
+        f"{request.method} {request.url.path}", request.headers.get("x-request-id")
+    ) as trace_id:
+        response = await call_next(request)
+    # Route templates keep the number of label values bounded
+    route = request.scope.get("route")
+    request_duration.observe(
+        time.perf_counter() - start,
+        method=request.method,
+        path=getattr(route, "path", "unmatched"),
+        status=response.status_code,
+    )
+    response.headers["X-Trace-Id"] = trace_id
+    return response
+
 
 @app.post("/import_articles/")
-def import_articles_endpoint(article_data: ArticleData) -> int:
+async def import_articles_endpoint(article_data: ArticleData) -> int:
     logging.info(f"Starting to process article import with params: {article_data}")
     if not article_data.query and not article_data.tag:
         raise HTTPException(
             status_code=500, detail="Either `query` or `tag` must be provided"
         )
-    data = get_articles(article_data.query, article_data.tag, article_data.size)
+    data = await aget_articles(article_data.query, article_data.tag, article_data.size)
     logging.info(f"Articles fetched: {len(data['data'])} articles.")
     try:
-        params = process_params(data)
+        params = await aprocess_params(data)
     except Exception as e:
         # You could log the exception here if needed
         raise HTTPException(status_code=500, detail=e)
-    graph.query(import_cypher_query, params={"data": params})
+    await astore_articles(params)
     logging.info(f"Article import query executed successfully.")
     return len(params)
 
 
 @app.post("/process_articles/")
-def process_articles() -> str:
-    texts = graph.query(
+async def process_articles() -> str:
+    texts = await aquery(
         "MATCH (a:Article) WHERE a.processed IS NULL RETURN a.id AS id, a.text AS text"
     )
-    graph_documents = []
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        # Submitting all tasks and creating a list of future objects
-        futures = [executor.submit(process_document, text) for text in texts]
-
-        for future in futures:
-            graph_document = future.result()
-            graph_documents.extend(graph_document)
-    store_graph_documents(graph_documents)
+    responses = await gather_with_limit(
+        [aprocess_document(text) for text in texts], MAX_WORKERS
+    )
+    graph_documents = [el for response in responses for el in response]
+    await asyncio.to_thread(store_graph_documents, graph_documents)
     return f"Processed {len(graph_documents)} articles."
 
 
 @app.get("/dashboard/")
-def dashboard() -> Dict[str, Any]:
-    article_data = graph.query(
-        """MATCH (a:Article) RETURN count(*) AS article_count,
-        [{sentiment: 'positive', count: sum(CASE WHEN a.sentiment > 0.5 THEN 1 ELSE 0 END)},
-         {sentiment: 'neutral', count: sum(CASE WHEN -0.5 < a.sentiment < 0.5 THEN 1 ELSE 0 END)},
-         {sentiment: 'negative', count: sum(CASE WHEN a.sentiment < -0.5 THEN 1 ELSE 0 END)}] AS sentiment
-        """
-    )
-    entity_types = graph.query(
-        """MATCH (e:`__Entity__`)
-        RETURN [l IN labels(e) WHERE l <> '__Entity__' | l][0] AS label,
-               count(*) AS count
-        ORDER BY count DESC LIMIT 7
-        """
-    )
-    entity_count = graph.query(
-        """
-        MATCH (e:`__Entity__`)
-        RETURN count(*) AS count
-        """
+async def dashboard() -> Dict[str, Any]:
+    return await dashboard_stats.aget()
+
+
+@app.get("/ready/")
+async def ready(response: Response) -> Dict[str, Any]:
+    """
+    Readiness probe, fails until Neo4j is reachable and indexes are online.
+    Indexes are created by running `python startup.py` before the workers.
+    """
+    status = await asyncio.to_thread(readiness)
+    if not status["ready"]:
+        response.status_code = 503
+    return status
+
+
+@app.get("/pool_metrics/")
+async def fetch_pool_metrics() -> Dict[str, Any]:
+    """
+    Neo4j connection pool usage, to spot pool saturation
+    """
+    return pool_metrics()
+
+
+@app.get("/metrics")
+async def metrics() -> PlainTextResponse:
+    """
+    Prometheus metrics
+    """
+    return PlainTextResponse(
+        registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
     )
-    return {
-        "article": article_data[0],
-        "entity": {"types": entity_types, "count": entity_count[0]["count"]},
-    }
 
 
 @app.get("/refresh_schema/")
-def refresh_schema() -> bool:
-    graph.refresh_schema()
+async def refresh_schema() -> bool:
+    await asyncio.to_thread(schema_service.refresh)
     return True
 
 
 @app.post("/unprocessed_count/")
-def fetch_unprocessed_count(count_data: CountData) -> int:
+async def fetch_unprocessed_count(count_data: CountData) -> int:
     """
     Fetches number of articles that haven't been processed yet.
     """
     if count_data.type == "articles":
-        data = graph.query(
+        data = await aquery(
             "MATCH (a:Article) WHERE a.processed IS NULL RETURN count(a) AS output"
         )
     elif count_data.type == "entities":
-        data = graph.query(
+        data = await aquery(
             "MATCH (a:Person|Organization) WHERE a.processed IS NULL RETURN count(a) AS output"
         )
     else:
@@ -124,74 +172,45 @@ def fetch_unprocessed_count(count_data: CountData) -> int:
 
 
 @app.post("/enhance_entities/")
-def enhance_entities(entity_data: EntityData) -> str:
-    entities = graph.query(
+async def enhance_entities(entity_data: EntityData) -> str:
+    entities = await aquery(
         "MATCH (a:Person|Organization) WHERE a.processed IS NULL "
         "WITH a LIMIT toInteger($limit) "
         "RETURN [el in labels(a) WHERE el <> '__Entity__' | el][0] "
         "AS label, collect(a.name) AS entities",
         params={"limit": entity_data.size},
     )
-    enhanced_data = []
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        # Submitting all tasks and creating a list of future objects
-        for row in entities:
-            futures = [
-                executor.submit(process_entities, el, row["label"])
-                for el in row["entities"]
-            ]
-
-            for future in futures:
-                response = future.result()
-                enhanced_data.append(response)
-    store_enhanced_data(enhanced_data)
+    enhanced_data = await gather_with_limit(
+        [
+            aprocess_entities(el, row["label"])
+            for row in entities
+            for el in row["entities"]
+        ],
+        MAX_WORKERS,
+    )
+    await asyncio.to_thread(store_enhanced_data, enhanced_data)
     return "Finished enhancing entities."
 
 
 @app.get("/fetch_network/")
-def fetch_network() -> Dict:
+async def fetch_network(
+    request: Request,
+    seed: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+) -> Response:
     """
-    Fetches data for network visualization
+    Fetches data for network visualization. Without parameters, returns an
+    overview of articles and their neighbors. Pass `limit` to page through
+    articles instead, and `next_cursor` of the response as `cursor` to load
+    the next page. Pass an `element_id` of a node as `seed` to expand its
+    neighborhood.
     """
-    data = graph.query(
-        """
-CALL {
-    MATCH (a:Article)-[r]->(end)
-    WITH a,r,end LIMIT 200
-    WITH apoc.coll.toSet(collect(distinct a) + collect(distinct end)) AS nodes,
-        collect(r) AS rels
-    RETURN nodes,
-           rels
-UNION ALL
-    MATCH (a:Article)-[]->(end)
-    WITH end LIMIT 200
-    MATCH (end)-[r]->(neighbor)
-    WITH neighbor, r
-    LIMIT 350
-    WITH collect(distinct neighbor) AS nodes,
-         collect(r) AS rels
-    RETURN nodes, rels
-}
-WITH collect(nodes) AS allNodeSets, collect(rels) AS allRelSets
-WITH apoc.coll.flatten(allNodeSets) AS allNodes, apoc.coll.flatten(allRelSets) AS allRels
-RETURN {nodes: [n in allNodes |
-                {
-                    id: coalesce(n.title, n.name, n.id),
-                    tag: [el in labels(n) WHERE el <> "__Entity__"| el][0],
-                    properties: n {.*, title: Null, name: Null, id: Null, date: toString(n.date),
-                                        founding_date: toString(n.founding_date), embedding: Null, 
-                                        mentions: count {(n)-[:MENTIONS]-()} + 1}
-                }] ,
-        relationships: [r in allRels |
-                    {start: coalesce(startNode(r).title, startNode(r).name, startNode(r).id),
-                    end: coalesce(endNode(r).title, endNode(r).name, endNode(r).id),
-                    type:type(r),
-                    properties: r {.*}
-                    }]
-        } AS output
-"""
-    )
-    return remove_null_properties(data[0]["output"])
+    etag, payload = await asyncio.to_thread(network_cache.get, seed, cursor, limit)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=payload, media_type="application/json", headers=headers)
 
 
 add_routes(app, chain, path="/chat", enabled_endpoints=["stream_log"])
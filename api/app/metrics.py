@@ -0,0 +1,283 @@
+import asyncio
+import functools
+import logging
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_labels(labels: Dict[str, Any]) -> str:
+    if not labels:
+        return ""
+    escaped = {
+        k: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        for k, v in labels.items()
+    }
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped.items()) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = tuple(str(labels[el]) for el in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} counter",
+        ]
+        with self._lock:
+            for key, value in self._values.items():
+                labels = _format_labels(dict(zip(self.labelnames, key)))
+                lines.append(f"{self.name}{labels} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # Per label values: bucket counts, sum and count
+        self._values: Dict[Tuple, Tuple[List[int], float, int]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = tuple(str(labels[el]) for el in self.labelnames)
+        with self._lock:
+            counts, total, count = self._values.get(
+                key, ([0] * (len(self.buckets) + 1), 0.0, 0)
+            )
+            counts[bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    def collect(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self._lock:
+            for key, (counts, total, count) in self._values.items():
+                labels = dict(zip(self.labelnames, key))
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                    cumulative += bucket_count
+                    bucket_labels = _format_labels({**labels, "le": bound})
+                    lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(labels)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+class Registry:
+    """
+    Renders metrics in the Prometheus text exposition format
+    """
+
+    def __init__(self):
+        self._metrics: List[Any] = []
+        self._collectors: List[Callable[[], List[str]]] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], List[str]]) -> None:
+        """
+        Registers a callable returning exposition lines computed on scrape
+        """
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.collect())
+        for collector in self._collectors:
+            try:
+                lines.extend(collector())
+            except Exception as e:
+                logging.warning(f"Metrics collector failed: {e}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+stage_duration = registry.register(
+    Histogram(
+        "pipeline_stage_duration_seconds", "Duration of pipeline stages", ["stage"]
+    )
+)
+request_duration = registry.register(
+    Histogram(
+        "http_request_duration_seconds",
+        "Duration of HTTP requests",
+        ["method", "path", "status"],
+    )
+)
+rows_total = registry.register(
+    Counter("pipeline_rows_total", "Rows written to Neo4j", ["operation"])
+)
+chunks_total = registry.register(
+    Counter("pipeline_chunks_total", "Text chunks embedded")
+)
+cache_requests = registry.register(
+    Counter("cache_requests_total", "Cache lookups", ["cache", "result", "tenant"])
+)
+
+
+def pool_gauges(metrics: Dict[str, Any]) -> List[str]:
+    """
+    Exposition lines for the Neo4j connection pool usage
+    """
+    connections = [
+        "# HELP neo4j_pool_connections Neo4j connections per driver, address and state",
+        "# TYPE neo4j_pool_connections gauge",
+    ]
+    max_size = [
+        "# HELP neo4j_pool_max_size Maximum Neo4j connections per address",
+        "# TYPE neo4j_pool_max_size gauge",
+    ]
+    for driver, usage in metrics.items():
+        for address, counts in usage["addresses"].items():
+            for state in ["in_use", "idle"]:
+                labels = _format_labels(
+                    {"driver": driver, "address": address, "state": state}
+                )
+                connections.append(f"neo4j_pool_connections{labels} {counts[state]}")
+        labels = _format_labels({"driver": driver})
+        max_size.append(f"neo4j_pool_max_size{labels} {usage['max_size']}")
+    return connections + max_size
+
+
+# Spans of the current request and the id of the innermost open span
+_trace: ContextVar[Optional[Dict[str, Any]]] = ContextVar("trace", default=None)
+_span_id: ContextVar[Optional[str]] = ContextVar("span_id", default=None)
+
+
+@contextmanager
+def trace(name: str, trace_id: Optional[str] = None) -> Iterator[str]:
+    """
+    Collects the stages run within the block, including those run in threads
+    and tasks started from it, and logs them as one trace
+    """
+    current = {"id": trace_id or uuid.uuid4().hex, "spans": []}
+    token = _trace.set(current)
+    start = time.perf_counter()
+    try:
+        yield current["id"]
+    finally:
+        _trace.reset(token)
+        if current["spans"]:
+            spans = " ".join(
+                f"{el['name']}={el['duration'] * 1000:.0f}ms" for el in current["spans"]
+            )
+            logging.info(
+                f"Trace {current['id']} {name} "
+                f"{(time.perf_counter() - start) * 1000:.0f}ms: {spans}"
+            )
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """
+    Times a pipeline stage into the stage histogram and the current trace
+    """
+    span_id = uuid.uuid4().hex[:16]
+    parent_id = _span_id.get()
+    token = _span_id.set(span_id)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        _span_id.reset(token)
+        stage_duration.observe(duration, stage=name)
+        current = _trace.get()
+        if current is not None:
+            current["spans"].append(
+                {
+                    "name": name,
+                    "span_id": span_id,
+                    "parent_id": parent_id,
+                    "duration": duration,
+                }
+            )
+
+
+def timed(name: str) -> Callable:
+    """
+    Decorator timing each call of a sync or async function as a stage
+    """
+
+    def decorator(func: Callable) -> Callable:
+        if asyncio.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with stage(name):
+                    return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class FirstTokenTimer(BaseCallbackHandler):
+    """
+    Records the time from the start of an LLM call to its first token
+    """
+
+    def __init__(self):
+        self._starts: Dict[UUID, float] = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, **kwargs):
+        self._starts[run_id] = time.perf_counter()
+
+    def on_llm_start(self, serialized, prompts, *, run_id: UUID, **kwargs):
+        self._starts[run_id] = time.perf_counter()
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs):
+        start = self._starts.pop(run_id, None)
+        if start is not None:
+            stage_duration.observe(time.perf_counter() - start, stage="llm_first_token")
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs):
+        self._starts.pop(run_id, None)
+
+    def on_llm_error(self, error, *, run_id: UUID, **kwargs):
+        self._starts.pop(run_id, None)
+
+
+first_token_timer = FirstTokenTimer()
@@ -0,0 +1,202 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from metrics import cache_requests
+from serialization import dumps
+from tenants import current_tenant
+from utils import TenantLocal, read_query
+
+# Default and maximum number of articles per network page
+NETWORK_PAGE_SIZE = 20
+MAX_NETWORK_PAGE_SIZE = 200
+# Default and maximum number of relationships expanded around a seed node
+EXPANSION_SIZE = 100
+MAX_EXPANSION_SIZE = 1000
+# Relationships of articles and of their neighbors in the overview
+OVERVIEW_SIZE = 200
+OVERVIEW_NEIGHBOR_SIZE = 350
+# Number of serialized pages kept in the cache
+NETWORK_CACHE_SIZE = 256
+
+# Dates are formatted by Cypher toString, clean drops the null dates
+node_output = """{
+    id: coalesce(n.title, n.name, n.id),
+    element_id: elementId(n),
+    tag: [el in labels(n) WHERE el <> "__Entity__"| el][0],
+    properties: apoc.map.clean(
+        n {.*, mentions: count {(n)-[:MENTIONS]-()} + 1,
+           date: toString(n.date), founding_date: toString(n.founding_date)},
+        ["title", "name", "id", "embedding"], []
+    )
+}"""
+
+relationship_output = """{
+    start: coalesce(startNode(r).title, startNode(r).name, startNode(r).id),
+    end: coalesce(endNode(r).title, endNode(r).name, endNode(r).id),
+    type: type(r),
+    properties: properties(r)
+}"""
+
+# Article relationships and second-hop neighbors, the payload of a request
+# without parameters
+overview_query = f"""
+CALL {{
+    MATCH (a:Article)-[r]->(end)
+    WITH a, r, end LIMIT toInteger($limit)
+    RETURN apoc.coll.toSet(collect(DISTINCT a) + collect(DISTINCT end)) AS nodes,
+           collect(r) AS rels
+UNION ALL
+    MATCH (a:Article)-->(end)
+    WITH end LIMIT toInteger($limit)
+    MATCH (end)-[r]->(neighbor)
+    WITH neighbor, r LIMIT toInteger($neighbor_limit)
+    RETURN collect(DISTINCT neighbor) AS nodes, collect(r) AS rels
+}}
+WITH apoc.coll.toSet(apoc.coll.flatten(collect(nodes))) AS nodes,
+     apoc.coll.flatten(collect(rels)) AS rels
+RETURN [n IN nodes | {node_output}] AS nodes,
+       [r IN rels | {relationship_output}] AS relationships
+"""
+
+# Articles are paged in id order, so each page is an index range seek
+page_query = f"""
+MATCH (a:Article) WHERE a.id > $cursor
+WITH a ORDER BY a.id LIMIT toInteger($limit)
+CALL {{
+    WITH a
+    MATCH (a)-[r]->(end)
+    RETURN collect(r) AS rels, collect(end) AS ends
+}}
+WITH collect(a) AS articles, apoc.coll.flatten(collect(rels)) AS rels,
+     apoc.coll.flatten(collect(ends)) AS ends, last(collect(a.id)) AS cursor
+RETURN [n IN apoc.coll.toSet(articles + ends) | {node_output}] AS nodes,
+       [r IN rels | {relationship_output}] AS relationships,
+       size(articles) AS count, cursor
+"""
+
+# Relationships of the seed are paged in element id order
+expansion_query = f"""
+MATCH (seed) WHERE elementId(seed) = $seed
+OPTIONAL MATCH (seed)-[r]-(neighbor)
+WHERE elementId(r) > $cursor
+WITH seed, r, neighbor ORDER BY elementId(r) LIMIT toInteger($limit)
+WITH seed, collect(r) AS rels, collect(neighbor) AS neighbors
+RETURN [n IN apoc.coll.toSet([seed] + neighbors) | {node_output}] AS nodes,
+       [r IN rels | {relationship_output}] AS relationships,
+       size(rels) AS count, elementId(last(rels)) AS cursor
+"""
+
+
+def fetch_network_page(
+    seed: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Fetches a page of the network visualization data.
+
+    Without parameters, returns an overview of article relationships and
+    their second-hop neighbors in a single page. With a cursor or limit,
+    pages through articles and their outgoing relationships. With a seed
+    element id, pages through the relationships around that node.
+    Property maps contain no null values. Node dates are formatted by
+    Cypher toString, other temporal values as ISO 8601 by the serializer.
+    `next_cursor` is None on the last page.
+    """
+    if not seed and not cursor and not limit:
+        params = {"limit": OVERVIEW_SIZE, "neighbor_limit": OVERVIEW_NEIGHBOR_SIZE}
+        data = read_query(overview_query, params)
+        return {
+            "nodes": data[0]["nodes"],
+            "relationships": data[0]["relationships"],
+            "next_cursor": None,
+        }
+    if seed:
+        limit = min(max(limit or EXPANSION_SIZE, 1), MAX_EXPANSION_SIZE)
+        params = {"seed": seed, "cursor": cursor or "", "limit": limit}
+        data = read_query(expansion_query, params)
+    else:
+        limit = min(max(limit or NETWORK_PAGE_SIZE, 1), MAX_NETWORK_PAGE_SIZE)
+        params = {"cursor": cursor or "", "limit": limit}
+        data = read_query(page_query, params)
+    if not data:  # Unknown seed
+        return {"nodes": [], "relationships": [], "next_cursor": None}
+    return {
+        "nodes": data[0]["nodes"],
+        "relationships": data[0]["relationships"],
+        "next_cursor": data[0]["cursor"] if data[0]["count"] == limit else None,
+    }
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Checks an If-None-Match header against the ETag with the weak
+    comparison of RFC 9110, so weak and comma separated tags match
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    tags = (el.strip() for el in if_none_match.split(","))
+    return etag.removeprefix("W/") in (el.removeprefix("W/") for el in tags)
+
+
+class NetworkCache:
+    """
+    LRU cache of serialized network pages along with their ETags.
+
+    Writers invalidate the whole cache, as any write may change any page.
+    Since ETags are content hashes, clients still get 304 responses for
+    pages that are unchanged after a recomputation.
+    """
+
+    def __init__(self, max_size: int = NETWORK_CACHE_SIZE):
+        self.max_size = max_size
+        self._pages: OrderedDict[Tuple, Tuple[str, bytes]] = OrderedDict()
+        self._lock = threading.Lock()
+        # Incremented on invalidation, so pages computed before a write
+        # are not cached after it
+        self._generation = 0
+
+    def get(
+        self,
+        seed: Optional[str] = None,
+        cursor: Optional[str] = None,
+        limit: Optional[int] = None,
+    ) -> Tuple[str, bytes]:
+        """
+        Returns the ETag and the serialized page
+        """
+        key = (seed, cursor, limit)
+        with self._lock:
+            if key in self._pages:
+                self._pages.move_to_end(key)
+                cache_requests.inc(
+                    cache="network", result="hit", tenant=current_tenant().id
+                )
+                return self._pages[key]
+            generation = self._generation
+        cache_requests.inc(cache="network", result="miss", tenant=current_tenant().id)
+        payload = dumps(fetch_network_page(seed, cursor, limit))
+        entry = (f'"{hashlib.sha256(payload).hexdigest()[:16]}"', payload)
+        with self._lock:
+            if generation != self._generation:
+                return entry
+            self._pages[key] = entry
+            self._pages.move_to_end(key)
+            while len(self._pages) > self.max_size:
+                self._pages.popitem(last=False)
+        return entry
+
+    def invalidate(self) -> None:
+        """
+        Called by writers after they change the graph
+        """
+        with self._lock:
+            self._generation += 1
+            self._pages.clear()
+
+
+network_cache = TenantLocal(lambda tenant: NetworkCache())
@@ -1,10 +1,22 @@
+import asyncio
+import logging
 import os
+from typing import Dict, List
 
+from dashboard import dashboard_stats
+from gazetteer import gazetteer
+from importing import import_cypher_query, import_labels, import_relationship_types
 from langchain_core.documents import Document
 from langchain_experimental.graph_transformers import DiffbotGraphTransformer
-from utils import graph
+from local_index import local_index
+from metrics import rows_total, stage, timed
+from network import network_cache
+from schema import schema_service
+from utils import awrite_query, graph, http_client
 
 DIFF_TOKEN = os.environ["DIFFBOT_API_KEY"]
+# Diffbot Natural Language host, overridable to point at a local stand-in
+DIFFBOT_NL_URL = os.environ.get("DIFFBOT_NL_URL", "https://nl.diffbot.com")
 EXCLUDED_TYPES = ["Number", "Money"]
 
 diffbot_nlp = DiffbotGraphTransformer(
@@ -12,6 +24,7 @@ diffbot_nlp = DiffbotGraphTransformer(
 )
 
 
+@timed("nlp_extraction")
 def process_document(text):
     """
     Uses diffbot graph transformer from LangChain to convert text
@@ -21,14 +34,43 @@ def process_document(text):
         return diffbot_nlp.convert_to_graph_documents(
             [Document(page_content=text["text"], metadata={"id": text["id"]})]
         )
-    except Exception as e:
-        print(f"Error processing document with ID {text['id']}: {e}")
+    except Exception:
+        logging.exception(f"Error processing document with ID {text['id']}")
+        return []
+
+
+@timed("nlp_extraction")
+async def aprocess_document(text):
+    try:
+        response = await http_client.post(
+            f"{DIFFBOT_NL_URL}/v1/",
+            params={
+                "fields": ",".join(diffbot_nlp.extract_types),
+                "token": DIFF_TOKEN,
+                "language": "en",
+            },
+            data={"content": text["text"], "lang": "en"},
+        )
+        document = Document(page_content=text["text"], metadata={"id": text["id"]})
+        # Parsing the response into graph documents is CPU-bound
+        return [
+            await asyncio.to_thread(
+                lambda: diffbot_nlp.process_response(response.json(), document)
+            )
+        ]
+    except Exception:
+        logging.exception(f"Error processing document with ID {text['id']}")
         return []
 
 
 node_import_query = """
 MATCH (a:Article {id: $document.metadata.id})
-SET a.processed = True
+SET a.processed = True,
+    a.sentiment_bucket = coalesce(a.sentiment_bucket,
+      CASE WHEN a.sentiment > 0.5 THEN 'positive'
+           WHEN a.sentiment < -0.5 THEN 'negative'
+           WHEN -0.5 < a.sentiment < 0.5 THEN 'neutral'
+           ELSE 'unclassified' END)
 WITH a
 UNWIND $data AS row
 MERGE (source:`__Entity__` {id: row.id})
@@ -59,7 +101,10 @@ RETURN count(*)
 """
 
 
+@timed("neo4j_write")
 def store_graph_documents(graph_documents):
+    labels = set()
+    relationship_types = {"MENTIONS"}
     for document in graph_documents:
         # Import nodes
         graph.query(
@@ -92,5 +137,46 @@ def store_graph_documents(graph_documents):
                 ]
             },
         )
+        gazetteer.add(el.properties.get("name") for el in document.nodes)
+        labels.update(el.type for el in document.nodes)
+        relationship_types.update(
+            el.type.replace(" ", "_").upper()
+            for el in document.relationships
+            if el.source.type not in EXCLUDED_TYPES
+            and el.target.type not in EXCLUDED_TYPES
+        )
     # Merge duplicate entities
     graph.query(merge_entities)
+    schema_service.observe(labels - set(EXCLUDED_TYPES), relationship_types)
+    rows_total.inc(len(graph_documents), operation="graph_documents")
+    dashboard_stats.invalidate()
+    network_cache.invalidate()
+
+
+async def astore_articles(params: List[Dict], query: str = import_cypher_query) -> None:
+    """
+    Writes articles and their chunks with the transactional import query, or
+    another query ending with `store_chunks_cypher`. Chunks no longer part of
+    an article are removed in the same transaction.
+    """
+    with stage("neo4j_write"):
+        data = await awrite_query(query, {"data": params})
+    rows_total.inc(len(params), operation="articles")
+    schema_service.observe(import_labels, import_relationship_types)
+    dashboard_stats.invalidate()
+    network_cache.invalidate()
+    removed = [id for row in data for id in row["removed"]]
+    if removed:
+        logging.info(f"Removed {len(removed)} chunks of changed articles.")
+        await asyncio.to_thread(local_index.remove, removed)
+    chunks = [
+        chunk
+        for article in params
+        for chunk in article["chunks"]
+        if chunk["embedding"] is not None
+    ]
+    await asyncio.to_thread(
+        local_index.add,
+        [el["index"] for el in chunks],
+        [el["embedding"] for el in chunks],
+    )
@@ -0,0 +1,195 @@
+"""
+Splits stored articles again with the current chunking configuration.
+
+Articles record the configuration they were split with, so only the ones
+split with another configuration are processed. Chunk ids are derived from
+their text, so chunks the new configuration leaves unchanged keep their
+embedding and only new chunks are embedded. Reports how the number of
+chunks, their tokens and the embedding cost change:
+
+    CHUNK_STRATEGY=paragraph python rechunk.py --dry-run  # report only
+    CHUNK_STRATEGY=paragraph python rechunk.py
+
+Options override the CHUNK_* environment variables for this run. Run the API
+with the same configuration, so new imports are split the same way.
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+from typing import Dict, List, get_args
+
+from chunking import Chunker, ChunkingConfig, ChunkStrategy
+from context import count_tokens
+from importing import (
+    _log_embedding,
+    _new_chunks,
+    add_embeddings,
+    existing_chunks_query,
+    split_article,
+    store_chunks_cypher,
+)
+from metrics import chunks_total, stage
+from processing import astore_articles
+from tenants import DEFAULT_TENANT, use_tenant
+from utils import aembed_texts, aquery
+
+# USD per million tokens of text-embedding-3-small
+EMBEDDING_PRICE = float(os.environ.get("EMBEDDING_PRICE", 0.02))
+
+articles_query = """
+MATCH (a:Article)
+WHERE a.id > $cursor AND ($all OR coalesce(a.chunking, '') <> $chunking)
+RETURN a.id AS id, a.text AS text,
+       [(a)-[:HAS_CHUNK]->(c) | c.text] AS chunks
+ORDER BY a.id
+LIMIT toInteger($limit)
+"""
+
+rechunk_cypher_query = (
+    """
+UNWIND $data AS row
+MATCH (a:Article {id: row.id})
+SET a.chunking = row.chunking
+"""
+    + store_chunks_cypher
+)
+
+
+class RechunkReport:
+    """
+    Chunk counts and tokens before and after splitting again
+    """
+
+    def __init__(self):
+        self.articles = 0
+        self.chunks_before = 0
+        self.chunks_after = 0
+        self.tokens_before = 0
+        self.tokens_after = 0
+        self.chunks_embedded = 0
+        self.tokens_embedded = 0
+
+    def add(self, old_texts: List[str], chunks: List[Dict], new_chunks: List[Dict]):
+        self.articles += 1
+        self.chunks_before += len(old_texts)
+        self.chunks_after += len(chunks)
+        self.tokens_before += sum(count_tokens(el) for el in old_texts)
+        self.tokens_after += sum(count_tokens(el["text"]) for el in chunks)
+        self.chunks_embedded += len(new_chunks)
+        self.tokens_embedded += sum(count_tokens(el["text"]) for el in new_chunks)
+
+    def format(self) -> str:
+        def cost(tokens: int) -> str:
+            return f"${tokens / 1_000_000 * EMBEDDING_PRICE:.4f}"
+
+        return "\n".join(
+            [
+                f"{'':24} {'before':>12} {'after':>12}",
+                f"{'chunks':24} {self.chunks_before:>12} {self.chunks_after:>12}",
+                f"{'chunk tokens':24} {self.tokens_before:>12} {self.tokens_after:>12}",
+                f"{'full embedding cost':24} {cost(self.tokens_before):>12} "
+                f"{cost(self.tokens_after):>12}",
+                f"Articles: {self.articles}, chunks embedded: "
+                f"{self.chunks_embedded}, unchanged: "
+                f"{self.chunks_after - self.chunks_embedded}",
+                f"Tokens embedded: {self.tokens_embedded}, "
+                f"cost: {cost(self.tokens_embedded)}",
+            ]
+        )
+
+
+async def rechunk_batch(
+    rows: List[Dict], splitter: Chunker, report: RechunkReport, dry_run: bool
+) -> None:
+    params = []
+    all_chunks = []
+    for row in rows:
+        chunks = split_article(row["id"], row["text"], splitter)
+        params.append(
+            {
+                "id": row["id"],
+                "chunking": splitter.config.fingerprint,
+                "chunks": chunks,
+            }
+        )
+        all_chunks.extend(chunks)
+    existing = await aquery(
+        existing_chunks_query, {"ids": [el["index"] for el in all_chunks]}
+    )
+    new_chunks = _new_chunks(all_chunks, existing)
+    new_ids = {el["index"] for el in new_chunks}
+    for row, param in zip(rows, params):
+        report.add(
+            row["chunks"],
+            param["chunks"],
+            [el for el in param["chunks"] if el["index"] in new_ids],
+        )
+    if dry_run:
+        return
+    _log_embedding(new_chunks, all_chunks)
+    with stage("embedding"):
+        embedded_documents = await aembed_texts([el["text"] for el in new_chunks])
+    chunks_total.inc(len(new_chunks))
+    await astore_articles(
+        add_embeddings(params, new_chunks, embedded_documents), rechunk_cypher_query
+    )
+
+
+async def rechunk(
+    config: ChunkingConfig, batch_size: int, all: bool, dry_run: bool
+) -> RechunkReport:
+    splitter = Chunker(config)
+    report = RechunkReport()
+    cursor = ""
+    while True:
+        rows = await aquery(
+            articles_query,
+            {
+                "cursor": cursor,
+                "all": all,
+                "chunking": config.fingerprint,
+                "limit": batch_size,
+            },
+        )
+        if not rows:
+            break
+        await rechunk_batch(rows, splitter, report, dry_run)
+        cursor = rows[-1]["id"]
+        logging.info(f"Split {report.articles} articles again.")
+    return report
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    defaults = ChunkingConfig()
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--strategy",
+        choices=get_args(ChunkStrategy),
+        default=defaults.strategy,
+    )
+    parser.add_argument("--size", type=int, default=defaults.size)
+    parser.add_argument("--overlap", type=int, default=defaults.overlap)
+    parser.add_argument("--max-chunks", type=int, default=defaults.max_chunks)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument(
+        "--all",
+        action="store_true",
+        help="Also process articles already split with this configuration",
+    )
+    parser.add_argument("--dry-run", action="store_true", help="Report without writing")
+    parser.add_argument("--tenant", default=DEFAULT_TENANT)
+    args = parser.parse_args()
+    config = ChunkingConfig(
+        strategy=args.strategy,
+        size=args.size,
+        overlap=args.overlap,
+        max_chunks=args.max_chunks,
+    )
+    with use_tenant(args.tenant):
+        report = asyncio.run(rechunk(config, args.batch_size, args.all, args.dry_run))
+    print(report.format())
@@ -0,0 +1,140 @@
+from typing import Dict, List, Optional, Tuple
+
+from context import CONTEXT_TOKEN_BUDGET
+from langchain_community.vectorstores.neo4j_vector import remove_lucene_chars
+from langchain_core.documents import Document
+from langchain_core.pydantic_v1 import BaseModel, Field
+from local_index import local_index
+from metrics import timed
+from utils import (
+    embeddings,
+    index_name,
+    keyword_index_name,
+    read_query,
+    vector_index,
+)
+
+# Rank constant of reciprocal rank fusion
+RRF_K = 60
+# Candidates fetched from each index relative to the number of results
+CANDIDATE_FACTOR = 2
+# Upper bounds of the request parameters
+MAX_K = 50
+MAX_TOKEN_BUDGET = 16000
+
+vector_search_query = """
+CALL db.index.vector.queryNodes($index, toInteger($k), $embedding)
+YIELD node, score
+RETURN node.id AS id, node.text AS text, score, node.position AS position,
+       [(a:Article)-[:HAS_CHUNK]->(node) | a.id][0] AS article_id
+"""
+
+fulltext_search_query = """
+CALL db.index.fulltext.queryNodes($index, $query, {limit: toInteger($k)})
+YIELD node, score
+RETURN node.id AS id, node.text AS text, score, node.position AS position,
+       [(a:Article)-[:HAS_CHUNK]->(node) | a.id][0] AS article_id
+"""
+
+
+class RetrievalConfig(BaseModel):
+    """Parameters of the chunk retrieval step."""
+
+    k: int = Field(
+        4, ge=1, le=MAX_K, description="Number of text chunks passed to the LLM"
+    )
+    fusion: str = Field(
+        "max",
+        description="How vector and keyword results are combined",
+        enum=["max", "rrf"],
+    )
+    min_score: float = Field(
+        0.0,
+        description="Chunks scoring below this value are dropped. Scores are "
+        "normalized to [0, 1] for max fusion and sum 1/(60 + rank) for rrf",
+    )
+    token_budget: int = Field(
+        CONTEXT_TOKEN_BUDGET,
+        ge=1,
+        le=MAX_TOKEN_BUDGET,
+        description="Maximum number of context tokens passed to the LLM",
+    )
+
+
+def _to_documents(rows: List[Dict]) -> List[Document]:
+    return [
+        Document(
+            page_content=el["text"],
+            metadata={
+                "id": el["id"],
+                "article_id": el["article_id"],
+                "position": el["position"],
+            },
+        )
+        for el in rows
+    ]
+
+
+def reciprocal_rank_fusion(
+    result_lists: List[List[Document]], k: int
+) -> List[Tuple[Document, float]]:
+    """
+    Combines ranked lists by summing 1 / (RRF_K + rank) of each document
+    """
+    scores: Dict[str, float] = {}
+    documents: Dict[str, Document] = {}
+    for results in result_lists:
+        for rank, doc in enumerate(results, start=1):
+            key = doc.metadata.get("id") or doc.page_content
+            documents.setdefault(key, doc)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (RRF_K + rank)
+    ranked = sorted(scores.items(), key=lambda el: el[1], reverse=True)[:k]
+    return [(documents[key], score) for key, score in ranked]
+
+
+@timed("vector_search")
+def hybrid_search(
+    query: str,
+    config: Optional[RetrievalConfig] = None,
+    backend: str = "neo4j",
+) -> List[Document]:
+    """
+    Retrieves text chunks relevant to the query.
+
+    With "max" fusion the scores of the vector and keyword index are max
+    normalized and combined by Neo4jVector. With "rrf" both indexes are
+    queried separately and merged with reciprocal rank fusion. The local
+    backend only supports vector search, so the fusion method is ignored.
+    Searches fall back to Neo4j while the local index is being built.
+    """
+    config = config or RetrievalConfig()
+    if backend == "local" and not local_index.is_ready():
+        # Neo4j serves searches until the local index is built
+        backend = "neo4j"
+    if backend == "local":
+        results = local_index.similarity_search_with_score(query, k=config.k)
+    elif config.fusion == "rrf":
+        candidates = config.k * CANDIDATE_FACTOR
+        vector_results = read_query(
+            vector_search_query,
+            {
+                "index": index_name,
+                "k": candidates,
+                "embedding": embeddings.embed_query(query),
+            },
+        )
+        fulltext_results = read_query(
+            fulltext_search_query,
+            {
+                "index": keyword_index_name,
+                "k": candidates,
+                "query": remove_lucene_chars(query),
+            },
+        )
+        results = reciprocal_rank_fusion(
+            [_to_documents(vector_results), _to_documents(fulltext_results)],
+            config.k,
+        )
+    else:
+        results = vector_index.similarity_search_with_score(query, k=config.k)
+    return [doc for doc, score in results if score >= config.min_score]
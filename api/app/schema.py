@@ -0,0 +1,209 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from langchain.chains.graph_qa.cypher_utils import CypherQueryCorrector, Schema
+from utils import TenantLocal, graph
+
+SCHEMA_SNAPSHOT_PATH = os.environ.get("SCHEMA_SNAPSHOT_PATH", "schema_snapshot.json")
+
+
+class SchemaSnapshot:
+    """
+    Immutable graph schema along with the Cypher corrector built from it
+    """
+
+    def __init__(
+        self,
+        schema: str,
+        structured_schema: Dict[str, Any],
+        created_at: Optional[float] = None,
+    ):
+        self.schema = schema
+        self.structured_schema = structured_schema
+        self.created_at = created_at or time.time()
+        self.version = hashlib.sha256(
+            json.dumps(structured_schema, sort_keys=True, default=str).encode()
+        ).hexdigest()[:12]
+        self.labels = set(structured_schema.get("node_props", {}))
+        self.relationship_types = set(structured_schema.get("rel_props", {})) | {
+            el["type"] for el in structured_schema.get("relationships", [])
+        }
+        # Cypher validation tool for relationship directions
+        self.corrector = CypherQueryCorrector(
+            [
+                Schema(el["start"], el["type"], el["end"])
+                for el in structured_schema.get("relationships", [])
+            ]
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "version": self.version,
+            "created_at": self.created_at,
+            "schema": self.schema,
+            "structured_schema": self.structured_schema,
+        }
+
+
+class SchemaService:
+    """
+    Serves the current schema snapshot to the prompt builder and the corrector.
+
+    The snapshot is loaded from disk on warm starts and only introspected from
+    the database when missing, on demand, or after writers report a label or
+    relationship type the snapshot does not know about. A new snapshot is
+    fully built before it replaces the old one, so readers always get a
+    consistent schema and corrector pair.
+
+    Workers share the snapshot file. A worker reloads it when another worker
+    saved a newer one, and writers mark it stale with a marker file next to
+    it, so a refresh or a new label in one worker reaches all of them.
+    """
+
+    def __init__(
+        self,
+        path: str = SCHEMA_SNAPSHOT_PATH,
+        listeners: Optional[List[Callable[[SchemaSnapshot], None]]] = None,
+    ):
+        self.path = path
+        self._snapshot: Optional[SchemaSnapshot] = None
+        # Modification time of the snapshot file when it was last read or saved
+        self._mtime = 0.0
+        # Set when the marker file can't be written
+        self._stale = False
+        self._lock = threading.Lock()
+        self._listeners = [] if listeners is None else listeners
+
+    def on_change(self, callback: Callable[[SchemaSnapshot], None]) -> None:
+        """
+        Registers a callback invoked with every new snapshot version
+        """
+        self._listeners.append(callback)
+
+    def _stale_path(self) -> str:
+        return self.path + ".stale"
+
+    @staticmethod
+    def _mtime_of(path: str) -> float:
+        try:
+            return os.stat(path).st_mtime
+        except OSError:
+            return 0.0
+
+    def _load(self) -> Optional[SchemaSnapshot]:
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        return SchemaSnapshot(
+            data["schema"], data["structured_schema"], data["created_at"]
+        )
+
+    def _save(self, snapshot: SchemaSnapshot) -> None:
+        try:
+            with open(self.path + ".tmp", "w") as f:
+                json.dump(snapshot.to_dict(), f, default=str)
+            os.replace(self.path + ".tmp", self.path)
+            self._mtime = self._mtime_of(self.path)
+        except OSError as e:
+            logging.warning(f"Could not save schema snapshot: {e}")
+
+    def _publish(self, snapshot: SchemaSnapshot) -> None:
+        previous, self._snapshot = self._snapshot, snapshot
+        if previous is None or previous.version != snapshot.version:
+            logging.info(f"Graph schema snapshot version {snapshot.version}.")
+            for callback in self._listeners:
+                callback(snapshot)
+
+    def _reload(self) -> None:
+        """
+        Reads the snapshot file when it is newer than the snapshot in memory.
+        Must be called with the lock held.
+        """
+        mtime = self._mtime_of(self.path)
+        if self._snapshot is None or mtime > self._mtime:
+            snapshot = self._load()
+            self._mtime = mtime
+            if snapshot is not None:
+                self._publish(snapshot)
+
+    def _current(self) -> Optional[SchemaSnapshot]:
+        """
+        Snapshot in memory, reloaded when the file on disk is newer
+        """
+        mtime = self._mtime_of(self.path)
+        if self._snapshot is None or mtime > self._mtime:
+            with self._lock:
+                self._reload()
+        return self._snapshot
+
+    def _is_stale(self, snapshot: SchemaSnapshot) -> bool:
+        return self._stale or self._mtime_of(self._stale_path()) > snapshot.created_at
+
+    def _introspect(self) -> SchemaSnapshot:
+        """
+        Must be called with the lock held
+        """
+        # Labels written during introspection mark this snapshot stale
+        started_at = time.time()
+        graph.refresh_schema()
+        snapshot = SchemaSnapshot(graph.get_schema, graph.structured_schema, started_at)
+        self._save(snapshot)
+        self._publish(snapshot)
+        self._stale = False
+        return snapshot
+
+    def refresh(self) -> SchemaSnapshot:
+        """
+        Introspects the database and publishes a new snapshot
+        """
+        with self._lock:
+            return self._introspect()
+
+    def get(self) -> SchemaSnapshot:
+        snapshot = self._current()
+        if snapshot is None or self._is_stale(snapshot):
+            with self._lock:
+                # Requests waiting for the lock, or other workers, may have
+                # refreshed it already
+                self._reload()
+                snapshot = self._snapshot
+                if snapshot is None or self._is_stale(snapshot):
+                    snapshot = self._introspect()
+        return snapshot
+
+    def observe(
+        self,
+        labels: Iterable[str] = (),
+        relationship_types: Iterable[str] = (),
+    ) -> None:
+        """
+        Called by writers with the labels and relationship types they wrote.
+        Marks the snapshot stale for all workers when any of them is new.
+        """
+        snapshot = self._current()
+        if snapshot is None:  # Introspected on first use anyway
+            return
+        if not set(labels) <= snapshot.labels or not (
+            set(relationship_types) <= snapshot.relationship_types
+        ):
+            try:
+                with open(self._stale_path(), "w"):
+                    pass
+            except OSError as e:
+                logging.warning(f"Could not mark schema snapshot stale: {e}")
+                self._stale = True
+
+
+# Shared by the services of all tenants, callbacks run in the context of the
+# tenant whose schema changed
+schema_listeners: List[Callable[[SchemaSnapshot], None]] = []
+schema_service = TenantLocal(
+    lambda tenant: SchemaService(tenant.path(SCHEMA_SNAPSHOT_PATH), schema_listeners)
+)
@@ -0,0 +1,24 @@
+from typing import Any
+
+import orjson
+from fastapi.responses import JSONResponse
+
+
+def _default(obj: Any) -> Any:
+    # Neo4j temporal types aren't subclasses of the datetime types
+    if hasattr(obj, "iso_format"):
+        return obj.iso_format()
+    return str(obj)
+
+
+def dumps(data: Any) -> bytes:
+    """
+    Serializes data with orjson, converting Neo4j temporal values to
+    ISO 8601 strings while encoding
+    """
+    return orjson.dumps(data, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
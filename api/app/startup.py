@@ -0,0 +1,108 @@
+import argparse
+import logging
+import os
+import time
+from typing import Any, Dict
+
+from local_index import local_index
+from tenants import tenants, use_tenant
+from utils import (
+    entity_keyword_index,
+    index_name,
+    keyword_index_name,
+    read_query,
+    setup_indices,
+)
+
+# Seconds to wait for Neo4j before the API starts without index setup
+STARTUP_TIMEOUT = float(os.environ.get("STARTUP_TIMEOUT", 120))
+# Longest pause between connection attempts, in seconds
+MAX_RETRY_DELAY = 10
+
+# Indexes that must be online before the API serves requests
+required_indexes = [
+    index_name,
+    keyword_index_name,
+    entity_keyword_index,
+    "entity_range",
+    "chunk_id",
+    "article_id",
+    "article_sentiment_bucket",
+]
+
+indexes_query = """
+SHOW INDEXES YIELD name, state
+WHERE name IN $names
+RETURN name, state
+"""
+
+
+def readiness() -> Dict[str, Any]:
+    """
+    Checks that Neo4j is reachable and all required indexes are online
+    """
+    try:
+        data = read_query(indexes_query, {"names": required_indexes})
+    except Exception as e:
+        return {"ready": False, "reason": f"Neo4j is not available: {e}"}
+    online = {el["name"] for el in data if el["state"] == "ONLINE"}
+    missing = [el for el in required_indexes if el not in online]
+    if missing:
+        return {"ready": False, "reason": f"Indexes not online: {missing}"}
+    return {"ready": True}
+
+
+def wait_for_neo4j(timeout: float = STARTUP_TIMEOUT) -> bool:
+    """
+    Retries connecting with exponential backoff. Returns False when Neo4j
+    is still not reachable after the timeout.
+    """
+    deadline = time.monotonic() + timeout
+    delay = 1.0
+    while True:
+        try:
+            read_query("RETURN 1")
+            return True
+        except Exception as e:
+            if time.monotonic() + delay > deadline:
+                logging.error(f"Neo4j is not available: {e}")
+                return False
+            logging.info(f"Neo4j is not available yet, retrying in {delay:.0f}s.")
+            time.sleep(delay)
+            delay = min(delay * 2, MAX_RETRY_DELAY)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    parser = argparse.ArgumentParser(
+        description="Creates indexes before the API starts"
+    )
+    parser.add_argument(
+        "tenants", nargs="*", help="Tenants to set up, all of them by default"
+    )
+    parser.add_argument(
+        "--rebuild-local-index",
+        action="store_true",
+        help="Rebuild the local vector index even if it exists",
+    )
+    args = parser.parse_args()
+    # Indexes are created in the database of every tenant, or the given ones
+    for tenant in args.tenants or tenants:
+        with use_tenant(tenant):
+            # The API is started either way and reports not ready on /ready/
+            # until the indexes exist, so setup failures don't stop it
+            if not wait_for_neo4j():
+                logging.error(f"Skipped index setup of tenant {tenant}.")
+                continue
+            try:
+                setup_indices()
+                # Built before the workers start, so no request waits for it.
+                # An existing index is kept up to date by the writers.
+                if args.rebuild_local_index or not local_index.exists():
+                    local_index.build()
+            except Exception:
+                logging.exception(f"Index setup of tenant {tenant} failed")
+                continue
+            logging.info(f"Index setup of tenant {tenant} finished: {readiness()}")
@@ -0,0 +1,87 @@
+import json
+import os
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional
+
+# Tenant of requests without a tenant header, served from the NEO4J_* settings
+DEFAULT_TENANT = "default"
+# Header that selects the tenant of a request
+TENANT_HEADER = "x-tenant-id"
+# JSON object of tenant ids to their Neo4j settings, e.g.
+# {"acme": {"database": "acme"}, "globex": {"uri": "neo4j://other:7687"}}
+TENANTS = os.environ.get("TENANTS", "{}")
+
+
+class Tenant:
+    """
+    Neo4j database of a tenant. Each tenant has its own database, so index
+    names and merge keys like `Site {name}` are scoped to the tenant, and
+    its own drivers, so tenants don't compete for pooled connections.
+    """
+
+    def __init__(
+        self,
+        id: str,
+        database: Optional[str] = None,
+        uri: Optional[str] = None,
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+        max_connection_pool_size: Optional[int] = None,
+    ):
+        self.id = id
+        self.database = database or id
+        self.uri = uri or os.environ["NEO4J_URI"]
+        self.username = username or os.environ["NEO4J_USERNAME"]
+        self.password = password or os.environ["NEO4J_PASSWORD"]
+        self.max_connection_pool_size = max_connection_pool_size
+
+    def path(self, path: str) -> str:
+        """
+        Tenant specific version of a local file or directory path
+        """
+        if self.id == DEFAULT_TENANT:
+            return path
+        root, extension = os.path.splitext(path)
+        return f"{root}.{self.id}{extension}"
+
+
+def load_tenants(config: str = TENANTS) -> Dict[str, Tenant]:
+    # Same default database as Neo4jGraph
+    tenants = {
+        DEFAULT_TENANT: Tenant(
+            DEFAULT_TENANT, os.environ.get("NEO4J_DATABASE", "neo4j")
+        ),
+        **{id: Tenant(id, **settings) for id, settings in json.loads(config).items()},
+    }
+    databases = {}
+    for tenant in tenants.values():
+        other = databases.setdefault((tenant.uri, tenant.database), tenant.id)
+        if other != tenant.id:
+            raise ValueError(
+                f"Tenants {other} and {tenant.id} share database {tenant.database}"
+            )
+    return tenants
+
+
+tenants = load_tenants()
+
+_current: ContextVar[str] = ContextVar("tenant", default=DEFAULT_TENANT)
+
+
+def current_tenant() -> Tenant:
+    return tenants[_current.get()]
+
+
+@contextmanager
+def use_tenant(id: str) -> Iterator[Tenant]:
+    """
+    Routes database access and caches of the block to a tenant. Raises
+    KeyError for unknown tenants.
+    """
+    tenant = tenants[id]
+    token = _current.set(id)
+    try:
+        yield tenant
+    finally:
+        _current.reset(token)
@@ -1,7 +1,13 @@
+import asyncio
 import re
-from typing import List, Optional, Union
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextvars import copy_context
+from typing import Any, Dict, List, Optional, Tuple, Union
 
-from langchain.chains.graph_qa.cypher_utils import CypherQueryCorrector, Schema
+from cypher_cache import CypherTemplateCache
+from cypher_guard import check_plan, format_result, guarded_query
+from entity_resolution import entity_resolver
+from gazetteer import entity_extractor
 from langchain_core.messages import (
     AIMessage,
     SystemMessage,
@@ -13,34 +19,35 @@ from langchain_core.prompts import (
     HumanMessagePromptTemplate,
     MessagesPlaceholder,
 )
-from langchain_core.pydantic_v1 import BaseModel
-from langchain_core.runnables import RunnablePassthrough
-from utils import Entities, entity_chain, graph, llm
-
-# Cypher validation tool for relationship directions
-corrector_schema = [
-    Schema(el["start"], el["type"], el["end"])
-    for el in graph.structured_schema.get("relationships")
-]
-cypher_validation = CypherQueryCorrector(corrector_schema)
+from langchain_core.pydantic_v1 import BaseModel, Field
+from langchain_core.runnables import (
+    RunnableConfig,
+    RunnableLambda,
+    RunnablePassthrough,
+)
+from metrics import timed
+from schema import SchemaSnapshot, schema_service
+from utils import Entities, TenantLocal, llm
 
 
 # Fulltext index query
-def map_to_database(entities: Entities) -> Optional[str]:
+def get_entity_mapping(entities: Entities) -> Dict[str, str]:
+    candidates = entity_resolver.resolve(entities.names)
+    return {entity: names[0] for entity, names in candidates.items() if names}
+
+
+def map_to_database(entity_mapping: Dict[str, str]) -> Optional[str]:
     result = ""
-    for entity in entities.names:
-        response = graph.query(
-            "CALL db.index.fulltext.queryNodes('entity', $entity + '*', {limit:1})"
-            " YIELD node,score RETURN node.name AS result",
-            {"entity": entity},
-        )
-        try:
-            result += f"{entity} maps to {response[0]['result']} in database\n"
-        except IndexError:
-            pass
+    for entity, value in entity_mapping.items():
+        result += f"{entity} maps to {value} in database\n"
     return result
 
 
+# Sampling temperature of speculative Cypher candidates
+SPECULATIVE_TEMPERATURE = 0.7
+# Upper bound of the candidates a request can ask for, each is an LLM call
+MAX_CANDIDATES = 4
+
 # Generate Cypher statement based on natural language input
 cypher_template = """Based on the Neo4j graph schema below, write a Cypher query that would answer the user's question:
 {schema}
@@ -60,15 +67,26 @@ cypher_prompt = ChatPromptTemplate.from_messages(
 )
 
 cypher_response = (
-    RunnablePassthrough.assign(names=entity_chain)
-    | RunnablePassthrough.assign(
-        entities_list=lambda x: map_to_database(x["names"]),
-        schema=lambda _: graph.get_schema,
+    RunnablePassthrough.assign(
+        entities_list=lambda x: map_to_database(x["entity_mapping"]),
     )
     | cypher_prompt
     | llm
 )
 
+# Additional speculative candidates are sampled for diversity
+speculative_cypher_response = (
+    RunnablePassthrough.assign(
+        entities_list=lambda x: map_to_database(x["entity_mapping"]),
+    )
+    | cypher_prompt
+    | llm.bind(temperature=SPECULATIVE_TEMPERATURE)
+)
+
+cypher_cache = TenantLocal(lambda tenant: CypherTemplateCache())
+# Templates were validated against the previous schema
+schema_service.on_change(lambda _: cypher_cache.clear())
+
 # Generate natural language response based on database results
 response_system = """You are an assistant that helps to form nice and human 
 understandable answers based on the provided information from tools.
@@ -94,11 +112,156 @@ def clean_query(query: str) -> str:
     return matches[0] if matches else query.content
 
 
+def _cached_cypher(input: Dict[str, Any], version: str) -> Optional[Dict[str, Any]]:
+    cached = cypher_cache.get(input["question"], input["entity_mapping"], version)
+    if cached:
+        query, params = cached
+        return {
+            "query": query,
+            "params": params,
+            "cached": True,
+            "checked": False,
+            "version": version,
+        }
+    return None
+
+
+def _generated_cypher(
+    query: str, version: str, checked: bool = False
+) -> Dict[str, Any]:
+    return {
+        "query": query,
+        "params": {},
+        "cached": False,
+        "checked": checked,
+        "version": version,
+    }
+
+
+def _check_candidate(query: str) -> Optional[str]:
+    """
+    Returns the query if it passes check_plan, or None if it is invalid
+    """
+    try:
+        return check_plan(query) if query else None
+    except Exception:
+        return None
+
+
+def _generate_candidate(
+    input: Dict[str, Any], config: RunnableConfig, snapshot: SchemaSnapshot, index: int
+) -> Tuple[str, Optional[str]]:
+    chain = cypher_response if index == 0 else speculative_cypher_response
+    try:
+        query = snapshot.corrector(clean_query(chain.invoke(input, config)))
+    except Exception:
+        return "", None
+    return query, _check_candidate(query)
+
+
+async def _agenerate_candidate(
+    input: Dict[str, Any], config: RunnableConfig, snapshot: SchemaSnapshot, index: int
+) -> Tuple[str, Optional[str]]:
+    chain = cypher_response if index == 0 else speculative_cypher_response
+    try:
+        query = snapshot.corrector(clean_query(await chain.ainvoke(input, config)))
+    except Exception:
+        return "", None
+    return query, await asyncio.to_thread(_check_candidate, query)
+
+
+def _candidates(input: Dict[str, Any]) -> int:
+    # The chain may be invoked without the validation of the input type
+    return min(max(input.get("candidates") or 1, 1), MAX_CANDIDATES)
+
+
+@timed("cypher_generation")
+def generate_cypher(input: Dict[str, Any], config: RunnableConfig) -> Dict[str, Any]:
+    """
+    Reuses a cached template for questions of the same shape,
+    otherwise generates and validates a new Cypher statement.
+
+    With more than one candidate requested, candidates are generated
+    concurrently and the first one passing validation and EXPLAIN wins.
+    """
+    # Prompt, validation and cached templates must use the same schema version
+    snapshot = schema_service.get()
+    cached = _cached_cypher(input, snapshot.version)
+    if cached:
+        return cached
+    prompt_input = {**input, "schema": snapshot.schema}
+    candidates = _candidates(input)
+    if candidates == 1:
+        response = cypher_response.invoke(prompt_input, config)
+        return _generated_cypher(
+            snapshot.corrector(clean_query(response)), snapshot.version
+        )
+    executor = ThreadPoolExecutor(max_workers=candidates)
+    # Candidates are checked against the database of the current tenant
+    futures = [
+        executor.submit(
+            copy_context().run, _generate_candidate, prompt_input, config, snapshot, i
+        )
+        for i in range(candidates)
+    ]
+    fallback = ""
+    try:
+        for future in as_completed(futures):
+            query, checked_query = future.result()
+            if checked_query:
+                return _generated_cypher(checked_query, snapshot.version, True)
+            fallback = fallback or query
+    finally:
+        # Running LLM calls can't be interrupted, their results are discarded
+        executor.shutdown(wait=False, cancel_futures=True)
+    return _generated_cypher(fallback, snapshot.version)
+
+
+@timed("cypher_generation")
+async def agenerate_cypher(
+    input: Dict[str, Any], config: RunnableConfig
+) -> Dict[str, Any]:
+    snapshot = await asyncio.to_thread(schema_service.get)
+    cached = _cached_cypher(input, snapshot.version)
+    if cached:
+        return cached
+    prompt_input = {**input, "schema": snapshot.schema}
+    candidates = _candidates(input)
+    if candidates == 1:
+        response = await cypher_response.ainvoke(prompt_input, config)
+        return _generated_cypher(
+            snapshot.corrector(clean_query(response)), snapshot.version
+        )
+    tasks = [
+        asyncio.create_task(_agenerate_candidate(prompt_input, config, snapshot, i))
+        for i in range(candidates)
+    ]
+    fallback = ""
+    try:
+        for next_candidate in asyncio.as_completed(tasks):
+            query, checked_query = await next_candidate
+            if checked_query:
+                return _generated_cypher(checked_query, snapshot.version, True)
+            fallback = fallback or query
+    finally:
+        for task in tasks:
+            task.cancel()
+    return _generated_cypher(fallback, snapshot.version)
+
+
 def get_function_response(
-    query: str, question: str
+    cypher: Dict[str, Any], question: str, entity_mapping: Dict[str, str]
 ) -> List[Union[AIMessage, ToolMessage]]:
     try:
-        context = graph.query(cypher_validation(clean_query(query)))
+        data = guarded_query(
+            cypher["query"], cypher["params"], check=not cypher["checked"]
+        )
+        context = format_result(data)
+        # Empty results may come from a wrong query, so it isn't reused
+        if data and cypher["query"] and not cypher["cached"]:
+            cypher_cache.put(
+                question, entity_mapping, cypher["query"], cypher["version"]
+            )
     except Exception as e:
         context = str(e)
     TOOL_ID = "call_H7fABDuzEau48T10Qn0Lsh0D"
@@ -118,15 +281,23 @@ def get_function_response(
                 ]
             },
         ),
-        ToolMessage(content=str(context), tool_call_id=TOOL_ID),
+        ToolMessage(content=context, tool_call_id=TOOL_ID),
     ]
     return messages
 
 
 text2cypher_chain = (
-    RunnablePassthrough.assign(query=cypher_response)
+    RunnablePassthrough.assign(names=entity_extractor)
     | RunnablePassthrough.assign(
-        function_response=lambda x: get_function_response(x["query"], x["question"])
+        entity_mapping=lambda x: get_entity_mapping(x["names"])
+    )
+    | RunnablePassthrough.assign(
+        cypher=RunnableLambda(generate_cypher, afunc=agenerate_cypher)
+    )
+    | RunnablePassthrough.assign(
+        function_response=lambda x: get_function_response(
+            x["cypher"], x["question"], x["entity_mapping"]
+        )
     )
     | response_prompt
     | llm
@@ -138,6 +309,12 @@ text2cypher_chain = (
 
 class Question(BaseModel):
     question: str
+    candidates: int = Field(
+        1,
+        ge=1,
+        le=MAX_CANDIDATES,
+        description="Number of Cypher candidates generated concurrently",
+    )
 
 
 text2cypher_chain = text2cypher_chain.with_types(input_type=Question)
@@ -1,5 +1,12 @@
-from typing import Any, Dict, List, Tuple
+import asyncio
+import base64
+import logging
+import os
+import threading
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
 
+import httpx
+import numpy as np
 from langchain_community.graphs import Neo4jGraph
 from langchain_community.vectorstores import Neo4jVector
 from langchain_community.vectorstores.neo4j_vector import remove_lucene_chars
@@ -7,16 +14,131 @@ from langchain_core.messages import AIMessage, HumanMessage
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.pydantic_v1 import BaseModel, Field
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-from langchain_text_splitters import TokenTextSplitter
+from metrics import first_token_timer
+from neo4j import READ_ACCESS, WRITE_ACCESS, AsyncGraphDatabase
+from tenants import DEFAULT_TENANT, Tenant, current_tenant
 
 index_name = "news_vector"
 keyword_index_name = "news_fulltext"
 entity_keyword_index = "entity"
 
-llm = ChatOpenAI(temperature=0, model="gpt-4-turbo", streaming=True)
+# Connection pool size of each Neo4j driver
+NEO4J_MAX_POOL_SIZE = int(os.environ.get("NEO4J_MAX_POOL_SIZE", 100))
+# Seconds a session waits for a free connection before failing
+NEO4J_ACQUISITION_TIMEOUT = float(os.environ.get("NEO4J_ACQUISITION_TIMEOUT", 60))
+# Number of records fetched per batch from the database
+NEO4J_FETCH_SIZE = int(os.environ.get("NEO4J_FETCH_SIZE", 1000))
+# Seconds to wait for Diffbot and other HTTP APIs
+HTTP_TIMEOUT = float(os.environ.get("HTTP_TIMEOUT", 60))
+
+# Dimensions of stored embeddings, text-embedding-3 models shorten vectors
+# natively. Changing it requires dropping the vector index and re-embedding.
+EMBEDDING_DIMENSIONS = int(os.environ.get("EMBEDDING_DIMENSIONS", 1536))
+# Int8 quantization of the vector index, requires Neo4j 5.23 or later
+VECTOR_QUANTIZATION = os.environ.get("VECTOR_QUANTIZATION", "false").lower() == "true"
+# Texts per embeddings request, the API accepts up to 2048
+EMBEDDING_BATCH_SIZE = 1000
+
+driver_config = {
+    "max_connection_pool_size": NEO4J_MAX_POOL_SIZE,
+    "connection_acquisition_timeout": NEO4J_ACQUISITION_TIMEOUT,
+    "fetch_size": NEO4J_FETCH_SIZE,
+}
+
+
+def tenant_driver_config(tenant: Tenant) -> Dict[str, Any]:
+    if tenant.max_connection_pool_size is None:
+        return driver_config
+    return {
+        **driver_config,
+        "max_connection_pool_size": tenant.max_connection_pool_size,
+    }
+
+
+llm = ChatOpenAI(
+    temperature=0,
+    model="gpt-4-turbo",
+    streaming=True,
+    callbacks=[first_token_timer],
+)
+
+
+class Lazy:
+    """
+    Proxy that builds the wrapped object on first use, so importing a module
+    doesn't connect to the database or load tokenizers. Construction is
+    retried on the next use when it fails.
+    """
+
+    def __init__(self, factory: Callable[[], Any]):
+        self._factory = factory
+        self._instance = None
+        self._lock = threading.Lock()
+
+    @property
+    def initialized(self) -> bool:
+        return self._instance is not None
+
+    def get(self) -> Any:
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    self._instance = self._factory()
+        return self._instance
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.get(), name)
+
+
+class TenantLocal:
+    """
+    Proxy to a separate instance per tenant, built on first use by the
+    tenant of the current request. Wraps drivers and caches, so tenants
+    share neither connections nor cached data.
+    """
+
+    def __init__(self, factory: Callable[[Tenant], Any]):
+        self._factory = factory
+        self._instances: Dict[str, Lazy] = {}
+        self._lock = threading.Lock()
+
+    def _lazy(self, tenant: Tenant) -> Lazy:
+        with self._lock:
+            if tenant.id not in self._instances:
+                self._instances[tenant.id] = Lazy(lambda: self._factory(tenant))
+            return self._instances[tenant.id]
+
+    def current(self) -> Any:
+        """
+        Instance of the current tenant. Unlike `Lazy.get`, it doesn't shadow
+        `get` methods of the wrapped caches.
+        """
+        return self._lazy(current_tenant()).get()
+
+    def instances(self) -> Dict[str, Any]:
+        """
+        Instances of all tenants that were built
+        """
+        with self._lock:
+            lazies = dict(self._instances)
+        return {id: el.get() for id, el in lazies.items() if el.initialized}
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.current(), name)
+
+
+vector_index_options_query = """
+SHOW INDEXES YIELD name, options
+WHERE name = $name
+RETURN toInteger(options.indexConfig['vector.dimensions']) AS dimensions
+"""
 
 
 def setup_indices():
+    """
+    Creates indexes and backfills derived properties. Idempotent, run as
+    an explicit startup step with `python startup.py`.
+    """
     graph.query(
         "CREATE CONSTRAINT classification IF NOT EXISTS FOR (n:`Classification`) REQUIRE (n.name) IS UNIQUE;"
     )
@@ -24,40 +146,248 @@ def setup_indices():
     graph.query(
         "CREATE INDEX entity_range IF NOT EXISTS FOR (n:`__Entity__`) ON (n.name);"
     )
+    graph.query("CREATE INDEX chunk_id IF NOT EXISTS FOR (n:Chunk) ON (n.id);")
+    graph.query("CREATE INDEX article_id IF NOT EXISTS FOR (n:Article) ON (n.id);")
+    graph.query(
+        "CREATE INDEX article_sentiment_bucket IF NOT EXISTS "
+        "FOR (n:Article) ON (n.sentiment_bucket);"
+    )
+    # Backfill sentiment buckets of articles imported before they existed,
+    # and move articles without a sentiment or exactly at a threshold out of
+    # the neutral bucket they were once given
+    graph.query(
+        """MATCH (a:Article)
+    WHERE a.sentiment_bucket IS NULL
+       OR (a.sentiment_bucket = 'neutral' AND NOT coalesce(-0.5 < a.sentiment < 0.5, false))
+    CALL {
+      WITH a
+      SET a.sentiment_bucket = CASE WHEN a.sentiment > 0.5 THEN 'positive'
+                                    WHEN a.sentiment < -0.5 THEN 'negative'
+                                    WHEN -0.5 < a.sentiment < 0.5 THEN 'neutral'
+                                    ELSE 'unclassified' END
+    } IN TRANSACTIONS OF 10000 ROWS"""
+    )
     graph.query(
         f"CREATE FULLTEXT INDEX {entity_keyword_index} IF NOT EXISTS FOR (n:`__Entity__`) ON EACH [n.name]",
     )
     graph.query(
         f"CREATE FULLTEXT INDEX {keyword_index_name} IF NOT EXISTS FOR (n:Chunk) ON EACH [n.text]",
     )
+    quantization = (
+        ", `vector.quantization.enabled`: true" if VECTOR_QUANTIZATION else ""
+    )
     graph.query(
         f"""CREATE VECTOR INDEX {index_name} IF NOT EXISTS
     FOR (n: Chunk) ON (n.embedding)
     OPTIONS {{indexConfig: {{
-    `vector.dimensions`: 1536,
-    `vector.similarity_function`: 'cosine'
+    `vector.dimensions`: {EMBEDDING_DIMENSIONS},
+    `vector.similarity_function`: 'cosine'{quantization}
     }}}}""",
     )
+    existing = graph.query(vector_index_options_query, {"name": index_name})
+    if existing and existing[0]["dimensions"] != EMBEDDING_DIMENSIONS:
+        logging.warning(
+            f"Vector index {index_name} has {existing[0]['dimensions']} dimensions, "
+            f"EMBEDDING_DIMENSIONS is {EMBEDDING_DIMENSIONS}. Drop the index and "
+            "re-embed the chunks to change it."
+        )
 
 
-graph = Neo4jGraph(enhanced_schema=False, refresh_schema=True)
+# Schema is introspected on demand by the schema service.
+# `graph.query` runs in write sessions, reads should use `read_query`.
+graph = TenantLocal(
+    lambda tenant: Neo4jGraph(
+        url=tenant.uri,
+        username=tenant.username,
+        password=tenant.password,
+        database=tenant.database,
+        enhanced_schema=False,
+        refresh_schema=False,
+        driver_config=tenant_driver_config(tenant),
+    )
+)
 
-embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
+# Async driver for handlers that must not block the event loop
+async_driver = TenantLocal(
+    lambda tenant: AsyncGraphDatabase.driver(
+        tenant.uri,
+        auth=(tenant.username, tenant.password),
+        **tenant_driver_config(tenant),
+    )
+)
+
+
+def _read(tx, query: str, params: Dict[str, Any]) -> List[Dict]:
+    return tx.run(query, params).data()
+
+
+async def _arun(tx, query: str, params: Dict[str, Any]) -> List[Dict]:
+    result = await tx.run(query, params)
+    return await result.data()
 
-# Setup vector and keyword indices
-setup_indices()
 
-vector_index = Neo4jVector.from_existing_index(
-    embeddings,
-    graph=graph,
-    index_name=index_name,
-    keyword_index_name=keyword_index_name,
-    search_type="hybrid",
+def read_query(query: str, params: Optional[Dict[str, Any]] = None) -> List[Dict]:
+    """
+    Runs a read-only query in a managed read transaction. In a cluster it is
+    routed to readers, so it doesn't queue behind long write transactions,
+    and it is retried on transient errors.
+    """
+    with graph._driver.session(
+        database=graph._database, default_access_mode=READ_ACCESS
+    ) as session:
+        return session.execute_read(_read, query, params or {})
+
+
+async def aquery(query: str, params: Optional[Dict[str, Any]] = None) -> List[Dict]:
+    """
+    Async version of `read_query`
+    """
+    async with async_driver.session(
+        database=current_tenant().database, default_access_mode=READ_ACCESS
+    ) as session:
+        return await session.execute_read(_arun, query, params or {})
+
+
+async def awrite_query(
+    query: str, params: Optional[Dict[str, Any]] = None
+) -> List[Dict]:
+    """
+    Runs an idempotent write query in a managed write transaction
+    """
+    async with async_driver.session(
+        database=current_tenant().database, default_access_mode=WRITE_ACCESS
+    ) as session:
+        return await session.execute_write(_arun, query, params or {})
+
+
+# Shared client, so connections to external APIs are reused
+http_client = Lazy(lambda: httpx.AsyncClient(timeout=HTTP_TIMEOUT))
+
+
+async def gather_with_limit(aws: List[Awaitable], limit: int) -> List[Any]:
+    """
+    Like asyncio.gather, running at most `limit` awaitables at once
+    """
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(aw: Awaitable) -> Any:
+        async with semaphore:
+            return await aw
+
+    return await asyncio.gather(*[run(el) for el in aws])
+
+
+def _pool_usage(driver) -> Dict[str, Any]:
+    pool = driver._pool
+    addresses = {}
+    for address, connections in list(pool.connections.items()):
+        connections = list(connections)
+        in_use = sum(el.in_use for el in connections)
+        addresses[str(address)] = {
+            "in_use": in_use,
+            "idle": len(connections) - in_use,
+            "saturation": in_use / pool.pool_config.max_connection_pool_size,
+        }
+    return {
+        "max_size": pool.pool_config.max_connection_pool_size,
+        "addresses": addresses,
+    }
+
+
+def _driver_name(tenant: str, name: str) -> str:
+    return name if tenant == DEFAULT_TENANT else f"{tenant}/{name}"
+
+
+def pool_metrics() -> Dict[str, Any]:
+    """
+    Connection usage per server address of the drivers that were started,
+    prefixed with the tenant for tenants other than the default. The driver
+    has no public pool API, so its internals are read and omitted if they
+    change.
+    """
+    drivers = {}
+    for id, instance in graph.instances().items():
+        drivers[_driver_name(id, "sync")] = instance._driver
+    for id, instance in async_driver.instances().items():
+        drivers[_driver_name(id, "async")] = instance
+    metrics = {}
+    for name, driver in drivers.items():
+        try:
+            metrics[name] = _pool_usage(driver)
+        except AttributeError:
+            pass
+    return metrics
+
+
+embeddings = OpenAIEmbeddings(
+    model="text-embedding-3-small", dimensions=EMBEDDING_DIMENSIONS
 )
 
-text_splitter = TokenTextSplitter(
-    chunk_size=500,
-    chunk_overlap=50,
+
+def _embedding_request(texts: List[str]) -> Dict[str, Any]:
+    # Base64 responses are decoded straight into float32 arrays
+    return {
+        "input": texts,
+        "model": embeddings.model,
+        "dimensions": EMBEDDING_DIMENSIONS,
+        "encoding_format": "base64",
+    }
+
+
+def _decode_embeddings(matrix: np.ndarray, offset: int, response) -> None:
+    for el in response.data:
+        matrix[offset + el.index] = np.frombuffer(
+            base64.b64decode(el.embedding), dtype=np.float32
+        )
+
+
+def embed_texts(texts: List[str]) -> np.ndarray:
+    """
+    Embeds texts into a contiguous float32 matrix with a row per text,
+    without going through Python lists of floats
+    """
+    matrix = np.empty((len(texts), EMBEDDING_DIMENSIONS), dtype=np.float32)
+    for offset in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+        response = embeddings.client.create(
+            **_embedding_request(texts[offset : offset + EMBEDDING_BATCH_SIZE])
+        )
+        _decode_embeddings(matrix, offset, response)
+    return matrix
+
+
+async def aembed_texts(texts: List[str]) -> np.ndarray:
+    matrix = np.empty((len(texts), EMBEDDING_DIMENSIONS), dtype=np.float32)
+    offsets = range(0, len(texts), EMBEDDING_BATCH_SIZE)
+    responses = await asyncio.gather(
+        *[
+            embeddings.async_client.create(
+                **_embedding_request(texts[offset : offset + EMBEDDING_BATCH_SIZE])
+            )
+            for offset in offsets
+        ]
+    )
+    for offset, response in zip(offsets, responses):
+        _decode_embeddings(matrix, offset, response)
+    return matrix
+
+
+# Chunk properties and the article of the chunk, so chunks of the same
+# article can be recognized when context is packed
+chunk_retrieval_query = """
+RETURN node.text AS text, score,
+       node {.*, text: Null, embedding: Null, id: Null,
+             article_id: [(a:Article)-[:HAS_CHUNK]->(node) | a.id][0]} AS metadata
+"""
+
+vector_index = TenantLocal(
+    lambda tenant: Neo4jVector.from_existing_index(
+        embeddings,
+        graph=graph.current(),
+        index_name=index_name,
+        keyword_index_name=keyword_index_name,
+        search_type="hybrid",
+        retrieval_query=chunk_retrieval_query,
+    )
 )
 
 
@@ -65,6 +395,10 @@ def format_docs(docs):
     return "\n\n".join(doc.page_content for doc in docs)
 
 
+def format_chunks(chunks: List[str]) -> str:
+    return "\n\n".join(chunks)
+
+
 def _format_chat_history(chat_history: List[Tuple[str, str]]) -> List:
     buffer = []
     for human, ai in chat_history:
@@ -117,29 +451,3 @@ def generate_full_text_query(input: str) -> str:
         full_text_query += f" {word}~2 AND"
     full_text_query += f" {words[-1]}~2"
     return full_text_query.strip()
-
-
-def remove_null_properties(data: Dict[str, Any]):
-    if not data:
-        return []
-    # Process the 'nodes' part of the data
-    for node in data["nodes"]:
-        # Create a list of keys to remove (those that are None)
-        keys_to_remove = [
-            key for key, value in node["properties"].items() if value is None
-        ]
-        # Remove each key from the properties dictionary
-        for key in keys_to_remove:
-            node["properties"].pop(key)
-
-    # Process the 'relationships' part of the data
-    for relationship in data["relationships"]:
-        # Create a list of keys to remove (those that are None)
-        keys_to_remove = [
-            key for key, value in relationship["properties"].items() if value is None
-        ]
-        # Remove each key from the properties dictionary
-        for key in keys_to_remove:
-            relationship["properties"].pop(key)
-
-    return data
@@ -0,0 +1,243 @@
+"""
+Seeded synthetic corpus for the offline benchmarks.
+
+Generates organizations, people and news articles mentioning them, along with
+the Diffbot responses (DQL articles, Enhance entities and NLP facts) the API
+would receive for them. The same seed and sizes always yield the same corpus.
+"""
+
+import random
+from typing import Any, Dict, List, Optional
+
+SYLLABLES = ["ka", "lo", "mi", "ran", "te", "vo", "su", "der", "qui", "zen", "bra"]
+ORGANIZATION_SUFFIXES = ["Systems", "Labs", "Group", "Holdings", "Energy", "Health"]
+FIRST_NAMES = ["Ada", "Ben", "Chen", "Dana", "Emil", "Fatima", "Goran", "Hana", "Ivo"]
+TOPICS = [
+    "artificial intelligence",
+    "battery storage",
+    "cloud computing",
+    "drug discovery",
+    "semiconductors",
+    "supply chains",
+    "renewable energy",
+    "cybersecurity",
+]
+CITIES = ["Berlin", "Lagos", "Osaka", "Lima", "Toronto", "Pune"]
+SITES = ["Daily Ledger", "Market Wire", "Tech Courier", "Global Post"]
+TITLES = ["CEO", "CTO", "head of research", "chief financial officer"]
+
+# Diffbot fact type per relationship between a person and an organization
+EMPLOYMENT_FACT = "employee or member of"
+
+
+def uri(kind: str, index: int) -> str:
+    return f"http://diffbot.com/entity/bench-{kind}-{index}"
+
+
+class Corpus:
+    def __init__(
+        self,
+        articles: int = 200,
+        organizations: int = 50,
+        people: int = 100,
+        seed: int = 42,
+    ):
+        rng = random.Random(seed)
+        self.organizations = self._names(
+            rng, organizations, lambda: rng.choice(ORGANIZATION_SUFFIXES)
+        )
+        self.people = self._names(rng, people, lambda: None)
+        self.employers = {el: rng.randrange(organizations) for el in range(people)}
+        self.articles = [self._article(rng, i) for i in range(articles)]
+        self._organization_index = {el: i for i, el in enumerate(self.organizations)}
+        self._person_index = {el: i for i, el in enumerate(self.people)}
+
+    @staticmethod
+    def _names(rng: random.Random, size: int, suffix) -> List[str]:
+        names = []
+        while len(names) < size:
+            word = "".join(rng.choice(SYLLABLES) for _ in range(3)).capitalize()
+            extra = suffix()
+            name = f"{word} {extra}" if extra else f"{rng.choice(FIRST_NAMES)} {word}"
+            if name not in names:
+                names.append(name)
+        return names
+
+    def _sentences(self, rng: random.Random, orgs: List[int], people: List[int]):
+        topic = rng.choice(TOPICS)
+        sentences = []
+        for person in people:
+            sentences.append(
+                f"{self.people[person]} serves as {rng.choice(TITLES)} of "
+                f"{self.organizations[self.employers[person]]}."
+            )
+        for first, second in zip(orgs, orgs[1:]):
+            sentences.append(
+                f"{self.organizations[first]} announced a partnership with "
+                f"{self.organizations[second]} on {topic}."
+            )
+        # Filler text so articles span several chunks
+        for _ in range(rng.randint(20, 80)):
+            sentences.append(
+                f"Analysts expect the {rng.choice(TOPICS)} market in "
+                f"{rng.choice(CITIES)} to grow {rng.randint(1, 40)} percent as "
+                f"{self.organizations[rng.choice(orgs)]} expands its {topic} business."
+            )
+        rng.shuffle(sentences)
+        return topic, " ".join(sentences)
+
+    def _article(self, rng: random.Random, index: int) -> Dict[str, Any]:
+        orgs = rng.sample(
+            range(len(self.organizations)), min(3, len(self.organizations))
+        )
+        people = rng.sample(range(len(self.people)), min(2, len(self.people)))
+        # Employers of mentioned people are mentioned as well
+        orgs = list(dict.fromkeys(orgs + [self.employers[el] for el in people]))
+        topic, text = self._sentences(rng, orgs, people)
+        sentiment = round(rng.uniform(-1, 1), 3)
+        return {
+            "id": f"bench-article-{index}",
+            "title": f"{self.organizations[orgs[0]]} bets on {topic}",
+            "text": text,
+            # Daily articles going back from 2024-06-01
+            "date": {"timestamp": (1717200000 - index * 86400) * 1000},
+            "siteName": rng.choice(SITES),
+            "publisherRegion": "Europe",
+            "language": "en",
+            "author": f"{rng.choice(FIRST_NAMES)} Writer",
+            "pageUrl": f"https://news.example.com/articles/{index}",
+            "sentiment": sentiment,
+            "categories": [{"name": topic.title(), "score": 0.9}],
+            "tags": [
+                {
+                    "label": self.organizations[el],
+                    "sentiment": sentiment,
+                    "uri": uri("organization", el),
+                    "types": ["http://dbpedia.org/ontology/Organisation"],
+                }
+                for el in orgs
+            ],
+        }
+
+    def dql(self, offset: int, size: int) -> Dict[str, Any]:
+        """
+        Diffbot DQL response with `size` articles, wrapping around the corpus
+        """
+        return {
+            "hits": len(self.articles),
+            "data": [
+                {"entity": self.articles[(offset + i) % len(self.articles)]}
+                for i in range(size)
+            ],
+        }
+
+    def enhance(self, type: str, name: str) -> Dict[str, Any]:
+        """
+        Diffbot Enhance response for an organization or person of the corpus
+        """
+        if type == "Organization" and name in self._organization_index:
+            index = self._organization_index[name]
+            employees = [p for p, o in self.employers.items() if o == index]
+            entity = {
+                "type": "Organization",
+                "name": name,
+                "nbEmployees": 50 + index * 37,
+                "revenue": {"value": 1_000_000 * (index + 1), "currency": "USD"},
+                "foundingDate": {"timestamp": (946684800 + index * 86400 * 90) * 1000},
+                "description": f"{name} is a synthetic benchmark company.",
+                "isDissolved": False,
+                "diffbotClassification": [
+                    {"name": TOPICS[index % len(TOPICS)].title(), "isPrimary": True}
+                ],
+                "competitors": [
+                    {
+                        "name": self.organizations[
+                            (index + i) % len(self.organizations)
+                        ],
+                        "type": "Organization",
+                    }
+                    for i in (1, 2)
+                ],
+            }
+            if employees:
+                entity["ceo"] = {"name": self.people[employees[0]], "type": "Person"}
+            return {"data": [{"score": 1.0, "entity": entity}]}
+        if type == "Person" and name in self._person_index:
+            index = self._person_index[name]
+            first, last = name.split(" ", 1)
+            return {
+                "data": [
+                    {
+                        "score": 1.0,
+                        "entity": {
+                            "type": "Person",
+                            "name": name,
+                            "nameDetail": {"firstName": first, "lastName": last},
+                            "description": f"{name} is a synthetic benchmark person.",
+                            "locations": [
+                                {
+                                    "city": {"name": CITIES[index % len(CITIES)]},
+                                    "country": {"name": "Benchmarkland"},
+                                }
+                            ],
+                            "nationalities": [{"name": "Benchmarkish"}],
+                            "employments": [
+                                {
+                                    "title": TITLES[index % len(TITLES)],
+                                    "employer": {
+                                        "name": self.organizations[
+                                            self.employers[index]
+                                        ]
+                                    },
+                                    "isCurrent": True,
+                                    "from": {"str": "d2019-01-01"},
+                                }
+                            ],
+                        },
+                    }
+                ]
+            }
+        return {"data": []}
+
+    def _entity(self, name: str) -> Optional[Dict[str, Any]]:
+        if name in self._organization_index:
+            index = self._organization_index[name]
+            return {
+                "name": name,
+                "allUris": [uri("organization", index)],
+                "allTypes": [{"name": "organization"}],
+            }
+        if name in self._person_index:
+            index = self._person_index[name]
+            return {
+                "name": name,
+                "allUris": [uri("person", index)],
+                "allTypes": [{"name": "person"}],
+            }
+        return None
+
+    def nlp(self, content: str) -> Dict[str, Any]:
+        """
+        Diffbot Natural Language response for an article text of the corpus
+        """
+        mentioned = [el for el in self.organizations + self.people if el in content]
+        entities = [
+            {**self._entity(el), "sentiment": 0.1, "confidence": 0.9}
+            for el in mentioned
+        ]
+        facts = []
+        for name in mentioned:
+            if name not in self._person_index:
+                continue
+            employer = self.organizations[self.employers[self._person_index[name]]]
+            if employer in mentioned:
+                facts.append(
+                    {
+                        "entity": self._entity(name),
+                        "value": self._entity(employer),
+                        "property": {"name": EMPLOYMENT_FACT},
+                        "confidence": 0.9,
+                        "evidence": [{"passage": f"{name} serves at {employer}."}],
+                    }
+                )
+        return {"entities": entities, "facts": facts, "sentiment": 0.1}
@@ -0,0 +1,91 @@
+"""
+Load test of /dashboard/ latency while ingestion endpoints are running.
+
+Polls the dashboard at a fixed rate against a running API, first alone and
+then while concurrent article imports and processing calls are in flight.
+The dashboard should stay flat, as ingestion handlers wait on Diffbot,
+OpenAI and Neo4j without holding worker threads.
+
+Usage: python benchmarks/dashboard_under_ingestion.py [base_url] [seconds] [ingestion_calls]
+"""
+
+import asyncio
+import statistics
+import sys
+import time
+
+import httpx
+
+# Dashboard requests per second
+POLL_RATE = 20
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100), len(values) - 1)]
+
+
+async def poll_dashboard(client: httpx.AsyncClient, seconds: float):
+    latencies = []
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        response = await client.get("/dashboard/")
+        response.raise_for_status()
+        latencies.append((time.perf_counter() - start) * 1000)
+        await asyncio.sleep(max(1 / POLL_RATE - (time.perf_counter() - start), 0))
+    return latencies
+
+
+async def ingest(client: httpx.AsyncClient, calls: int):
+    requests = []
+    for i in range(calls):
+        if i % 2:
+            requests.append(client.post("/process_articles/"))
+        else:
+            requests.append(
+                client.post(
+                    "/import_articles/",
+                    json={"query": None, "tag": "Artificial intelligence", "size": 5},
+                )
+            )
+    responses = await asyncio.gather(*requests, return_exceptions=True)
+    return sum(
+        1 for el in responses if isinstance(el, httpx.Response) and el.is_success
+    )
+
+
+def report(name: str, latencies):
+    print(
+        f"{name:12} {len(latencies):>6} {statistics.median(latencies):>8.1f} "
+        f"{percentile(latencies, 95):>8.1f} {percentile(latencies, 99):>8.1f} "
+        f"{max(latencies):>8.1f}"
+    )
+
+
+async def main(
+    base_url: str = "http://localhost:8000",
+    seconds: float = 20,
+    ingestion_calls: int = 8,
+):
+    async with httpx.AsyncClient(base_url=base_url, timeout=600) as client:
+        baseline = await poll_dashboard(client, seconds)
+        ingestion = asyncio.create_task(ingest(client, ingestion_calls))
+        loaded = await poll_dashboard(client, seconds)
+        succeeded = await ingestion
+    print(
+        f"{'phase':12} {'n':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}"
+    )
+    report("idle", baseline)
+    report("ingestion", loaded)
+    print(f"Ingestion calls succeeded: {succeeded}/{ingestion_calls}")
+
+
+if __name__ == "__main__":
+    asyncio.run(
+        main(
+            *sys.argv[1:2],
+            *[float(el) for el in sys.argv[2:3]],
+            *[int(el) for el in sys.argv[3:4]],
+        )
+    )
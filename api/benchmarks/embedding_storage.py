@@ -0,0 +1,152 @@
+"""
+Measures memory, import throughput and recall of chunk embedding storage.
+
+Uses the chunk embeddings stored in the database. The benchmark:
+- Compares the memory held by import parameters with embeddings as Python
+  float lists and as float32 array rows.
+- Measures write throughput of each into temporary BenchmarkChunk nodes,
+  also at shortened dimensions.
+- Measures recall@k of shortened and int8 quantized vectors against exact
+  search over the full vectors.
+
+Shortened vectors are truncated and normalized, matching the `dimensions`
+parameter of text-embedding-3 models. Quantization is scalar int8 per
+dimension, approximating the quantized vector index of Neo4j 5.23+.
+
+Usage: python benchmarks/embedding_storage.py [chunks] [queries] [k]
+"""
+
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "app"))
+
+from utils import graph, read_query  # noqa: E402
+
+# Rows per write transaction
+BATCH_SIZE = 1000
+# Shortened dimensions compared against the full vectors
+DIMENSIONS = [1024, 512, 256]
+
+embeddings_query = """
+MATCH (c:Chunk)
+WHERE c.embedding IS NOT NULL
+RETURN c.embedding AS embedding
+LIMIT toInteger($limit)
+"""
+
+write_query = """
+UNWIND $data AS row
+CREATE (c:BenchmarkChunk {id: row.index})
+WITH c, row
+CALL db.create.setNodeVectorProperty(c, 'embedding', row.embedding)
+"""
+
+cleanup_query = """
+MATCH (c:BenchmarkChunk)
+CALL { WITH c DELETE c } IN TRANSACTIONS OF 10000 ROWS
+"""
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def shorten(vectors: np.ndarray, dimensions: int) -> np.ndarray:
+    return normalize(vectors[:, :dimensions])
+
+
+def quantize(vectors: np.ndarray) -> np.ndarray:
+    """
+    Int8 scalar quantization per dimension, returned dequantized for scoring
+    """
+    low, high = vectors.min(axis=0), vectors.max(axis=0)
+    scale = np.where(high > low, (high - low) / 255, 1)
+    codes = np.round((vectors - low) / scale).astype(np.uint8)
+    return normalize(codes * scale + low)
+
+
+def recall(exact: np.ndarray, vectors: np.ndarray, queries: np.ndarray, k: int):
+    found = np.argsort(-(queries @ vectors.T), axis=1)[:, :k]
+    return np.mean(
+        [len(set(a) & set(b)) / k for a, b in zip(exact, found)],
+    )
+
+
+def params(matrix: np.ndarray, as_lists: bool):
+    return [
+        {"index": f"benchmark-{i}", "embedding": row.tolist() if as_lists else row}
+        for i, row in enumerate(matrix)
+    ]
+
+
+def params_memory(matrix: np.ndarray, as_lists: bool) -> float:
+    # The matrix is copied so array rows are counted as well
+    tracemalloc.start()
+    data = params(matrix.copy(), as_lists)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del data
+    return size / 1024 / 1024
+
+
+def write_throughput(matrix: np.ndarray, as_lists: bool) -> float:
+    data = params(matrix, as_lists)
+    start = time.perf_counter()
+    for offset in range(0, len(data), BATCH_SIZE):
+        graph.query(write_query, {"data": data[offset : offset + BATCH_SIZE]})
+    elapsed = time.perf_counter() - start
+    graph.query(cleanup_query)
+    return len(data) / elapsed
+
+
+def main(chunks: int = 10000, queries: int = 200, k: int = 10):
+    rows = read_query(embeddings_query, {"limit": chunks})
+    if len(rows) <= queries:
+        sys.exit("Not enough chunk embeddings in the database")
+    vectors = normalize(np.array([el["embedding"] for el in rows], dtype=np.float32))
+    print(f"{len(vectors)} chunks with {vectors.shape[1]} dimensions")
+
+    print(f"{'parameters':24} {'MiB':>8} {'chunks/s':>10}")
+    for name, as_lists in [("float lists", True), ("float32 arrays", False)]:
+        print(
+            f"{name:24} {params_memory(vectors, as_lists):>8.1f} "
+            f"{write_throughput(vectors, as_lists):>10.0f}"
+        )
+    for dimensions in DIMENSIONS:
+        print(
+            f"{f'float32 arrays, {dimensions}':24} "
+            f"{params_memory(shorten(vectors, dimensions), False):>8.1f} "
+            f"{write_throughput(shorten(vectors, dimensions), False):>10.0f}"
+        )
+
+    rng = np.random.default_rng(42)
+    sample = rng.choice(len(vectors), queries, replace=False)
+    exact = np.argsort(-(vectors[sample] @ vectors.T), axis=1)[:, :k]
+    print(f"{'storage':24} {f'recall@{k}':>10} {'bytes/chunk':>12}")
+    print(f"{'float32':24} {1.0:>10.3f} {vectors.shape[1] * 4:>12}")
+    print(
+        f"{'int8 quantized':24} "
+        f"{recall(exact, quantize(vectors), vectors[sample], k):>10.3f} "
+        f"{vectors.shape[1]:>12}"
+    )
+    for dimensions in DIMENSIONS:
+        shortened = shorten(vectors, dimensions)
+        print(
+            f"{f'float32, {dimensions}':24} "
+            f"{recall(exact, shortened, shortened[sample], k):>10.3f} "
+            f"{dimensions * 4:>12}"
+        )
+        print(
+            f"{f'int8 quantized, {dimensions}':24} "
+            f"{recall(exact, quantize(shortened), shortened[sample], k):>10.3f} "
+            f"{dimensions:>12}"
+        )
+
+
+if __name__ == "__main__":
+    main(*[int(el) for el in sys.argv[1:4]])
@@ -0,0 +1,75 @@
+"""
+Compares prefiltered vector search strategies across filter selectivities.
+
+Picks organizations with a varying number of mentioning articles and runs the
+same topic search with the exact scan, the oversampled vector index with a
+post-filter, and the automatic choice between them. Reports latency and the
+recall of each strategy against the exact scan.
+
+Usage: python benchmarks/filtered_vector_search.py [topic] [repeats]
+"""
+
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "app"))
+
+from graph_prefiltering import get_organization_news  # noqa: E402
+from utils import graph  # noqa: E402
+
+organizations_query = """
+MATCH (o:Organization)
+WITH o, count {(o)<-[:MENTIONS]-(:Article)} AS articles
+WHERE articles > 0
+WITH articles, collect(o.name)[0] AS organization
+ORDER BY articles
+RETURN organization, articles
+"""
+
+
+def timed(repeats, **kwargs):
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        output = get_organization_news(**kwargs)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return statistics.median(latencies), set(output.split("###Article: "))
+
+
+def main(topic: str = "new products", repeats: int = 5):
+    rows = graph.query(organizations_query)
+    # Sample up to 8 selectivity levels evenly
+    step = max(len(rows) // 8, 1)
+    sample = rows[::step]
+    print(
+        f"{'organization':30} {'articles':>8} {'strategy':>8} {'ms':>9} {'recall':>7}"
+    )
+    for row in sample:
+        for sentiment in [None, "positive"]:
+            _, exact = timed(
+                1,
+                topic=topic,
+                organization=row["organization"],
+                sentiment=sentiment,
+                strategy="exact",
+            )
+            for strategy in ["exact", "index", None]:
+                latency, output = timed(
+                    repeats,
+                    topic=topic,
+                    organization=row["organization"],
+                    sentiment=sentiment,
+                    strategy=strategy,
+                )
+                recall = len(output & exact) / len(exact) if exact else 1.0
+                name = f"{row['organization'][:20]} {sentiment or ''}".strip()
+                print(
+                    f"{name:30} {row['articles']:>8} {strategy or 'auto':>8} "
+                    f"{latency:>9.1f} {recall:>7.2f}"
+                )
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:2], *[int(el) for el in sys.argv[2:3]])
@@ -0,0 +1,110 @@
+"""
+Compares serialization of a synthetic network visualization payload.
+
+The previous path received property maps with nulls and dates converted with
+toString() in Cypher, removed the nulls in a separate pass and encoded the
+result with FastAPI's jsonable_encoder and json.dumps. The current path
+receives property maps without nulls and native Neo4j temporal values, and
+encodes them with orjson in a single pass.
+
+Usage: python benchmarks/network_serialization.py [nodes] [repeats]
+"""
+
+import json
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+from fastapi.encoders import jsonable_encoder
+from neo4j.time import Date, DateTime
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "app"))
+
+from serialization import dumps  # noqa: E402
+
+
+def synthetic_payload(nodes: int, native: bool):
+    random.seed(0)
+    output = {"nodes": [], "relationships": []}
+    for i in range(nodes):
+        date = DateTime(2024, 1 + i % 12, 1 + i % 28, 12, 30, 0)
+        founding_date = Date(1990 + i % 30, 1, 1) if i % 3 else None
+        properties = {
+            "sentiment": random.uniform(-1, 1),
+            "language": "en",
+            "url": f"https://example.com/{i}",
+            "mentions": random.randint(1, 50),
+        }
+        if native:
+            properties["date"] = date
+            if founding_date:
+                properties["founding_date"] = founding_date
+        else:
+            properties.update(
+                {
+                    "title": None,
+                    "name": None,
+                    "id": None,
+                    "embedding": None,
+                    "date": str(date),
+                    "founding_date": str(founding_date) if founding_date else None,
+                }
+            )
+        output["nodes"].append(
+            {"id": f"node {i}", "tag": "Organization", "properties": properties}
+        )
+    for i in range(nodes * 2):
+        output["relationships"].append(
+            {
+                "start": f"node {random.randrange(nodes)}",
+                "end": f"node {random.randrange(nodes)}",
+                "type": "MENTIONS",
+                "properties": {"confidence": random.random()} if i % 2 else {},
+            }
+        )
+    return output
+
+
+def remove_null_properties(data):
+    # Previous implementation from utils
+    for el in data["nodes"] + data["relationships"]:
+        keys_to_remove = [
+            key for key, value in el["properties"].items() if value is None
+        ]
+        for key in keys_to_remove:
+            el["properties"].pop(key)
+    return data
+
+
+def previous(data):
+    return json.dumps(jsonable_encoder(remove_null_properties(data))).encode()
+
+
+def current(data):
+    return dumps(data)
+
+
+def timed(func, native: bool, nodes: int, repeats: int):
+    latencies = []
+    for _ in range(repeats):
+        data = synthetic_payload(nodes, native)
+        start = time.perf_counter()
+        payload = func(data)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return statistics.median(latencies), len(payload)
+
+
+def main(nodes: int = 10_000, repeats: int = 5):
+    print(f"{'path':10} {'nodes':>7} {'ms':>9} {'bytes':>10}")
+    for name, func, native in [
+        ("previous", previous, False),
+        ("current", current, True),
+    ]:
+        latency, size = timed(func, native, nodes, repeats)
+        print(f"{name:10} {nodes:>7} {latency:>9.1f} {size:>10}")
+
+
+if __name__ == "__main__":
+    main(*[int(el) for el in sys.argv[1:3]])
@@ -0,0 +1,298 @@
+"""
+Offline end-to-end benchmark of the API against a local Neo4j.
+
+Starts the Diffbot and OpenAI stand-ins from stubs.py on a synthetic corpus,
+points the API at them and drives it in process through its ASGI app. The
+ingestion phase imports, processes and enhances the corpus batch by batch,
+then the read phase runs the dashboard, network, retrievers and chains
+concurrently. Reports throughput and p50/p95/p99 latency per endpoint.
+
+Requires a local Neo4j with APOC, e.g. `docker compose up neo4j`, reachable
+with NEO4J_URI, NEO4J_USERNAME and NEO4J_PASSWORD (defaults match
+docker-compose.yml). The database is cleared before the run, so the harness
+refuses to run on one holding articles it did not import. Tokenizers are
+loaded by tiktoken, which needs its encodings cached in TIKTOKEN_CACHE_DIR
+to run without network access.
+
+Usage: python benchmarks/offline.py [articles] [batch_size] [repeats] [concurrency] [latency_ms]
+"""
+
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "app"))
+
+from corpus import TOPICS, Corpus  # noqa: E402
+from stubs import StubServer  # noqa: E402
+
+foreign_articles_query = """
+MATCH (a:Article) WHERE NOT a.id STARTS WITH 'bench-'
+RETURN count(a) AS output
+"""
+
+clear_query = """
+MATCH (n)
+CALL { WITH n DETACH DELETE n } IN TRANSACTIONS OF 10000 ROWS
+"""
+
+
+def configure(url: str, workdir: str):
+    """
+    Points the API at the stand-ins, must run before importing app modules
+    """
+    os.environ.update(
+        {
+            "DIFFBOT_API_KEY": "offline",
+            "DIFFBOT_KG_URL": url,
+            "DIFFBOT_NL_URL": url,
+            "OPENAI_API_KEY": "offline",
+            "OPENAI_BASE_URL": f"{url}/openai/v1",
+            "OPENAI_API_BASE": f"{url}/openai/v1",
+            "LANGCHAIN_TRACING_V2": "false",
+            "LOCAL_INDEX_PATH": os.path.join(workdir, "local_index"),
+            "SCHEMA_SNAPSHOT_PATH": os.path.join(workdir, "schema_snapshot.json"),
+        }
+    )
+    os.environ.setdefault("NEO4J_URI", "bolt://localhost:7687")
+    os.environ.setdefault("NEO4J_USERNAME", "neo4j")
+    os.environ.setdefault("NEO4J_PASSWORD", "password")
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100), len(values) - 1)]
+
+
+class Results:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.elapsed: Dict[str, float] = {}
+
+    async def run(
+        self,
+        name: str,
+        calls: List[Callable[[], Awaitable]],
+        concurrency: int = 1,
+    ):
+        """
+        Runs the calls with bounded concurrency and records their latencies
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = self.latencies.setdefault(name, [])
+
+        async def call(fn):
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    await fn()
+                except Exception as e:
+                    self.errors[name] = self.errors.get(name, 0) + 1
+                    if self.errors[name] == 1:
+                        print(f"{name} failed: {e!r}")
+                    return
+                latencies.append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        await asyncio.gather(*[call(el) for el in calls])
+        self.elapsed[name] = self.elapsed.get(name, 0) + time.perf_counter() - start
+
+    def report(self):
+        print(
+            f"{'endpoint':28} {'n':>5} {'errors':>6} {'req/s':>8} "
+            f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+        )
+        for name, latencies in self.latencies.items():
+            errors = self.errors.get(name, 0)
+            if not latencies:
+                print(f"{name:28} {0:>5} {errors:>6}")
+                continue
+            print(
+                f"{name:28} {len(latencies):>5} {errors:>6} "
+                f"{len(latencies) / self.elapsed[name]:>8.1f} "
+                f"{statistics.median(latencies):>8.1f} "
+                f"{percentile(latencies, 95):>8.1f} {percentile(latencies, 99):>8.1f}"
+            )
+
+
+def checked(request: Callable[[], Awaitable]) -> Callable[[], Awaitable]:
+    async def call():
+        response = await request()
+        response.raise_for_status()
+        return response
+
+    return call
+
+
+async def ingest(client, results: Results, corpus: Corpus, batch_size: int):
+    from utils import aquery
+
+    async def entities_left():
+        data = await aquery(
+            "MATCH (a:Person|Organization) WHERE a.processed IS NULL "
+            "RETURN count(a) AS output"
+        )
+        return data[0]["output"]
+
+    start = time.perf_counter()
+    for _ in range(max(len(corpus.articles) // batch_size, 1)):
+        await results.run(
+            "POST /import_articles/",
+            [
+                checked(
+                    lambda: client.post(
+                        "/import_articles/",
+                        json={"query": "benchmark", "tag": None, "size": batch_size},
+                    )
+                )
+            ],
+        )
+        await results.run(
+            "POST /process_articles/",
+            [checked(lambda: client.post("/process_articles/"))],
+        )
+    # Enhancing adds related entities, bound the rounds by the corpus size
+    rounds = (len(corpus.organizations) + len(corpus.people)) // batch_size + 5
+    while rounds and await entities_left():
+        rounds -= 1
+        await results.run(
+            "POST /enhance_entities/",
+            [
+                checked(
+                    lambda: client.post("/enhance_entities/", json={"size": batch_size})
+                )
+            ],
+        )
+    elapsed = time.perf_counter() - start
+    print(
+        f"Ingested {len(corpus.articles)} articles in {elapsed:.1f}s "
+        f"({len(corpus.articles) / elapsed:.1f} articles/s)"
+    )
+
+
+async def read(client, results: Results, corpus: Corpus, repeats: int, concurrency):
+    from dashboard import dashboard_stats
+    from graph_prefiltering import aget_organization_news
+    from network import NETWORK_PAGE_SIZE, network_cache
+    from retrieval import RetrievalConfig, hybrid_search
+
+    questions = [
+        f"What is {corpus.organizations[i % len(corpus.organizations)]} doing "
+        f"in {TOPICS[i % len(TOPICS)]}?"
+        for i in range(repeats)
+    ]
+
+    async def stream(path: str, input: Dict):
+        async with client.stream("POST", path, json={"input": input}) as response:
+            response.raise_for_status()
+            async for _ in response.aiter_bytes():
+                pass
+
+    async def uncached_dashboard():
+        dashboard_stats.invalidate()
+        return await client.get("/dashboard/")
+
+    async def network_pages():
+        network_cache.invalidate()
+        cursor = None
+        while True:
+            response = await client.get(
+                "/fetch_network/",
+                params={"cursor": cursor} if cursor else {"limit": NETWORK_PAGE_SIZE},
+            )
+            response.raise_for_status()
+            cursor = response.json().get("next_cursor")
+            if not cursor:
+                return
+
+    workloads = {
+        "GET /dashboard/": [checked(lambda: client.get("/dashboard/"))] * repeats,
+        "GET /dashboard/ (uncached)": [checked(uncached_dashboard)] * repeats,
+        "GET /fetch_network/": [checked(lambda: client.get("/fetch_network/"))]
+        * repeats,
+        "GET /fetch_network/ (all pages)": [network_pages] * repeats,
+        "hybrid_search (max)": [
+            lambda q=q: asyncio.to_thread(hybrid_search, q) for q in questions
+        ],
+        "hybrid_search (rrf)": [
+            lambda q=q: asyncio.to_thread(
+                hybrid_search, q, RetrievalConfig(fusion="rrf")
+            )
+            for q in questions
+        ],
+        "organization_news": [
+            lambda i=i: aget_organization_news(
+                TOPICS[i % len(TOPICS)],
+                corpus.organizations[i % len(corpus.organizations)],
+            )
+            for i in range(repeats)
+        ],
+        "POST /chat/stream_log": [
+            lambda q=q: stream(
+                "/chat/stream_log",
+                {"question": q, "chat_history": [], "mode": "basic_hybrid_search"},
+            )
+            for q in questions
+        ],
+        "POST /text2cypher/stream_log": [
+            lambda q=q: stream("/text2cypher/stream_log", {"question": q})
+            for q in questions
+        ],
+        "POST /prefiltering/stream_log": [
+            lambda q=q: stream(
+                "/prefiltering/stream_log", {"input": q, "chat_history": []}
+            )
+            for q in questions
+        ],
+    }
+    for name, calls in workloads.items():
+        await results.run(name, calls, concurrency)
+
+
+async def main(
+    articles: int = 200,
+    batch_size: int = 20,
+    repeats: int = 50,
+    concurrency: int = 8,
+    latency_ms: float = 0,
+):
+    corpus = Corpus(articles, organizations=max(articles // 4, 5), people=articles // 2)
+    server = StubServer(("127.0.0.1", 0), corpus, latency_ms / 1000)
+    server.start()
+    workdir = tempfile.mkdtemp(prefix="offline-benchmark-")
+    configure(server.url, workdir)
+
+    import httpx
+    from main import app
+    from startup import setup_indices
+    from utils import graph
+
+    if graph.query(foreign_articles_query)[0]["output"]:
+        sys.exit("The database holds articles not imported by the benchmark")
+    graph.query(clear_query)
+    setup_indices()
+
+    results = Results()
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://offline", timeout=600
+    ) as client:
+        await ingest(client, results, corpus, batch_size)
+        await read(client, results, corpus, repeats, concurrency)
+    server.shutdown()
+    results.report()
+
+
+if __name__ == "__main__":
+    asyncio.run(
+        main(
+            *[int(el) for el in sys.argv[1:5]],
+            *[float(el) for el in sys.argv[5:6]],
+        )
+    )
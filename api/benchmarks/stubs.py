@@ -0,0 +1,336 @@
+"""
+Local stand-ins for the Diffbot and OpenAI APIs used by the offline benchmarks.
+
+Serves the Diffbot DQL, Enhance and Natural Language endpoints from a
+synthetic corpus, and the OpenAI embeddings and chat completions endpoints
+with deterministic responses. Embeddings are sums of seeded random vectors
+per word, so texts sharing words get similar vectors and vector search
+returns meaningful neighbors. An optional delay emulates network latency.
+
+Point the API at the stand-ins with:
+    DIFFBOT_KG_URL=http://host:port DIFFBOT_NL_URL=http://host:port
+    OPENAI_BASE_URL=http://host:port/openai/v1
+
+Usage: python benchmarks/stubs.py [port] [articles] [latency_ms]
+"""
+
+import base64
+import json
+import re
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+from corpus import Corpus
+
+EMBEDDING_DIMENSIONS = 1536
+# Answer of the chat stand-in when the prompt asks for a Cypher statement
+CYPHER_ANSWER = "MATCH (o:Organization) RETURN o.name AS name LIMIT 5"
+
+_word_re = re.compile(r"\w+")
+_name_re = re.compile(r"[A-Z][a-z]+(?: [A-Z][a-z]+)+")
+
+
+class FakeEmbeddings:
+    def __init__(self, dimensions: int = EMBEDDING_DIMENSIONS):
+        self.dimensions = dimensions
+        self._vectors: Dict[str, np.ndarray] = {}
+        self._lock = threading.Lock()
+
+    def _word(self, word: str) -> np.ndarray:
+        vector = self._vectors.get(word)
+        if vector is None:
+            rng = np.random.default_rng(zlib.crc32(word.encode()))
+            vector = rng.standard_normal(self.dimensions).astype(np.float32)
+            with self._lock:
+                self._vectors[word] = vector
+        return vector
+
+    def embed(self, input: Any) -> np.ndarray:
+        # Inputs are strings or token id lists when the client splits long texts
+        words = (
+            [str(el) for el in input]
+            if isinstance(input, list)
+            else _word_re.findall(input.lower())
+        )
+        if not words:
+            words = [""]
+        vector = np.sum([self._word(el) for el in words], axis=0)
+        return vector / np.linalg.norm(vector)
+
+
+def _arguments(parameters: Dict[str, Any], text: str) -> Dict[str, Any]:
+    """
+    Fills a function call schema from the user message
+    """
+    arguments = {}
+    for key, schema in parameters.get("properties", {}).items():
+        if schema.get("type") == "array":
+            arguments[key] = list(dict.fromkeys(_name_re.findall(text)))
+        elif key == "organization":
+            names = _name_re.findall(text)
+            if names:
+                arguments[key] = names[0]
+        elif schema.get("type") == "string" or key in parameters.get("required", []):
+            arguments[key] = text
+    return arguments
+
+
+def chat_completion(body: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Assistant message for a chat completions request, as a tool call when
+    a tool is forced, a function call on the first turn of a function calling
+    agent, and text otherwise
+    """
+    messages = body.get("messages", [])
+    question = next(
+        (el["content"] for el in reversed(messages) if el["role"] == "user"), ""
+    )
+    if not isinstance(question, str):
+        question = " ".join(el.get("text", "") for el in question)
+    tool_choice = body.get("tool_choice")
+    if body.get("tools") and isinstance(tool_choice, dict):
+        name = tool_choice["function"]["name"]
+        function = next(
+            el["function"] for el in body["tools"] if el["function"]["name"] == name
+        )
+        arguments = _arguments(function.get("parameters", {}), question)
+        return {
+            "role": "assistant",
+            "content": None,
+            "tool_calls": [
+                {
+                    "id": "call_bench",
+                    "type": "function",
+                    "function": {"name": name, "arguments": json.dumps(arguments)},
+                }
+            ],
+        }
+    if body.get("functions") and messages[-1]["role"] == "user":
+        function = body["functions"][0]
+        arguments = _arguments(function.get("parameters", {}), question)
+        return {
+            "role": "assistant",
+            "content": None,
+            "function_call": {
+                "name": function["name"],
+                "arguments": json.dumps(arguments),
+            },
+        }
+    system = " ".join(
+        el["content"] for el in messages if el["role"] == "system"
+    ).lower()
+    if "cypher" in system:
+        return {"role": "assistant", "content": CYPHER_ANSWER}
+    return {
+        "role": "assistant",
+        "content": f"Based on the provided context, here is an answer to: {question}",
+    }
+
+
+def finish_reason(message: Dict[str, Any]) -> str:
+    if message.get("tool_calls"):
+        return "tool_calls"
+    if message.get("function_call"):
+        return "function_call"
+    return "stop"
+
+
+def stream_deltas(message: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Splits an assistant message into streamed chunk deltas
+    """
+    deltas = [{"role": "assistant", "content": ""}]
+    if message.get("tool_calls"):
+        call = message["tool_calls"][0]
+        deltas.append(
+            {
+                "tool_calls": [
+                    {
+                        "index": 0,
+                        "id": call["id"],
+                        "type": "function",
+                        "function": call["function"],
+                    }
+                ]
+            }
+        )
+    elif message.get("function_call"):
+        deltas.append({"function_call": message["function_call"]})
+    else:
+        deltas.extend(
+            {"content": el} for el in re.findall(r"\S+\s*", message["content"])
+        )
+    return deltas
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, corpus: Corpus, latency: float = 0):
+        super().__init__(address, StubHandler)
+        self.corpus = corpus
+        self.latency = latency
+        self.embeddings = FakeEmbeddings()
+        # The API always asks for the first page, so DQL serves the next
+        # articles of the corpus on every call to import new ones
+        self.dql_offset = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> threading.Thread:
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: StubServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload: Any, status: int = 200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        url = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        if url.path == "/kg/v3/dql":
+            size = int(params.get("size", 5))
+            with self.server.lock:
+                offset = self.server.dql_offset
+                self.server.dql_offset += size
+            self._send_json(self.server.corpus.dql(offset, size))
+        elif url.path == "/kg/v3/enhance":
+            self._send_json(
+                self.server.corpus.enhance(params.get("type"), params.get("name"))
+            )
+        else:
+            self._send_json({"error": f"Unknown path {url.path}"}, 404)
+
+    def do_POST(self):
+        time.sleep(self.server.latency)
+        url = urlparse(self.path)
+        body = self._body()
+        if url.path == "/v1/":
+            form = {k: v[0] for k, v in parse_qs(body.decode()).items()}
+            self._send_json(self.server.corpus.nlp(form.get("content", "")))
+        elif url.path == "/openai/v1/embeddings":
+            self._embeddings(json.loads(body))
+        elif url.path == "/openai/v1/chat/completions":
+            self._chat(json.loads(body))
+        else:
+            self._send_json({"error": f"Unknown path {url.path}"}, 404)
+
+    def _embeddings(self, request: Dict[str, Any]):
+        inputs = request["input"]
+        # A single string or token id list is a single input
+        if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        data = []
+        dimensions = request.get("dimensions")
+        for index, el in enumerate(inputs):
+            vector = self.server.embeddings.embed(el)
+            if dimensions:
+                # Shortened like text-embedding-3 vectors, truncated and normalized
+                vector = vector[:dimensions] / np.linalg.norm(vector[:dimensions])
+            if request.get("encoding_format") == "base64":
+                embedding = base64.b64encode(vector.tobytes()).decode()
+            else:
+                embedding = vector.tolist()
+            data.append({"object": "embedding", "index": index, "embedding": embedding})
+        self._send_json(
+            {
+                "object": "list",
+                "data": data,
+                "model": request.get("model"),
+                "usage": {"prompt_tokens": 0, "total_tokens": 0},
+            }
+        )
+
+    def _chat(self, request: Dict[str, Any]):
+        message = chat_completion(request)
+        base = {
+            "id": "chatcmpl-bench",
+            "created": int(time.time()),
+            "model": request.get("model"),
+        }
+        if not request.get("stream"):
+            self._send_json(
+                {
+                    **base,
+                    "object": "chat.completion",
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": message,
+                            "finish_reason": finish_reason(message),
+                        }
+                    ],
+                    "usage": {
+                        "prompt_tokens": 0,
+                        "completion_tokens": 0,
+                        "total_tokens": 0,
+                    },
+                }
+            )
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        deltas = stream_deltas(message)
+        for index, delta in enumerate(deltas):
+            last = index == len(deltas) - 1
+            chunk = {
+                **base,
+                "object": "chat.completion.chunk",
+                "choices": [
+                    {
+                        "index": 0,
+                        "delta": delta,
+                        "finish_reason": finish_reason(message) if last else None,
+                    }
+                ],
+            }
+            self._write_chunk(f"data: {json.dumps(chunk)}\n\n")
+        self._write_chunk("data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _write_chunk(self, text: str):
+        data = text.encode()
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+
+def main(port: int = 8100, articles: int = 200, latency_ms: float = 0):
+    server = StubServer(("127.0.0.1", port), Corpus(articles), latency_ms / 1000)
+    print(f"Serving Diffbot and OpenAI stand-ins on {server.url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main(
+        *[int(el) for el in sys.argv[1:3]],
+        *[float(el) for el in sys.argv[3:4]],
+    )
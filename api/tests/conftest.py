@@ -0,0 +1,16 @@
+"""
+Unit tests of the pure parts of the API. Nothing connects to Neo4j, OpenAI
+or Diffbot, the settings below only let the modules be imported.
+"""
+
+import os
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "app"))
+
+os.environ.setdefault("NEO4J_URI", "bolt://localhost:7687")
+os.environ.setdefault("NEO4J_USERNAME", "neo4j")
+os.environ.setdefault("NEO4J_PASSWORD", "password")
+os.environ.setdefault("OPENAI_API_KEY", "sk-test")
+os.environ.setdefault("DIFFBOT_API_KEY", "test")
@@ -0,0 +1,40 @@
+import pytest
+from chunking import Chunker, ChunkingConfig
+from langchain_core.pydantic_v1 import ValidationError
+
+
+class WordSplitter:
+    def split_text(self, text):
+        return text.split()
+
+
+def test_config_fingerprint():
+    config = ChunkingConfig(strategy="sentence", size=300, overlap=30, max_chunks=0)
+    assert config.fingerprint == "sentence-300-30-0"
+
+
+@pytest.mark.parametrize(
+    "params",
+    [
+        {"size": 0},
+        {"size": 100, "overlap": 100},
+        {"size": 100, "overlap": -1},
+        {"max_chunks": -1},
+        {"strategy": "page"},
+    ],
+)
+def test_config_rejects_invalid_values(params):
+    with pytest.raises(ValidationError):
+        ChunkingConfig(**params)
+
+
+def test_chunker_keeps_max_chunks():
+    chunker = Chunker(ChunkingConfig(max_chunks=2))
+    chunker._splitter = WordSplitter()
+    assert chunker.split("one two three") == ["one", "two"]
+
+
+def test_chunker_keeps_all_chunks_without_maximum():
+    chunker = Chunker(ChunkingConfig(max_chunks=0))
+    chunker._splitter = WordSplitter()
+    assert chunker.split("one two three") == ["one", "two", "three"]
@@ -0,0 +1,109 @@
+import context
+import pytest
+from chunking import Chunker, ChunkingConfig
+from context import deduplicate_chunks, deduplicate_lines, pack_context
+from langchain_core.documents import Document
+
+
+class WordEncoding:
+    """Counts words as tokens, so the tests don't need the tokenizer files"""
+
+    def encode(self, text, disallowed_special=()):
+        return text.split()
+
+
+@pytest.fixture(autouse=True)
+def tokens(monkeypatch):
+    monkeypatch.setattr(context, "encoding", WordEncoding())
+    monkeypatch.setattr(context, "chunker", Chunker(ChunkingConfig(size=20, overlap=6)))
+
+
+def words(start, end):
+    return " ".join(f"w{i}" for i in range(start, end))
+
+
+def chunk(text, article_id="a1", position=None):
+    return Document(
+        page_content=text, metadata={"article_id": article_id, "position": position}
+    )
+
+
+def test_near_duplicates_are_dropped():
+    first = chunk(words(0, 20), "a1", 0)
+    copy = chunk(words(0, 19) + " changed", "a2", 3)
+    other = chunk(words(100, 120), "a3", 0)
+    assert deduplicate_chunks([first, copy, other]) == [
+        words(0, 20),
+        words(100, 120),
+    ]
+
+
+def test_overlap_with_previous_chunk_is_stripped():
+    previous = chunk(words(0, 20), position=0)
+    following = chunk(words(14, 34), position=1)
+    assert deduplicate_chunks([following, previous]) == [
+        " " + words(20, 34),
+        words(0, 20),
+    ]
+
+
+def test_overlap_is_kept_without_previous_chunk():
+    following = chunk(words(14, 34), position=1)
+    other_article = chunk(words(0, 20), "a2", 0)
+    assert deduplicate_chunks([following, other_article]) == [
+        words(14, 34),
+        words(0, 20),
+    ]
+
+
+def test_short_overlap_is_kept():
+    previous = chunk(words(0, 20), position=0)
+    following = chunk(words(17, 37), position=1)
+    assert deduplicate_chunks([previous, following])[1] == words(17, 37)
+
+
+def test_chunks_without_metadata():
+    assert deduplicate_chunks([Document(page_content="text")]) == ["text"]
+
+
+def test_deduplicate_lines():
+    assert deduplicate_lines([" a ", "b", "a", "", None, "  "]) == ["a", "b"]
+
+
+def test_pack_context_keeps_ranked_items_within_budget():
+    chunks = [chunk(words(i * 100, i * 100 + 8), f"a{i}", 0) for i in range(4)]
+    _, packed = pack_context(chunks, token_budget=20)
+    assert packed == [words(0, 8), words(100, 108)]
+
+
+def test_pack_context_skips_items_that_do_not_fit():
+    chunks = [
+        chunk(words(0, 8), "a1", 0),
+        chunk(words(100, 120), "a2", 0),
+        chunk(words(200, 204), "a3", 0),
+    ]
+    _, packed = pack_context(chunks, token_budget=12)
+    assert packed == [words(0, 8), words(200, 204)]
+
+
+def test_pack_context_reserves_a_share_for_structured_lines():
+    structured = ["x1 x2", "y1 y2", "z1 z2", "v1 v2"]
+    chunks = [chunk(words(0, 10), "a1", 0), chunk(words(100, 110), "a2", 0)]
+    lines, packed = pack_context(chunks, structured, token_budget=20)
+    # Lines get 6 of the 20 tokens, the chunks the remaining 14
+    assert lines == ["x1 x2", "y1 y2", "z1 z2"]
+    assert packed == [words(0, 10)]
+
+
+def test_pack_context_gives_unused_budget_to_chunks():
+    chunks = [chunk(words(0, 10), "a1", 0), chunk(words(100, 108), "a2", 0)]
+    lines, packed = pack_context(chunks, ["x1 x2"], token_budget=20)
+    assert lines == ["x1 x2"]
+    assert packed == [words(0, 10), words(100, 108)]
+
+
+def test_pack_context_without_chunks_uses_whole_budget():
+    structured = [f"l{i} a b c" for i in range(5)]
+    lines, packed = pack_context([], structured, token_budget=20)
+    assert lines == structured
+    assert packed == []
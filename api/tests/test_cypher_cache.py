@@ -0,0 +1,88 @@
+import time
+
+from cypher_cache import CypherTemplateCache, is_cacheable, question_shape
+
+QUERY = "MATCH (o:Organization {name: 'Neo4j Inc'}) RETURN o.ceo"
+
+
+def test_is_cacheable():
+    assert is_cacheable("Who is the CEO of Neo4j?", {"neo4j": "Neo4j Inc"})
+    assert not is_cacheable("Who is the CEO of Neo4j?", {"neo4j": None})
+    assert not is_cacheable("Who is the CEO of Neo4j?", {"Neo4J Inc": "Neo4j Inc"})
+    assert is_cacheable("How many articles are there?", {})
+
+
+def test_question_shape():
+    assert (
+        question_shape("Who is the CEO of Neo4j?", {"Neo4j": "Neo4j Inc"})
+        == "who is the ceo of entity"
+    )
+
+
+def test_question_shape_replaces_longest_entity_first():
+    mapping = {"Bank": "Bank", "Bank of America": "Bank of America Corp"}
+    assert (
+        question_shape("Does Bank of America own a bank?", mapping)
+        == "does entity own a entity"
+    )
+
+
+def test_questions_about_other_entities_share_a_shape():
+    assert question_shape("CEO of Neo4j", {"Neo4j": "Neo4j Inc"}) == question_shape(
+        "ceo of Apple ", {"Apple": "Apple Inc"}
+    )
+
+
+def test_template_is_reused_for_other_entities():
+    cache = CypherTemplateCache()
+    assert cache.put("Who is the CEO of Neo4j?", {"Neo4j": "Neo4j Inc"}, QUERY, "v1")
+    template, params = cache.get("Who is the CEO of Apple?", {"Apple": "Apple"}, "v1")
+    assert template == "MATCH (o:Organization {name: $entity_0}) RETURN o.ceo"
+    assert params == {"entity_0": "Apple"}
+
+
+def test_parameters_follow_question_order():
+    cache = CypherTemplateCache()
+    query = 'MATCH (a {name: "Apple"})--(b {name: "Neo4j Inc"}) RETURN b'
+    mapping = {"Neo4j": "Neo4j Inc", "Apple": "Apple"}
+    assert cache.put("Is Apple related to Neo4j?", mapping, query, "v1")
+    template, params = cache.get(
+        "Is Google related to Tesla?", {"Tesla": "Tesla", "Google": "Alphabet"}, "v1"
+    )
+    assert template == "MATCH (a {name: $entity_0})--(b {name: $entity_1}) RETURN b"
+    assert params == {"entity_0": "Alphabet", "entity_1": "Tesla"}
+
+
+def test_query_without_clean_literal_is_not_cached():
+    cache = CypherTemplateCache()
+    query = (
+        "MATCH (o) WHERE o.name CONTAINS 'Neo4j Inc' OR o.id = 'Neo4j Inc-1' RETURN o"
+    )
+    assert not cache.put("CEO of Neo4j", {"Neo4j": "Neo4j Inc"}, query, "v1")
+    assert not cache.put("CEO of Neo4j", {"Neo4j": "Neo4j"}, QUERY, "v1")
+
+
+def test_template_expires_with_schema_version_and_ttl(monkeypatch):
+    cache = CypherTemplateCache(ttl=60)
+    mapping = {"Neo4j": "Neo4j Inc"}
+    cache.put("CEO of Neo4j", mapping, QUERY, "v1")
+    assert cache.get("CEO of Neo4j", mapping, "v2") is None
+    # The stale entry was dropped, so the old version misses too
+    assert cache.get("CEO of Neo4j", mapping, "v1") is None
+    cache.put("CEO of Neo4j", mapping, QUERY, "v1")
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now + 61)
+    assert cache.get("CEO of Neo4j", mapping, "v1") is None
+
+
+def test_least_recently_used_template_is_evicted():
+    cache = CypherTemplateCache(max_size=2)
+    mapping = {"Neo4j": "Neo4j"}
+    query = "MATCH (o {name: 'Neo4j'}) RETURN o"
+    for question in ["CEO of Neo4j", "Founders of Neo4j", "Investors of Neo4j"]:
+        cache.put(question, mapping, query, "v1")
+        # Uses the first template again after each put
+        cache.get("CEO of Neo4j", mapping, "v1")
+    assert cache.get("CEO of Neo4j", mapping, "v1") is not None
+    assert cache.get("Founders of Neo4j", mapping, "v1") is None
+    assert cache.get("Investors of Neo4j", mapping, "v1") is not None
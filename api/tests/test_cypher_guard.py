@@ -0,0 +1,66 @@
+import cypher_guard
+import pytest
+from cypher_guard import QueryRejected, check_plan, format_result
+
+QUERY = "MATCH (o:Organization) RETURN o.name"
+
+
+def operator(name, rows=1.0, *children):
+    return {
+        "operatorType": name,
+        "args": {"EstimatedRows": rows},
+        "children": list(children),
+    }
+
+
+@pytest.fixture
+def plan(monkeypatch):
+    def use(plan):
+        monkeypatch.setattr(cypher_guard, "explain", lambda query, params: plan)
+
+    return use
+
+
+def test_read_query_is_returned_unchanged(plan):
+    plan(operator("ProduceResults@neo4j", 10, operator("NodeByLabelScan", 10)))
+    assert check_plan(QUERY) == QUERY
+
+
+@pytest.mark.parametrize(
+    "name", ["Create", "MergeInto", "DetachDelete", "SetProperty", "LoadCSV"]
+)
+def test_write_operators_are_rejected(plan, name):
+    plan(operator("ProduceResults", 1, operator("EmptyResult", 1, operator(name))))
+    with pytest.raises(QueryRejected, match="Only read queries"):
+        check_plan(QUERY)
+
+
+def test_expensive_query_is_rejected(plan, monkeypatch):
+    monkeypatch.setattr(cypher_guard, "MAX_ESTIMATED_ROWS", 1000)
+    plan(
+        operator(
+            "ProduceResults",
+            10,
+            operator("Limit", 10, operator("CartesianProduct", 5000)),
+        )
+    )
+    with pytest.raises(QueryRejected, match="5000 rows"):
+        check_plan(QUERY)
+
+
+def test_plan_without_estimates(plan):
+    plan({"operatorType": "ProduceResults"})
+    assert check_plan(QUERY) == QUERY
+
+
+def test_format_result_keeps_small_results():
+    data = [{"name": "Neo4j"}]
+    assert format_result(data) == str(data)
+
+
+def test_format_result_truncates_rows(monkeypatch):
+    monkeypatch.setattr(cypher_guard, "MAX_RESULT_CHARS", 60)
+    data = [{"name": f"Organization {i}"} for i in range(10)]
+    output = format_result(data)
+    assert output.startswith('[{"name": "Organization 0"}, {"name": "Organization 1"}]')
+    assert output.endswith("Showing 2 of 10 rows, the rest was truncated.")
@@ -0,0 +1,73 @@
+import time
+
+import entity_resolution
+import pytest
+from entity_resolution import EntityResolver
+from utils import generate_full_text_query
+
+CANDIDATES = {"neo4j": ["Neo4j Inc", "Neo4j Labs"], "apple": ["Apple"]}
+
+
+@pytest.fixture
+def queries(monkeypatch):
+    """Records the rows of each resolution query"""
+    calls = []
+
+    def read_query(query, params):
+        calls.append(params["rows"])
+        return [
+            {"name": row["name"], "candidates": CANDIDATES.get(row["name"], [])}
+            for row in params["rows"]
+        ]
+
+    monkeypatch.setattr(entity_resolution, "read_query", read_query)
+    return calls
+
+
+def test_names_are_resolved_in_one_query(queries):
+    resolver = EntityResolver(generate_full_text_query, limit=25)
+    assert resolver.resolve(["neo4j", "apple", "neo4j"]) == {
+        "neo4j": ["Neo4j Inc", "Neo4j Labs"],
+        "apple": ["Apple"],
+    }
+    assert [[row["name"] for row in rows] for rows in queries] == [["neo4j", "apple"]]
+    assert queries[0][0]["query"] == "neo4j~2"
+
+
+def test_only_uncached_names_are_queried(queries):
+    resolver = EntityResolver(generate_full_text_query)
+    resolver.resolve(["neo4j"])
+    assert resolver.resolve(["neo4j", "apple"])["neo4j"] == ["Neo4j Inc", "Neo4j Labs"]
+    assert [[row["name"] for row in rows] for rows in queries] == [["neo4j"], ["apple"]]
+    resolver.resolve(["apple", "neo4j"])
+    assert len(queries) == 2
+
+
+def test_names_without_candidates_are_not_cached(queries):
+    resolver = EntityResolver(generate_full_text_query)
+    assert resolver.resolve(["unknown"]) == {"unknown": []}
+    resolver.resolve(["unknown"])
+    assert len(queries) == 2
+
+
+def test_names_without_search_terms_are_not_queried(queries):
+    resolver = EntityResolver(generate_full_text_query)
+    assert resolver.resolve(["?!"]) == {"?!": []}
+    assert queries == []
+
+
+def test_cached_names_expire(queries, monkeypatch):
+    resolver = EntityResolver(generate_full_text_query, ttl=60)
+    resolver.resolve(["apple"])
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now + 61)
+    resolver.resolve(["apple"])
+    assert len(queries) == 2
+
+
+def test_least_recently_used_name_is_evicted(queries):
+    resolver = EntityResolver(generate_full_text_query, max_size=1)
+    resolver.resolve(["neo4j"])
+    resolver.resolve(["apple"])
+    resolver.resolve(["neo4j"])
+    assert len(queries) == 3
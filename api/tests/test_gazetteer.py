@@ -0,0 +1,77 @@
+import gazetteer
+import pytest
+from gazetteer import EntityGazetteer, _Automaton, normalize
+
+
+def automaton(*names):
+    return _Automaton({normalize(el): el for el in names})
+
+
+@pytest.fixture
+def entities(monkeypatch):
+    rows = [{"name": el} for el in ["Neo4j", "Neo4j Inc", "Apple", "Bank of America"]]
+    monkeypatch.setattr(gazetteer, "read_query", lambda query, params: rows)
+    return EntityGazetteer()
+
+
+def test_normalize():
+    assert normalize("  Who is Neo4j's CEO?") == "who is neo4j s ceo"
+
+
+def test_search_finds_overlapping_patterns():
+    found = automaton("bank", "bank of america", "america").search(
+        "the bank of america"
+    )
+    assert sorted(found) == [
+        (4, 8, "bank"),
+        (4, 19, "bank of america"),
+        (12, 19, "america"),
+    ]
+
+
+def test_search_requires_word_boundaries():
+    found = automaton("apple").search("pineapple apples apple")
+    assert found == [(17, 22, "apple")]
+
+
+def test_search_follows_failure_links():
+    assert automaton("abd", "bc").search("abc") == []
+    assert automaton("ab c", "b c d").search("ab c d") == [(0, 4, "ab c")]
+
+
+def test_empty_automaton():
+    assert automaton().search("anything") == []
+
+
+def test_match_prefers_longest_name(entities):
+    assert entities.match("Is Neo4j Inc hiring?") == ["Neo4j Inc"]
+    assert entities.match("What about Neo4j and apple?") == ["Neo4j", "Apple"]
+
+
+def test_match_returns_database_names(entities):
+    assert entities.match("news on BANK OF AMERICA") == ["Bank of America"]
+
+
+def test_added_names_are_matched_before_merge(entities):
+    entities.match("warm up")
+    entities.add(["Tesla", None, "of", "Apple"])
+    assert entities.match("Tesla and Apple") == ["Tesla", "Apple"]
+    assert entities._pending == {"tesla": "Tesla"}
+
+
+def test_refresh_keeps_added_names(entities):
+    entities.match("warm up")
+    entities.add(["Tesla"])
+    entities.refresh()
+    assert entities.match("tesla") == ["Tesla"]
+
+
+def test_stop_words_are_not_indexed(monkeypatch):
+    rows = [{"name": "The Company"}, {"name": "Who"}]
+    monkeypatch.setattr(gazetteer, "read_query", lambda query, params: rows)
+    assert EntityGazetteer().match("who is the company") == []
+
+
+def test_fuzzy_match(entities):
+    assert entities.fuzzy_match("latest on Bank of Amerika") == ["Bank of America"]
+    assert entities.fuzzy_match("something else entirely") == []
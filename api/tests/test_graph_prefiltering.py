@@ -0,0 +1,67 @@
+import asyncio
+
+import graph_prefiltering
+from graph_prefiltering import (
+    EXACT_SCAN_THRESHOLD,
+    MAX_INDEX_CANDIDATES,
+    aget_organization_news,
+    build_filters,
+    get_organization_news,
+    pick_vector_strategy,
+)
+
+
+def test_selective_filters_are_scanned_exactly():
+    counts = {"filtered": EXACT_SCAN_THRESHOLD, "total": 10**6}
+    assert pick_vector_strategy(counts, k=5) == ("exact", EXACT_SCAN_THRESHOLD)
+
+
+def test_empty_database_is_scanned_exactly():
+    assert pick_vector_strategy({"filtered": None, "total": None}, k=5) == (
+        "exact",
+        0,
+    )
+
+
+def test_index_candidates_scale_with_selectivity():
+    counts = {"filtered": 100_000, "total": 1_000_000}
+    assert pick_vector_strategy(counts, k=5) == ("index", 100)
+
+
+def test_index_candidates_are_bounded():
+    counts = {"filtered": EXACT_SCAN_THRESHOLD + 1, "total": 10**9}
+    assert pick_vector_strategy(counts, k=5) == ("index", MAX_INDEX_CANDIDATES)
+
+
+def test_filters():
+    match, where, params = build_filters("Neo4j Inc", "negative")
+    assert match.startswith("MATCH (:`__Entity__`:Organization {name: $organization})")
+    assert match.endswith("WHERE a.sentiment_bucket = $sentiment_bucket")
+    assert "a.sentiment_bucket = $sentiment_bucket" in where
+    assert params == {
+        "k": 5,
+        "organization": "Neo4j Inc",
+        "sentiment_bucket": "negative",
+    }
+
+
+def test_without_filters():
+    assert build_filters(None, None) == ("MATCH (a:Article)", "true", {"k": 5})
+
+
+def test_unknown_organization(monkeypatch):
+    async def aget_candidates(input):
+        return []
+
+    monkeypatch.setattr(graph_prefiltering, "get_candidates", lambda input: [])
+    monkeypatch.setattr(graph_prefiltering, "aget_candidates", aget_candidates)
+    assert "no organization named Acme" in get_organization_news(organization="Acme")
+    assert "no organization named Acme" in asyncio.run(
+        aget_organization_news(organization="Acme")
+    )
+
+
+def test_ambiguous_organization_asks_to_follow_up(monkeypatch):
+    candidates = ["Neo4j Inc", "Neo4j Labs"]
+    monkeypatch.setattr(graph_prefiltering, "get_candidates", lambda input: candidates)
+    assert "Available options" in get_organization_news(organization="Neo4j")
@@ -0,0 +1,46 @@
+from importing import _new_chunks, chunk_ids, split_article
+
+
+class WordSplitter:
+    """Splits on whitespace, so the tests don't need the tokenizer files"""
+
+    def split(self, text):
+        return text.split()
+
+
+def test_chunk_ids_are_stable():
+    texts = ["first chunk", "second chunk"]
+    assert chunk_ids("a1", texts) == chunk_ids("a1", list(texts))
+    assert all(el.startswith("a1-") for el in chunk_ids("a1", texts))
+
+
+def test_chunk_ids_depend_on_text_only():
+    before = chunk_ids("a1", ["intro", "body", "outro"])
+    after = chunk_ids("a1", ["new intro", "body", "outro"])
+    assert before[0] != after[0]
+    assert before[1:] == after[1:]
+
+
+def test_chunk_ids_are_scoped_to_the_article():
+    assert chunk_ids("a1", ["text"]) != chunk_ids("a2", ["text"])
+
+
+def test_repeated_texts_are_numbered():
+    ids = chunk_ids("a1", ["same", "other", "same", "same"])
+    assert len(set(ids)) == 4
+    assert ids[2] == ids[0] + "-2"
+    assert ids[3] == ids[0] + "-3"
+
+
+def test_split_article():
+    chunks = split_article("a1", "one two", WordSplitter())
+    assert chunks == [
+        {"text": "one", "index": chunk_ids("a1", ["one"])[0], "position": 0},
+        {"text": "two", "index": chunk_ids("a1", ["one", "two"])[1], "position": 1},
+    ]
+
+
+def test_new_chunks_skips_stored_chunks():
+    chunks = split_article("a1", "one two three", WordSplitter())
+    existing = [{"id": chunks[1]["index"]}]
+    assert _new_chunks(chunks, existing) == [chunks[0], chunks[2]]
@@ -0,0 +1,79 @@
+import local_index
+import numpy as np
+import pytest
+from local_index import _kmeans, _normalize, _Snapshot
+
+
+def snapshot(vectors, centroids=None, deleted=None):
+    vectors = _normalize(np.asarray(vectors, dtype=np.float32))
+    if centroids is None:
+        assignments = np.zeros(len(vectors), dtype=np.int64)
+    else:
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+    ids = [f"c{i}" for i in range(len(vectors))]
+    return _Snapshot(ids, vectors, centroids, assignments, deleted)
+
+
+def query(*values):
+    return _normalize(np.asarray([values], dtype=np.float32))[0]
+
+
+def test_normalize_keeps_zero_vectors():
+    normalized = _normalize(np.array([[3.0, 4.0], [0.0, 0.0]]))
+    assert np.allclose(normalized, [[0.6, 0.8], [0.0, 0.0]])
+
+
+def test_search_ranks_by_cosine_similarity():
+    index = snapshot([[1, 0], [0, 1], [1, 1], [-1, 0]])
+    result = index.search(query(1, 0.1), k=3)
+    assert [row for row, score in result] == [0, 2, 1]
+    assert result[0][1] == pytest.approx(float(query(1, 0.1)[0]))
+
+
+def test_search_returns_at_most_the_index_size():
+    index = snapshot([[1, 0], [0, 1]])
+    assert len(index.search(query(1, 0), k=10)) == 2
+
+
+@pytest.mark.parametrize("k", [0, -1])
+def test_search_without_results(k):
+    assert snapshot([[1, 0]]).search(query(1, 0), k=k) == []
+
+
+def test_search_of_empty_index():
+    empty = _Snapshot([], np.zeros((0, 2), dtype=np.float32), None, np.zeros(0))
+    assert empty.search(query(1, 0), k=3) == []
+
+
+def test_deleted_rows_rank_below_negative_scores():
+    deleted = np.array([True, False, False])
+    index = snapshot([[1, 0], [0, 1], [-1, 0]], deleted=deleted)
+    result = index.search(query(1, 0), k=3)
+    assert [row for row, score in result] == [1, 2]
+    assert result[1][1] < 0
+
+
+def test_ivf_search_probes_closest_lists(monkeypatch):
+    monkeypatch.setattr(local_index, "BRUTE_FORCE_LIMIT", 0)
+    monkeypatch.setattr(local_index, "NPROBE", 1)
+    centroids = _normalize(np.array([[1, 0], [-1, 0]], dtype=np.float32))
+    index = snapshot([[1, 0.1], [1, -0.2], [-1, 0.1], [-1, 0]], centroids)
+    result = index.search(query(1, 0), k=4)
+    assert [row for row, score in result] == [0, 1]
+
+
+def test_kmeans_separates_clusters():
+    rng = np.random.default_rng(0)
+    vectors = _normalize(
+        np.concatenate(
+            [
+                rng.normal([5, 0, 0], 0.1, (50, 3)),
+                rng.normal([0, 5, 0], 0.1, (50, 3)),
+            ]
+        )
+    )
+    centroids = _kmeans(vectors, 2)
+    assignments = np.argmax(vectors @ centroids.T, axis=1)
+    assert len(set(assignments[:50])) == 1
+    assert len(set(assignments[50:])) == 1
+    assert assignments[0] != assignments[50]
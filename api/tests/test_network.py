@@ -0,0 +1,17 @@
+import pytest
+from network import etag_matches
+
+ETAG = '"0123456789abcdef"'
+
+
+@pytest.mark.parametrize(
+    "header",
+    [ETAG, f"W/{ETAG}", f'"other", {ETAG}', f' "other" ,W/{ETAG} ', "*"],
+)
+def test_matching_etags(header):
+    assert etag_matches(header, ETAG)
+
+
+@pytest.mark.parametrize("header", [None, "", '"other"', ETAG[:-2] + '"', "W/*"])
+def test_other_etags(header):
+    assert not etag_matches(header, ETAG)
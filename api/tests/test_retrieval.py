@@ -0,0 +1,54 @@
+import pytest
+from langchain_core.documents import Document
+from langchain_core.pydantic_v1 import ValidationError
+from retrieval import MAX_K, RRF_K, RetrievalConfig, reciprocal_rank_fusion
+
+
+def doc(id, text=None):
+    return Document(page_content=text or f"text of {id}", metadata={"id": id})
+
+
+def ranking(result):
+    return [el.metadata.get("id") or el.page_content for el, _ in result]
+
+
+def test_fusion_sums_reciprocal_ranks():
+    result = reciprocal_rank_fusion([[doc("a"), doc("b")], [doc("b"), doc("c")]], k=3)
+    assert ranking(result) == ["b", "a", "c"]
+    scores = dict(zip(ranking(result), (score for _, score in result)))
+    assert scores["b"] == pytest.approx(1 / (RRF_K + 2) + 1 / (RRF_K + 1))
+    assert scores["a"] == pytest.approx(1 / (RRF_K + 1))
+    assert scores["c"] == pytest.approx(1 / (RRF_K + 2))
+
+
+def test_fusion_keeps_top_k():
+    result = reciprocal_rank_fusion([[doc("a"), doc("b"), doc("c")]], k=2)
+    assert ranking(result) == ["a", "b"]
+
+
+def test_fusion_keeps_first_document_of_each_id():
+    first = doc("a", "vector result")
+    result = reciprocal_rank_fusion([[first], [doc("a", "keyword result")]], k=1)
+    assert result[0][0] is first
+
+
+def test_fusion_falls_back_to_text_without_id():
+    plain = Document(page_content="same text")
+    result = reciprocal_rank_fusion([[plain], [Document(page_content="same text")]], 5)
+    assert ranking(result) == ["same text"]
+
+
+def test_fusion_of_empty_lists():
+    assert reciprocal_rank_fusion([[], []], k=4) == []
+
+
+@pytest.mark.parametrize("params", [{"k": 0}, {"k": MAX_K + 1}, {"token_budget": 0}])
+def test_config_rejects_out_of_range_values(params):
+    with pytest.raises(ValidationError):
+        RetrievalConfig(**params)
+
+
+def test_config_defaults():
+    config = RetrievalConfig()
+    assert config.k == 4
+    assert config.fusion == "max"